@@ -0,0 +1,96 @@
+"""
+Class for recording a few parameters of one TEC channel at the maximum rate the serial bus allows.
+"""
+
+from datetime import datetime
+from time import time
+import numpy as np
+import pandas as pd
+
+from app.queries import COMMAND_TABLE
+
+# parameters recorded when none are specified
+DEFAULT_BURST_PARAMETERS = ["object temperature", "output current"]
+
+# longest allowed burst capture (in seconds)
+MAX_BURST_DURATION = 120
+
+# initial number of samples preallocated per second of capture, the buffer grows if needed
+_PREALLOCATED_RATE = 100
+
+
+class BurstCapture:
+    """
+    Records parameters of one TEC into a compact columnar buffer (int64 timestamps, float32 values)
+    by querying them back to back for a fixed duration.
+    """
+
+    def __init__(self, tec, parameters=DEFAULT_BURST_PARAMETERS, duration=10):
+        """
+        Args:
+            tec (TECController): the TEC to record.
+            parameters (list of str): parameters from the COMMAND_TABLE to record.
+            duration (float): duration of the capture in seconds.
+        """
+        assert 0 < duration <= MAX_BURST_DURATION
+        for parameter in parameters:
+            assert parameter in COMMAND_TABLE, f"Unknown parameter {parameter}"
+
+        self.tec = tec
+        self.parameters = list(parameters)
+        self.duration = duration
+
+        # preallocated buffer
+        capacity = max(1, int(duration * _PREALLOCATED_RATE))
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._values = np.zeros((capacity, len(self.parameters)), dtype=np.float32)
+        self._num_samples = 0
+
+    def run(self):
+        """
+        Records until the duration has passed. Blocks the calling thread.
+
+        Returns:
+            pd.DataFrame: one row per sample with a timestamp column (ms since epoch) and one column per parameter.
+        """
+        time_end = time() + self.duration
+
+        while time() < time_end:
+            if self._num_samples == len(self._timestamps):
+                self._grow()
+
+            row = self._num_samples
+            self._timestamps[row] = int(datetime.now().timestamp() * 1000)
+            for i, parameter in enumerate(self.parameters):
+                self._values[row, i] = self.tec.get_value(parameter)
+            self._num_samples += 1
+
+        return self.to_dataframe()
+
+    def get_rate(self):
+        """
+        Returns the achieved sampling rate in Hz.
+        """
+        if self._num_samples < 2:
+            return 0.0
+        time_span = (self._timestamps[self._num_samples - 1] - self._timestamps[0]) / 1000
+        return (self._num_samples - 1) / time_span if time_span > 0 else 0.0
+
+    def to_dataframe(self):
+        """
+        Returns the recorded samples as a dataframe.
+        """
+        df = pd.DataFrame(
+            self._values[: self._num_samples].copy(), columns=self.parameters
+        )
+        df.insert(0, "timestamp", self._timestamps[: self._num_samples].copy())
+        return df
+
+    def _grow(self):
+        """
+        Doubles the capacity of the buffer.
+        """
+        self._timestamps = np.concatenate(
+            [self._timestamps, np.zeros_like(self._timestamps)]
+        )
+        self._values = np.concatenate([self._values, np.zeros_like(self._values)])
@@ -0,0 +1,210 @@
+"""
+Defines the compact schema and the layouts of the stored measurements.
+
+Measurements are acquired in the long layout (one row per TEC with a (Plate, TEC) multiindex)
+and stored in the wide layout (one row per measurement with one column per TEC and parameter).
+"""
+
+import numpy as np
+import pandas as pd
+
+# plates in the fixed order of a measurement, stored dictionary-encoded
+PLATES = ["top", "external", "bottom"]
+
+# dtype of every column of a measurement
+MEASUREMENT_DTYPES = {
+    "loop status": "int8",
+    "object temperature": "float32",
+    "target object temperature": "float32",
+    "output current": "float32",
+    "output voltage": "float32",
+    "output power": "float32",
+    "sample status": "int8",
+    "sample rate": "float32",
+    "timestamp": "int64",  # ms since epoch
+}
+
+# dtype of the TEC index level
+TEC_DTYPE = "uint8"
+
+# status flags for the TECs of a measurement
+SAMPLE_OK = 0
+SAMPLE_OFFLINE = 1  # TEC could not be reached, values are NaN
+SAMPLE_BURST = 2  # port is busy with a burst capture, values are NaN
+
+# loop status stored for TECs that could not be reached
+LOOP_STATUS_MISSING = -1
+
+# columns with one value per measurement instead of one value per TEC
+TICK_COLUMNS = ["timestamp", "sample rate"]
+
+
+def measurement_index(plates, tec_ids):
+    """
+    Returns a (Plate, TEC) multiindex with a categorical Plate and uint8 TEC level.
+    """
+    return pd.MultiIndex.from_arrays(
+        [
+            pd.Categorical(plates, categories=PLATES),
+            pd.Index(tec_ids).astype(TEC_DTYPE),
+        ],
+        names=["Plate", "TEC"],
+    )
+
+
+def _has_compact_index(df):
+    plate = df.index.get_level_values("Plate")
+    tec = df.index.get_level_values("TEC")
+    return (
+        isinstance(plate.dtype, pd.CategoricalDtype)
+        and list(plate.dtype.categories) == PLATES
+        and tec.dtype == TEC_DTYPE
+    )
+
+
+def apply_schema(df):
+    """
+    Returns the measurements (long or wide layout) converted to the compact schema.
+    Returns the dataframe unchanged if it already follows the schema, so this is cheap for new measurements.
+    Also migrates measurements stored with the previous dtypes (float64, int64 and object strings).
+    """
+    dtypes = {}
+    for column in df.columns:
+        parsed = parse_wide_column(column)
+        dtype = MEASUREMENT_DTYPES.get(column if parsed is None else parsed[0])
+        if dtype is not None and df[column].dtype != dtype:
+            dtypes[column] = dtype
+    if dtypes:
+        df = df.astype(dtypes)
+
+    if list(df.index.names) == ["Plate", "TEC"] and not _has_compact_index(df):
+        df = df.set_axis(
+            measurement_index(
+                df.index.get_level_values("Plate").astype(str),
+                df.index.get_level_values("TEC"),
+            ),
+            axis=0,
+        )
+
+    return df
+
+
+def wide_column(parameter, plate, tec_id):
+    """
+    Returns the name of the column of one parameter of one TEC in the wide layout, e.g. "object temperature_top_0".
+    """
+    return f"{parameter}_{plate}_{tec_id}"
+
+
+def parse_wide_column(column):
+    """
+    Returns (parameter, plate, tec_id) of a column in the wide layout or None for other columns (e.g. the TICK_COLUMNS).
+    """
+    parts = column.rsplit("_", 2)
+    if column in TICK_COLUMNS or len(parts) != 3 or not parts[2].isdigit():
+        return None
+    parameter, plate, tec_id = parts
+    return parameter, plate, int(tec_id)
+
+
+def wide_columns(df, parameter, plates=None, tec_ids=None):
+    """
+    Returns the columns of a parameter in a dataframe in the wide layout.
+
+    Args:
+        df (pd.DataFrame): data in the wide layout.
+        parameter (str): parameter, e.g. "object temperature".
+        plates (list of str): only return columns of these plates, all if None.
+        tec_ids (list of int): only return columns of these TECs, all if None.
+    """
+    columns = []
+    for column in df.columns:
+        parsed = parse_wide_column(column)
+        if parsed is None or parsed[0] != parameter:
+            continue
+        if plates is not None and parsed[1] not in plates:
+            continue
+        if tec_ids is not None and parsed[2] not in tec_ids:
+            continue
+        columns.append(column)
+    return columns
+
+
+def to_wide(df):
+    """
+    Converts measurements in the long layout to the wide layout with one row per timestamp.
+    Data in the wide layout is returned unchanged.
+    """
+    if df.empty or list(df.index.names) != ["Plate", "TEC"]:
+        return df
+
+    timestamps = df["timestamp"].to_numpy()
+    num_ticks = len(np.unique(timestamps))
+    num_tecs = len(df) // num_ticks
+    labels = df.index[:num_tecs]
+
+    # measurements of the acquisition always contain the same TECs in the same order,
+    # so every column can simply be reshaped
+    if num_tecs * num_ticks == len(df) and df.index.equals(
+        labels[np.tile(np.arange(num_tecs), num_ticks)]
+    ):
+        columns = {}
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if column in TICK_COLUMNS:
+                columns[column] = values[::num_tecs]
+                continue
+            values = values.reshape(num_ticks, num_tecs)
+            for i, (plate, tec_id) in enumerate(labels):
+                columns[wide_column(column, plate, tec_id)] = values[:, i]
+        return pd.DataFrame(columns)
+
+    # otherwise (e.g. sessions of older versions) align the TECs by their labels
+    long = df.reset_index()
+    long["Plate"] = long["Plate"].astype(str)
+    tec_columns = [column for column in df.columns if column not in TICK_COLUMNS]
+    wide = long.pivot(index="timestamp", columns=["Plate", "TEC"], values=tec_columns)
+    wide.columns = [wide_column(*column) for column in wide.columns]
+    # TECs missing in a measurement count as offline
+    wide = wide.fillna(
+        {column: LOOP_STATUS_MISSING for column in wide_columns(wide, "loop status")}
+        | {column: SAMPLE_OFFLINE for column in wide_columns(wide, "sample status")}
+    )
+    tick_columns = [
+        column for column in TICK_COLUMNS if column in df.columns and column != "timestamp"
+    ]
+    wide = long.groupby("timestamp")[tick_columns].first().join(wide)
+    return wide.reset_index()
+
+
+def to_long(df):
+    """
+    Converts measurements in the wide layout to the long layout with a (Plate, TEC) multiindex in the compact schema.
+    """
+    # parameters and TECs in the order of the columns
+    order = []
+    labels = []
+    for column in df.columns:
+        parsed = parse_wide_column(column)
+        if parsed is None and column not in TICK_COLUMNS:
+            # values derived from all TECs (e.g. the tick aggregates) have no place in the long layout
+            continue
+        name = column if parsed is None else parsed[0]
+        if name not in order:
+            order.append(name)
+        if parsed is not None and parsed[1:] not in labels:
+            labels.append(parsed[1:])
+
+    columns = {}
+    for name in order:
+        if name in TICK_COLUMNS:
+            columns[name] = np.repeat(df[name].to_numpy(), len(labels))
+        else:
+            names = [wide_column(name, plate, tec_id) for plate, tec_id in labels]
+            columns[name] = df.reindex(columns=names).to_numpy().ravel()
+
+    index = measurement_index(
+        np.tile([plate for plate, _ in labels], len(df)),
+        np.tile([tec_id for _, tec_id in labels], len(df)),
+    )
+    return apply_schema(pd.DataFrame(columns, index=index))
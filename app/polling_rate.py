@@ -0,0 +1,148 @@
+"""
+Class for adapting the sampling rate of the data acquisition to the live state of the TECs.
+"""
+
+from time import time
+import numpy as np
+
+# bounds for the sampling rate (in Hz)
+MIN_SAMPLE_RATE = 0.2
+MAX_SAMPLE_RATE = 2.0
+
+# rate used when the TECs are neither holding a stable temperature nor ramping (in Hz)
+DEFAULT_SAMPLE_RATE = 1.0
+
+# a temperature change faster than this counts as a ramp and is sampled at the max rate (in °C/s)
+RAMP_SLOPE = 0.05
+
+# keep sampling at the max rate for this long after a UI command was handled (in seconds)
+COMMAND_BOOST_DURATION = 30
+
+# when the target rate drops, lower the rate by this factor per tick instead of dropping at once
+RATE_DECAY = 0.8
+
+# loop status reported by the TECs when the temperature is stable
+LOOP_STATUS_STABLE = 2
+
+
+class PollingRateController:
+    """
+    Determines the sampling rate from the loop status, the rate of temperature change and pending commands.
+    """
+
+    def __init__(
+        self,
+        min_rate=MIN_SAMPLE_RATE,
+        max_rate=MAX_SAMPLE_RATE,
+        default_rate=DEFAULT_SAMPLE_RATE,
+    ):
+        """
+        Args:
+            min_rate (float): lowest sampling rate in Hz, used during long holds.
+            max_rate (float): highest sampling rate in Hz, used during transitions.
+            default_rate (float): sampling rate in Hz for all other states.
+        """
+        assert 0 < min_rate <= default_rate <= max_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.default_rate = default_rate
+
+        # rate currently in effect
+        self.rate = default_rate
+
+        # object temperatures, TEC labels and timestamp (in ms) of the previous measurement
+        self._last_temps = None
+        self._last_tecs = None
+        self._last_timestamp = None
+
+        # time when the last UI command was handled
+        self._last_command_time = -1
+
+    def get_interval(self):
+        """
+        Returns the time between two samples (in seconds) for the current rate.
+        """
+        return 1 / self.rate
+
+    def notify_command(self):
+        """
+        Informs the controller that a UI command was handled. The next samples will be taken at the max rate.
+        May be called from the command listener thread.
+        """
+        self._last_command_time = time()
+
+    def update(self, sample):
+        """
+        Updates the sampling rate based on the most recent measurement.
+
+        Args:
+            sample (SampleBuffer): most recent measurement of all TECs.
+
+        Returns:
+            float: the new sampling rate in Hz.
+        """
+        target_rate = self._get_target_rate(sample)
+
+        # speed up immediately, slow down gradually
+        if target_rate >= self.rate:
+            self.rate = target_rate
+        else:
+            self.rate = max(target_rate, self.rate * RATE_DECAY)
+
+        return self.rate
+
+    def _get_target_rate(self, sample):
+        """
+        Returns the rate the controller should move towards.
+        """
+        slope = self._get_max_slope(sample)
+
+        # commands will change the state of the TECs, so watch closely
+        if time() - self._last_command_time <= COMMAND_BOOST_DURATION:
+            return self.max_rate
+
+        if sample is None or len(sample.tecs) == 0:
+            return self.default_rate
+
+        # ramps are sampled at the max rate
+        if slope is not None and slope >= RAMP_SLOPE:
+            return self.max_rate
+
+        # all TECs (external sensors do not regulate) hold a stable temperature
+        # missing TECs have no loop status (NaN), so they are not stable
+        if "loop status" in sample.columns:
+            regulating = [plate != "external" for plate, _ in sample.tecs]
+            loop_status = sample.column("loop status")[regulating]
+            if len(loop_status) > 0 and (loop_status == LOOP_STATUS_STABLE).all():
+                return self.min_rate
+
+        return self.default_rate
+
+    def _get_max_slope(self, sample):
+        """
+        Returns the highest absolute rate of temperature change (in °C/s) of any TEC
+        since the previous measurement or None if it cannot be determined.
+        Missing values are skipped, the result is NaN if no TEC has two values.
+        """
+        if sample is None or len(sample.tecs) == 0 or "object temperature" not in sample.columns:
+            return None
+
+        # the buffer is reused for the next measurement
+        temps = sample.column("object temperature").copy()
+        timestamp = sample.timestamp
+
+        slope = None
+        if (
+            self._last_temps is not None
+            and self._last_timestamp is not None
+            and timestamp > self._last_timestamp
+            and sample.tecs == self._last_tecs
+        ):
+            time_delta = (timestamp - self._last_timestamp) / 1000
+            slope = float(np.fmax.reduce(np.abs(temps - self._last_temps) / time_delta))
+
+        self._last_temps = temps
+        self._last_tecs = sample.tecs
+        self._last_timestamp = timestamp
+
+        return slope
@@ -0,0 +1,196 @@
+"""
+Class for holding one measurement of all TECs in preallocated NumPy arrays.
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from app.measurement_schema import (
+    LOOP_STATUS_MISSING,
+    MEASUREMENT_DTYPES,
+    SAMPLE_BURST,
+    SAMPLE_OFFLINE,
+    SAMPLE_OK,
+    TICK_COLUMNS,
+    measurement_index,
+    wide_column,
+)
+from app.queries import DEFAULT_QUERIES
+from app.tick_aggregates import TICK_AGGREGATES
+
+
+class SampleBuffer:
+    """
+    Columnar buffer for one measurement (tick) of all TECs.
+    Rows follow a fixed TEC ordering and columns follow the queries, so acquisition
+    can write values in place. A DataFrame is only built when a consumer asks for one.
+    """
+
+    # columns computed from the queried values
+    COMPUTED_COLUMNS = ["output power"]
+
+    def __init__(self, tecs, queries=DEFAULT_QUERIES):
+        """
+        Args:
+            tecs (list of (str, int)): (Plate, TEC) labels in the order the rows are filled.
+            queries (list of str): queried parameters in the order the columns are filled.
+        """
+        self.tecs = list(tecs)
+        self.queries = list(queries)
+        self.columns = self.queries + self.COMPUTED_COLUMNS
+        self._column_ids = {column: i for i, column in enumerate(self.columns)}
+
+        # one row per TEC, one column per parameter
+        # the TECs report 32 bit floats, so float32 does not lose precision
+        self.values = np.full(
+            (len(self.tecs), len(self.columns)), np.nan, dtype=np.float32
+        )
+
+        # status flag per TEC
+        self.status = np.full(len(self.tecs), SAMPLE_OK, dtype=np.int8)
+
+        # timestamp of the measurement (ms since epoch)
+        self.timestamp = None
+
+        # the index is the same for every measurement
+        self._index = measurement_index(
+            [plate for plate, _ in self.tecs], [tec_id for _, tec_id in self.tecs]
+        )
+
+        # fixed column order of the wide layout (see to_wide): every parameter and the status for all TECs,
+        # followed by the tick columns and the tick aggregates
+        self.wide_columns = [
+            wide_column(column, plate, tec_id)
+            for column in self.columns + ["sample status"]
+            for plate, tec_id in self.tecs
+        ] + TICK_COLUMNS
+        # tick aggregates: column -> (column of the parameter, rows of the TECs, function)
+        self._aggregates = {}
+        for column, (parameter, plates, function) in TICK_AGGREGATES.items():
+            if parameter in self._column_ids:
+                rows = [row for row, (plate, _) in enumerate(self.tecs) if plate in plates]
+                self._aggregates[column] = (self._column_ids[parameter], rows, function)
+                self.wide_columns.append(column)
+
+        # Arrow schema of the wide layout, created with the first measurement
+        self._wide_schema = None
+
+        # lazily built DataFrame of the current measurement
+        self._df = None
+
+    def row(self, tec_row):
+        """
+        Returns a writable view on the queried values of one TEC.
+        """
+        return self.values[tec_row, : len(self.queries)]
+
+    def set_missing(self, tec_row, status=SAMPLE_OFFLINE):
+        """
+        Marks the values of one TEC as missing for this measurement.
+        """
+        self.values[tec_row, :] = np.nan
+        self.status[tec_row] = status
+
+    def column(self, column):
+        """
+        Returns a view on one column for all TECs.
+        """
+        return self.values[:, self._column_ids[column]]
+
+    def finish(self):
+        """
+        Completes the measurement after all rows were written:
+        computes the derived columns and sets the timestamp.
+        """
+        # power for all TECs at once
+        if "output current" in self._column_ids and "output voltage" in self._column_ids:
+            np.abs(
+                self.column("output current") * self.column("output voltage"),
+                out=self.column("output power"),
+            )
+
+        # timestamp (ms since last epoch)
+        self.timestamp = int(datetime.now().timestamp() * 1000)
+
+        # the previous DataFrame is outdated now
+        self._df = None
+
+    def wide_values(self, sample_rate):
+        """
+        Returns the measurement as one row in the wide layout in the compact schema, including the tick aggregates.
+        The values are written by indexing the buffer in the fixed order of wide_columns,
+        the aggregates are reduced over the rows of their TECs.
+
+        Args:
+            sample_rate (float): rate the measurement was taken at (in Hz).
+
+        Returns:
+            list of np.ndarray: one array with one value per column of wide_columns.
+        """
+        num_tecs = len(self.tecs)
+
+        # parameter by parameter, every parameter for all TECs
+        values = self.values.T.ravel()
+        columns = [values[i : i + 1] for i in range(len(values))]
+        if "loop status" in self._column_ids:
+            start = self._column_ids["loop status"] * num_tecs
+            loop_status = values[start : start + num_tecs]
+            loop_status = np.where(np.isnan(loop_status), LOOP_STATUS_MISSING, loop_status).astype(
+                MEASUREMENT_DTYPES["loop status"]
+            )
+            columns[start : start + num_tecs] = [loop_status[i : i + 1] for i in range(num_tecs)]
+
+        columns += [self.status[i : i + 1].copy() for i in range(num_tecs)]
+        columns.append(np.array([self.timestamp], dtype=MEASUREMENT_DTYPES["timestamp"]))
+        columns.append(np.array([sample_rate], dtype=MEASUREMENT_DTYPES["sample rate"]))
+
+        for column_id, rows, function in self._aggregates.values():
+            tec_values = self.values[rows, column_id][np.newaxis, :]
+            columns.append(function(tec_values).astype(np.float32, copy=False))
+        return columns
+
+    def to_wide_table(self, sample_rate):
+        """
+        Returns the measurement as an Arrow table with one row in the wide layout (see wide_values),
+        which is what the store keeps, without building a dataframe.
+        """
+        columns = self.wide_values(sample_rate)
+        if self._wide_schema is None:
+            self._wide_schema = pa.schema(
+                [
+                    (column, pa.from_numpy_dtype(values.dtype))
+                    for column, values in zip(self.wide_columns, columns)
+                ]
+            )
+        return pa.Table.from_arrays(
+            [pa.array(values) for values in columns], schema=self._wide_schema
+        )
+
+    def to_wide(self, sample_rate):
+        """
+        Returns the measurement as a dataframe with one row in the wide layout (see wide_values).
+        """
+        return pd.DataFrame(dict(zip(self.wide_columns, self.wide_values(sample_rate))))
+
+    def to_dataframe(self):
+        """
+        Returns the measurement as a dataframe with a (Plate, TEC) multiindex in the compact schema.
+        The dataframe is built once per measurement and does not share memory with the buffer.
+        Missing TECs have NaN values, LOOP_STATUS_MISSING as loop status and their flag in "sample status".
+        """
+        if self._df is None:
+            df = pd.DataFrame(self.values.copy(), index=self._index, columns=self.columns)
+            if "loop status" in self._column_ids:
+                df["loop status"] = (
+                    df["loop status"]
+                    .fillna(LOOP_STATUS_MISSING)
+                    .astype(MEASUREMENT_DTYPES["loop status"])
+                )
+            df["sample status"] = self.status.copy()
+            df["timestamp"] = np.full(
+                len(df), self.timestamp, dtype=MEASUREMENT_DTYPES["timestamp"]
+            )
+            self._df = df
+        return self._df
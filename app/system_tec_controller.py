@@ -1,10 +1,20 @@
+import logging
+from threading import Lock, Thread
+from time import sleep
+from mecom import ResponseException, WrongChecksum
+from serial.serialutil import SerialException
+from app.burst_capture import BurstCapture
 from app.plate_tec_controller import PlateTECController
+from app.sample_buffer import SAMPLE_BURST, SAMPLE_OK, SampleBuffer
 from app.serial_ports import PORTS
-import pandas as pd
-from datetime import datetime
 
 from app.tec_controller import TECController
 
+# delays between reconnection attempts to an offline port (in seconds)
+# the delay is doubled after every failed attempt
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
+
 
 class SystemTECController:
     """
@@ -20,6 +30,33 @@ class SystemTECController:
         if ports_external:
             self.external_tecs = self._connect_external_tecs(ports_external)
 
+        # fixed ordering of all TECs in a measurement:
+        # Plate in reverse alphabetical order (top, external, bottom), then TEC ascendingly
+        self._tecs = [(("top", tec_id), tec) for tec_id, tec in top.tec_controllers.items()]
+        if hasattr(self, "external_tecs"):
+            self._tecs += [
+                (("external", tec_id), tec)
+                for tec_id, tec in enumerate(self.external_tecs.values())
+            ]
+        self._tecs += [
+            (("bottom", tec_id), tec) for tec_id, tec in bottom.tec_controllers.items()
+        ]
+
+        # preallocated buffer that every measurement is written into
+        self._buffer = SampleBuffer([label for label, _ in self._tecs])
+
+        # rows of the buffer per serial port (both channels of a board share one port)
+        self._port_rows = {}
+        for row, (_, tec) in enumerate(self._tecs):
+            self._port_rows.setdefault(tec.port, []).append(row)
+
+        # ports that are currently reconnecting in the background
+        self._offline_ports = set()
+        self._port_state_lock = Lock()
+
+        # ports that are currently dedicated to a burst capture
+        self._burst_ports = set()
+
     def set_temp(self, plate, temp):
         """Sets the temperature for a plate.
         Only to be used in Temperature Control mode.
@@ -74,52 +111,134 @@ class SystemTECController:
         self.enable("top")
         self.enable("bottom")
 
+    def get_sample(self):
+        """
+        Queries all TECs and returns the measurement as a SampleBuffer.
+        TECs on ports that fail, are reconnecting or run a burst capture are marked as missing,
+        the other ports are sampled normally.
+        The buffer is reused for the next measurement.
+        """
+        for port, rows in self._port_rows.items():
+            # the bus time of this port belongs to a burst capture
+            if port in self._burst_ports:
+                for row in rows:
+                    self._buffer.set_missing(row, SAMPLE_BURST)
+                continue
+
+            if self.is_port_online(port):
+                try:
+                    for row in rows:
+                        self._tecs[row][1].read_into(self._buffer.row(row))
+                        self._buffer.status[row] = SAMPLE_OK
+                except (ResponseException, WrongChecksum, SerialException) as ex:
+                    logging.warning(f"port {port} is offline: {ex}")
+                    self._start_reconnect(port)
+
+            if not self.is_port_online(port):
+                for row in rows:
+                    self._buffer.set_missing(row)
+
+        # add power column and timestamp
+        self._buffer.finish()
+
+        return self._buffer
+
     def get_data(self):
         """
         Returns a dataframe with all the data for all TECs.
         """
-        # Get data of TECs
-        data = {}
-        for label, controller in self.controllers.items():
-            data[label] = controller.get_data()
-            
-        frames = []
-        for plate, plate_data in data.items():
-            for tec_id, tec_data in plate_data.items():
-                df = pd.DataFrame([tec_data])
-                df['TEC'] = tec_id
-                df['Plate'] = plate
-                frames.append(df)
-                
-        # add data of external TECs
-        if hasattr(self, "external_tecs"):
-            data_ext = {}
-            for i, (label, tec) in enumerate(self.external_tecs.items()):
-                data_ext[i] = tec.get_data()
-            
-            for tec_id, tec_data in data_ext.items():
-                df = pd.DataFrame([tec_data])
-                df['TEC'] = tec_id
-                df['Plate'] = "external"
-                frames.append(df)    
-
-        # Concatenate all small DataFrames and set multi-index
-        df = pd.concat(frames).set_index(['Plate', 'TEC']).sort_index()
-        
-        # sort the df by 'Plate' reverse alphabetical order and then by 'TEC' ascendingly
-        df = df.sort_values(by=['Plate', 'TEC'], ascending=[False, True])
-        
-        # add power column
-        df["output power"] = (df["output current"] * df["output voltage"]).abs()
-        
-        # add timestamps (ms since last epoch)
-        df["timestamp"] = int(datetime.now().timestamp() * 1000) 
-            
-        return df
+        return self.get_sample().to_dataframe()
 
     def get_temps_avg(self, plate):
         assert plate in ["top", "bottom"]
-        
+
+    def start_burst(self, plate, tec_id, parameters, duration, on_finished):
+        """
+        Records parameters of one TEC at the maximum achievable rate for a fixed duration in a background thread.
+        The port of the TEC is not polled during the capture, all other ports continue normally.
+
+        Args:
+            plate (string): top, bottom or external
+            tec_id (int): id of the TEC on the plate
+            parameters (list of str): parameters from the COMMAND_TABLE to record.
+            duration (float): duration of the capture in seconds.
+            on_finished (callable): called with the BurstCapture (or None and the exception on failure) when done.
+
+        Returns:
+            bool: False if the port is offline or already busy with a burst capture.
+
+        Raises:
+            AssertionError: if the parameters or the duration are invalid.
+        """
+        tec = dict(self._tecs)[(plate, tec_id)]
+        port = tec.port
+        # validates the parameters before the port is reserved
+        capture = BurstCapture(tec, parameters, duration)
+
+        with self._port_state_lock:
+            if port in self._offline_ports or port in self._burst_ports:
+                return False
+            self._burst_ports.add(port)
+
+        def run():
+            try:
+                try:
+                    capture.run()
+                finally:
+                    with self._port_state_lock:
+                        self._burst_ports.discard(port)
+            except (ResponseException, WrongChecksum, SerialException) as ex:
+                logging.warning(f"burst capture on port {port} failed: {ex}")
+                self._start_reconnect(port)
+                on_finished(None, ex)
+                return
+            except Exception as ex:
+                logging.exception(f"burst capture on port {port} failed")
+                on_finished(None, ex)
+                return
+            on_finished(capture, None)
+
+        Thread(target=run, daemon=True).start()
+        return True
+
+    def is_port_online(self, port):
+        """
+        Returns False while the port is reconnecting in the background.
+        """
+        with self._port_state_lock:
+            return port not in self._offline_ports
+
+    def _start_reconnect(self, port):
+        """
+        Marks a port as offline and reconnects its TECs in a background thread.
+        """
+        with self._port_state_lock:
+            if port in self._offline_ports:
+                return
+            self._offline_ports.add(port)
+
+        Thread(target=self._reconnect, args=(port,), daemon=True).start()
+
+    def _reconnect(self, port):
+        """
+        Tries to reconnect all TECs of a port with exponential backoff until it succeeds.
+        """
+        delay = RECONNECT_DELAY_MIN
+        while True:
+            sleep(delay)
+            try:
+                for row in self._port_rows[port]:
+                    self._tecs[row][1].reconnect()
+            except Exception as ex:
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+                logging.info(f"reconnecting to port {port} failed, retrying in {delay}s: {ex}")
+                continue
+
+            logging.info(f"reconnected to port {port}")
+            with self._port_state_lock:
+                self._offline_ports.discard(port)
+            return
+
     def _connect_external_tecs(self, ports):
         controllers = {}
         for i, port in enumerate(ports):
@@ -5,6 +5,7 @@ Class for handling one TEC via one channel of a TEC-1161 board.
 import base64
 import io
 import logging
+from threading import Lock, RLock
 from time import sleep
 from mecom import MeComSerial, ResponseException, WrongChecksum
 import pandas as pd
@@ -24,6 +25,11 @@ class TECController(object):
     # (we need 2 instances of this class per port but only 1 session)
     _sessions = {}
 
+    # one lock per port, held while a session of the port is opened, closed or reconnected,
+    # the reconnect thread and the command listener may both connect the same port
+    _port_locks = {}
+    _port_locks_lock = Lock()
+
     # allow the get_data function to timeout this many times before closing the connection
     _num_timeout_limit = 60
 
@@ -45,6 +51,11 @@ class TECController(object):
         self.scan_timeout = scan_timeout
         self.queries = queries
 
+        # configuration applied to the device, restored on reconnect
+        self._input_selection = None
+        self._general_operating_mode = None
+        self._individual_source = False
+
         self._connect()
 
         self._set_params()
@@ -52,56 +63,116 @@ class TECController(object):
         # we want to run in temperature control mode
         self.set_temperature_control_mode()
 
+    @classmethod
+    def _port_lock(cls, port):
+        """
+        Returns the lock of a port (reentrant, reconnect holds it while connecting).
+        """
+        with cls._port_locks_lock:
+            return cls._port_locks.setdefault(port, RLock())
+
     def _connect(self):
-        # open session or use existing one
-        if self.port in TECController._sessions:
-            self._session = TECController._sessions[self.port]
-        else:
-            self._session = MeComSerial(serialport=self.port)
-            TECController._sessions[self.port] = self._session
-
-        # get device address
-        self.address = self._session.identify()
-        logging.info(
-            "connected to address {} with serialport {} and channel {}".format(
-                self.address, self.port, self.channel
+        with TECController._port_lock(self.port):
+            # open session or use existing one
+            if self.port in TECController._sessions:
+                self._session = TECController._sessions[self.port]
+            else:
+                self._session = MeComSerial(serialport=self.port)
+                TECController._sessions[self.port] = self._session
+
+            # get device address
+            self.address = self._session.identify()
+            logging.info(
+                "connected to address {} with serialport {} and channel {}".format(
+                    self.address, self.port, self.channel
+                )
             )
-        )
 
     def session(self):
         if self._session is None:
             self._connect()
         return self._session
 
-    def get_data(self):
-        data = {}
-        for description in self.queries:
-            id, _ = COMMAND_TABLE[description]
+    def _close_session(self):
+        """
+        Stops the session and removes it from the shared sessions, so the port can be reopened.
+        """
+        with TECController._port_lock(self.port):
+            if self._session is None:
+                return
             try:
+                self._session.stop()
+            except SerialException:
+                pass  # port is already gone
+            if TECController._sessions.get(self.port) is self._session:
+                del TECController._sessions[self.port]
+            self._session = None
+
+    def reconnect(self):
+        """
+        Re-establishes the connection after the device was unreachable and restores its configuration.
+        Reuses a session that was already reopened by the other channel of the same port.
+        Raises the exception of the device if it is still unreachable or the configuration could not be restored.
+        """
+        with TECController._port_lock(self.port):
+            if TECController._sessions.get(self.port) is not self._session:
+                # the session is stale, it was closed or replaced
+                self._session = None
+            self._connect()
 
-                value = self.session().get_parameter(
-                    parameter_id=id,
-                    address=self.address,
-                    parameter_instance=self.channel,
-                )
-                data.update({description: value})
-                self._num_timeout_get_data = 0
+            self._set_params()
 
-            except (ResponseException) as ex:
-                # TEC is offline (e.g., encountered an error) and may currently be restarting.
-                # Instead of stopping the session, throw exception to be handled.
-                raise ex
+            if self._general_operating_mode is not None:
+                self._set_general_operating_mode(self._general_operating_mode)
+            if self._individual_source:
+                self.set_individual_source()
+            if self._input_selection is not None:
+                self._set_input_selection(self._input_selection)
 
-            except (WrongChecksum, SerialException) as ex:
-                # unrecoverable errors
-                self.session().stop()
-                self._session = None
-                raise ex
+    def get_value(self, description):
+        """
+        Queries a single parameter from the COMMAND_TABLE.
+        """
+        id, _ = COMMAND_TABLE[description]
+        try:
+
+            value = self.session().get_parameter(
+                parameter_id=id,
+                address=self.address,
+                parameter_instance=self.channel,
+            )
+            self._num_timeout_get_data = 0
+            return value
+
+        except (ResponseException) as ex:
+            # TEC is offline (e.g., encountered an error) and may currently be restarting.
+            # Instead of stopping the session, throw exception to be handled.
+            raise ex
+
+        except (WrongChecksum, SerialException) as ex:
+            # unrecoverable errors
+            self._close_session()
+            raise ex
+
+    def get_data(self):
+        data = {}
+        for description in self.queries:
+            data.update({description: self.get_value(description)})
         return data
 
+    def read_into(self, values):
+        """
+        Queries all parameters and writes them into a preallocated array,
+        one slot per query in the order of self.queries.
+        """
+        for i, description in enumerate(self.queries):
+            values[i] = self.get_value(description)
+
     def _set_params(self):
         """
         Sets values for certain parameters to prevent damage to components and get optimal behavior.
+        Closes the session and raises the exception of the device if any parameter could not be set,
+        so the TEC is not used with only a part of its limits.
         """
         for description in PARAM_VALUES:
             param_id, unit, value = PARAM_VALUES[description]
@@ -117,8 +188,8 @@ class TECController(object):
                 )
             except (ResponseException, WrongChecksum) as ex:
                 logging.error("ERROR in setting parameter limits. Aborting.")
-                self.session().stop()
-                self._session = None
+                self._close_session()
+                raise ex
 
         # if this is channel 1, set the delay till restart
         if self.channel == 1:
@@ -165,6 +236,7 @@ class TECController(object):
         logging.info(
             "set input selection to {} for channel {}".format(value, self.channel)
         )
+        self._input_selection = value
         return self.session().set_parameter(
             parameter_name="Input Selection",
             value=value,
@@ -199,6 +271,7 @@ class TECController(object):
                 value, self.channel
             )
         )
+        self._general_operating_mode = value
         return self.session().set_parameter(
             parameter_name="General Operating Mode",
             value=value,
@@ -212,6 +285,7 @@ class TECController(object):
         """
         # 0 is CH1 sensor, 2 is CH2 sensor
         value = 0 if self.channel == 1 else 2
+        self._individual_source = True
 
         return self.session().set_parameter(
             parameter_id=6300,
@@ -0,0 +1,118 @@
+"""
+Aggregates over the TECs of a measurement (tick), computed once by the data acquisition.
+
+They are stored as additional columns of the wide layout with one value per measurement,
+e.g. "average object temperature top", so consumers read them instead of aggregating
+the TEC columns on every update. External sensors are not part of the aggregates.
+"""
+
+import numpy as np
+import pandas as pd
+
+from app.measurement_schema import wide_columns
+
+# plates the aggregates are computed over
+AGGREGATE_PLATES = ["top", "bottom"]
+
+# parameters aggregated as the value with the maximum absolute value of any TEC
+MAX_ABS_PARAMETERS = ["output current", "output voltage"]
+
+
+def average_column(plate):
+    """
+    Returns the name of the column holding the average object temperature of a plate.
+    """
+    return f"average object temperature {plate}"
+
+
+def sum_column(parameter):
+    """
+    Returns the name of the column holding the sum of a parameter over all TECs.
+    """
+    return f"sum {parameter}"
+
+
+def max_abs_column(parameter):
+    """
+    Returns the name of the column holding the value of a parameter with the maximum absolute value of any TEC.
+    """
+    return f"max abs {parameter}"
+
+
+def _nanmean(values):
+    """
+    Mean of every row, missing values are skipped. Rows without values are NaN.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nansum(values, axis=1) / (~np.isnan(values)).sum(axis=1)
+
+
+def _nansum(values):
+    """
+    Sum of every row, missing values are skipped.
+    """
+    return np.nansum(values, axis=1)
+
+
+def _nanmax_abs(values):
+    """
+    Value with the maximum absolute value of every row, missing values are skipped.
+    """
+    if values.shape[1] == 0:
+        return np.full(len(values), np.nan, dtype=values.dtype)
+    max_ids = np.where(np.isnan(values), -np.inf, np.abs(values)).argmax(axis=1)
+    return values[np.arange(len(values)), max_ids]
+
+
+# aggregates of every measurement: column -> (parameter, plates, function over the TEC columns)
+TICK_AGGREGATES = {
+    **{
+        average_column(plate): ("object temperature", [plate], _nanmean)
+        for plate in AGGREGATE_PLATES
+    },
+    sum_column("output power"): ("output power", AGGREGATE_PLATES, _nansum),
+    **{
+        max_abs_column(parameter): (parameter, AGGREGATE_PLATES, _nanmax_abs)
+        for parameter in MAX_ABS_PARAMETERS
+    },
+}
+
+# aggregates holding an extreme value, rollups (see ui.rollups) keep the extreme value of an interval instead of the mean
+MAX_ABS_AGGREGATES = [max_abs_column(parameter) for parameter in MAX_ABS_PARAMETERS]
+
+
+def get_tick_aggregate(df, column):
+    """
+    Returns the values of an aggregate for all measurements of a dataframe in the wide layout.
+    Stored values are read, otherwise (e.g. data of older versions) they are computed from the TEC columns.
+
+    Args:
+        df (pd.DataFrame): measurements in the wide layout.
+        column (str): column of the aggregate, e.g. average_column("top").
+
+    Returns:
+        np.ndarray: one value per measurement.
+    """
+    if column in df.columns:
+        return df[column].to_numpy()
+
+    parameter, plates, function = TICK_AGGREGATES[column]
+    values = df[wide_columns(df, parameter, plates=plates)].to_numpy(dtype=np.float32)
+    # same dtype as the TEC columns
+    return function(values).astype(np.float32, copy=False)
+
+
+def add_tick_aggregates(df):
+    """
+    Returns the measurements in the wide layout with all aggregate columns, e.g. for data of older versions.
+    Returns the dataframe unchanged if it already has them.
+    New measurements get them from SampleBuffer.wide_values instead.
+    """
+    missing = [column for column in TICK_AGGREGATES if column not in df.columns]
+    if not missing:
+        return df
+    # added at once, assigning them one by one copies the dataframe every time
+    aggregates = pd.DataFrame(
+        {column: get_tick_aggregate(df, column) for column in missing}, index=df.index
+    )
+    return pd.concat([df, aggregates], axis=1)
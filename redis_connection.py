@@ -0,0 +1,35 @@
+"""
+Shared redis connections. All modules of a process use the same connection pools.
+"""
+
+import redis
+
+from redis_keys import REDIS_HOST, REDIS_PORT, REDIS_SOCKET
+
+# one connection pool per value of decode_responses
+_pools = {}
+
+
+def get_redis(decode_responses=True):
+    """
+    Returns a redis client using the connection pool of this process.
+    Connects via the unix domain socket REDIS_SOCKET if it is set, otherwise via REDIS_HOST and REDIS_PORT.
+
+    Args:
+        decode_responses (bool): return strings instead of bytes, False for binary values like the data itself.
+    """
+    pool = _pools.get(decode_responses)
+    if pool is None:
+        if REDIS_SOCKET is not None:
+            pool = redis.ConnectionPool(
+                connection_class=redis.UnixDomainSocketConnection,
+                path=REDIS_SOCKET,
+                db=0,
+                decode_responses=decode_responses,
+            )
+        else:
+            pool = redis.ConnectionPool(
+                host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=decode_responses
+            )
+        _pools[decode_responses] = pool
+    return redis.Redis(connection_pool=pool)
@@ -5,14 +5,41 @@ Connection parameters
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
 
+# path of the unix domain socket of redis, used instead of host and port if set
+# (only if redis runs on the same machine and was started with the "unixsocket" option)
+REDIS_SOCKET = None
+
 """
 Channel Keys
 """
-# channel for the current data
+# hot segment of the current data (list with one entry per tick)
 REDIS_KEY_STORE = "tec-data-store"
 
-# channel for the current data that is too old to be displayed
-REDIS_KEY_STORE_ALL = "tec-data-store-all"
+# size of the hot segment in bytes (counter)
+REDIS_KEY_STORE_BYTES = "tec-data-store-bytes"
+
+# sealed, immutable segments of the current data (one key per segment)
+REDIS_KEY_PREFIX_SEGMENT = "tec-data-segment:"
+
+# ordered index of the sealed segments (sorted set, scored by the first timestamp)
+REDIS_KEY_SEGMENT_INDEX = "tec-data-segment-index"
+
+# data of the previous session stored by older versions (base64 parquet), only read for migration
+REDIS_KEY_LEGACY_STORE_ALL = "tec-data-store-all"
+
+# chunks of the rollup tiers of the current data (one key per chunk, suffixed with "<interval in seconds>:<first timestamp>")
+REDIS_KEY_PREFIX_ROLLUP = "tec-rollup:"
+
+# ordered index of the chunks of a rollup tier (sorted set per tier, suffixed with the interval in seconds,
+# scored by the first timestamp)
+REDIS_KEY_PREFIX_ROLLUP_INDEX = "tec-rollup-index:"
+
+# newest measurement of the current data (Arrow IPC stream, one row in the wide layout)
+REDIS_KEY_LATEST = "tec-data-latest"
+
+# version of the current data (hash with the fields "generation", "version" and "timestamp")
+# the version counts the stored measurements, the generation changes whenever the data is cleared
+REDIS_KEY_STORE_VERSION = "tec-data-store-version"
 
 # recovered data from last session
 REDIS_KEY_PREVIOUS_DATA = "tec-data-store-previous"
@@ -29,5 +56,14 @@ REDIS_KEY_START_BACKEND_FEEDBACK = "tec-start-backend-feedback"
 # inform the UI that data acquisition is reconnecting
 REDIS_KEY_RECONNECTING = "tec-data-reconnecting"
 
+# result of the last burst capture
+REDIS_KEY_BURST_CAPTURE = "tec-burst-capture"
+
+# state and metadata of the last burst capture (hash)
+REDIS_KEY_BURST_CAPTURE_STATUS = "tec-burst-capture-status"
+
 # pubsub channel for UI commands
-REDIS_KEY_UI_COMMANDS = "ui_commands"
\ No newline at end of file
+REDIS_KEY_UI_COMMANDS = "ui_commands"
+
+# per-command latency metric of UI commands (hash per command)
+REDIS_KEY_PREFIX_COMMAND_LATENCY = "tec-command-latency:"
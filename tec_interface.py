@@ -13,27 +13,39 @@ except ImportError as e:
     input("Press Enter to continue....")
     exit()
 
-import redis
+import signal
+from threading import Thread
+from app.polling_rate import PollingRateController
+from app.sample_buffer import SAMPLE_OK, SAMPLE_OFFLINE, SampleBuffer
 from app.system_tec_controller import SystemTECController
 from time import sleep, time
+import numpy as np
 import pandas as pd
 
-from mecom.exceptions import ResponseException
 from mecom.mecom import MeComSerial
+from redis_connection import get_redis
 from redis_keys import (
-    REDIS_HOST,
     REDIS_KEY_START_BACKEND_FEEDBACK,
-    REDIS_KEY_STORE,
-    REDIS_KEY_STORE_ALL,
     REDIS_KEY_TEC_CONNECTION_STATUS,
-    REDIS_KEY_PREVIOUS_DATA,
+    REDIS_KEY_PREFIX_COMMAND_LATENCY,
     REDIS_KEY_RECONNECTING,
     REDIS_KEY_UI_COMMANDS,
-    REDIS_PORT,
 )
 from ui.callbacks.graphs_tables import _convert_timestamps
 from ui.components.graphs import format_timestamps
-from ui.data_store import get_data_both_channels, get_data_from_store, update_store
+from ui.data_store import (
+    archive_previous_session,
+    clear_store,
+    get_memory_usage,
+    live_window_rows,
+    set_burst_capture_status,
+    store_burst_capture,
+    update_store,
+)
+from ui.shared_ring import SharedRingWriter
+
+# interval of the printed memory usage of the stored data in seconds
+MEMORY_USAGE_INTERVAL = 60
 
 
 class TECInterface:
@@ -58,24 +70,22 @@ class TECInterface:
             ports_bottom=[PORTS["BOTTOM_1"], PORTS["BOTTOM_2"]],
             ports_external=external_ports,
         )
-        # all measurements from all TECs
-        self._data = pd.DataFrame()
+        # most recent measurement of all TECs
+        self._sample = None
 
         # timestamp when data was last updated
         self._data_time = -1
 
-    def get_data(self):
+    def get_sample(self):
         """
-        Returns data from all connected TECs as a dataframe.
-        May return previous data if called too frequently.
+        Returns the measurement of all connected TECs as a SampleBuffer.
+        May return the previous measurement if called too frequently.
         """
         # get fresh data if UPDATE_THRESHOLD is exceeded, otherwise provide existing data
         if time() - self._data_time >= self._UPDATE_THRESHOLD:
-            self._data = self.system_controller.get_data()
+            self._sample = self.system_controller.get_sample()
             self._data_time = time()
-            return self._data
-        else:
-            return self._data
+        return self._sample
 
     def set_temperature(self, plate, temperature):
         """
@@ -115,10 +125,56 @@ class TECInterface:
         """
         self.system_controller.enable_all()
 
+    def start_burst_capture(self, plate, tec_id, duration, parameters):
+        """
+        Records parameters of one TEC at the maximum achievable rate for a few seconds.
+        Runs in the background, the result is put in the store when finished.
+        """
+        status = {
+            "plate": plate,
+            "tec": tec_id,
+            "duration": duration,
+            "parameters": "$".join(parameters),
+            "started": time(),
+        }
+        set_burst_capture_status({**status, "state": "running"})
+
+        def on_finished(capture, exception):
+            if capture is None:
+                set_burst_capture_status(
+                    {**status, "state": "error", "error": str(exception)}
+                )
+                return
+            df = capture.to_dataframe()
+            store_burst_capture(df)
+            set_burst_capture_status(
+                {
+                    **status,
+                    "state": "finished",
+                    "samples": len(df),
+                    "rate": capture.get_rate(),
+                }
+            )
+
+        try:
+            started = self.system_controller.start_burst(
+                plate, tec_id, parameters, duration, on_finished
+            )
+        except (AssertionError, KeyError) as ex:
+            # unknown TEC or invalid parameters
+            set_burst_capture_status(
+                {**status, "state": "error", "error": f"invalid burst capture: {ex!r}"}
+            )
+            return
+        if not started:
+            set_burst_capture_status(
+                {**status, "state": "error", "error": "port is offline or busy"}
+            )
+
     def handle_message(self, message):
         """
         Handles an incoming message from the UI.
-        Format: "command$$value1$$value2$$.."
+        Format: "command$$value1$$value2$$..$$timestamp"
         """
         splitted = message["data"].split("$$")
         command = splitted[0]
@@ -131,6 +187,12 @@ class TECInterface:
                 self.disable_all_plates()
             case "ENABLE_ALL":
                 self.enable_all_plates()
+            case "BURST":
+                plate = splitted[1]
+                tec_id = int(splitted[2])
+                duration = float(splitted[3])
+                parameters = splitted[4].split("$")
+                self.start_burst_capture(plate, tec_id, duration, parameters)
 
     @staticmethod
     def test_serial_connection(port):
@@ -182,17 +244,28 @@ class DummyInterface:
         self.df.set_index(["Plate", "TEC"], inplace=True)
         self.counter = 0
 
-    def get_data(self):
+        # buffer of the measurements, in the TEC order of the first one
+        self._sample = SampleBuffer(list(self.df.index[:8]))
+
+    def get_sample(self):
         """
-        Returns the next 8 rows (=> 1 measurement) of the pre-recorded data.
+        Returns the next 8 rows (=> 1 measurement) of the pre-recorded data as a SampleBuffer,
+        or None once all data was provided.
         """
         start = self.counter * 8
         self.counter = self.counter + 1
 
         if start + 8 > len(self.df):
-            return pd.DataFrame()
+            return None
 
-        return self.df[start : start + 8]
+        rows = self.df[start : start + 8].reindex(self._sample.tecs)
+        num_queries = len(self._sample.queries)
+        self._sample.values[:, :num_queries] = rows[self._sample.queries].to_numpy(dtype=np.float32)
+        self._sample.status[:] = SAMPLE_OK
+        self._sample.finish()
+        # the recorded timestamp is replayed as it is
+        self._sample.timestamp = int(rows["timestamp"].iloc[-1])
+        return self._sample
 
     def handle_message(self, message):
         """
@@ -209,16 +282,22 @@ def setup_redis():
         redis object, pubsub object for listening to UI commands.
     """
     # connect to the redis storage
-    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-
-    # save all previous data
-    r.delete(REDIS_KEY_PREVIOUS_DATA)
-    previous_data = get_data_both_channels()
-    update_store(previous_data, REDIS_KEY_PREVIOUS_DATA)
+    r = get_redis()
+
+    # save all previous data, the store is only cleared once it is archived
+    try:
+        archive_previous_session()
+    except Exception as e:
+        # the backend still starts, but the data stays in place (redis and the archive of the current session),
+        # so nothing is lost: new measurements are added to it and it is archived again at the next start
+        # (e.g. the files were still opened by the UI)
+        print(
+            f"[ERROR] Could not archive the data of the previous session, it is kept as part of the current session: {e}"
+        )
+    else:
+        # clean up the data channels
+        clear_store()
 
-    # clean up the data channels
-    r.delete(REDIS_KEY_STORE)
-    r.delete(REDIS_KEY_STORE_ALL)
     r.delete(REDIS_KEY_RECONNECTING)
     r.delete(REDIS_KEY_TEC_CONNECTION_STATUS)
 
@@ -305,60 +384,198 @@ def wait_for_go(r, pubsub_ui_commands):
             sleep(1 - time_delta)
 
 
-def data_aquisition(tec_interface, r, pubsub_ui_commands):
-    # keep track if all TECs are online right now
-    tecs_online = True
+def record_command_latency(r, command, sent_time, latency_stats):
+    """
+    Updates the latency metric of a UI command, i.e. the time from the UI sending the command
+    until it was executed by the device layer, and publishes it via redis.
 
-    # pull data until program is forcefully stopped
-    while True:
-        time_start = time()  # in seconds
+    Args:
+        r (redis.Redis): Redis connection object.
+        command (str): name of the command, e.g. SET_TEMP.
+        sent_time (float): time the UI sent the command at.
+        latency_stats (dict): latency statistics per command, updated in place.
+    """
+    latency = time() - sent_time
+
+    stats = latency_stats.setdefault(command, {"count": 0, "total": 0.0, "max": 0.0})
+    stats["count"] += 1
+    stats["total"] += latency
+    stats["max"] = max(stats["max"], latency)
+
+    r.hset(
+        f"{REDIS_KEY_PREFIX_COMMAND_LATENCY}{command}",
+        mapping={
+            "last": latency,
+            "mean": stats["total"] / stats["count"],
+            "max": stats["max"],
+            "count": stats["count"],
+        },
+    )
+    print(f"Command {command} executed after {latency * 1000:.1f}ms.")
+
+
+def command_listener(tec_interface, r, pubsub_ui_commands, polling_rate):
+    """
+    Blocks on the UI command channel and dispatches every command to the device layer as soon as it arrives.
+    Runs in its own thread next to the data acquisition. Bus access is serialized per query by the lock of
+    the MeCom session, so commands are interleaved with the polling instead of waiting for a whole tick.
 
-        # listen to any UI commands
-        message = pubsub_ui_commands.get_message()
-        while message and message["type"] == "message":
+    Args:
+        tec_interface (TECInterface or DummyInterface): interface the commands are dispatched to.
+        r (redis.Redis): Redis connection object.
+        pubsub_ui_commands (redis.client.PubSub): PubSub object for listening to UI commands.
+        polling_rate (PollingRateController): is notified of every handled command.
+    """
+    latency_stats = {}
+
+    for message in pubsub_ui_commands.listen():
+        if message["type"] != "message":
+            continue
+
+        try:
             tec_interface.handle_message(message)
-            message = pubsub_ui_commands.get_message()
+        except Exception as e:
+            # keep listening, a failed command must not stop the listener
+            print(f"[ERROR] Exception caught while handling UI command {message['data']}: {e}")
+            continue
+
+        # commands will change the state of the TECs
+        polling_rate.notify_command()
 
-        # get and store fresh data
+        # the last part of the message is the time the UI sent it at
+        splitted = message["data"].split("$$")
         try:
-            data = tec_interface.get_data()  # ResponseTimeout can only occur here
-            update_store(data)
+            sent_time = float(splitted[-1])
+        except ValueError:
+            continue
+        record_command_latency(r, splitted[0], sent_time, latency_stats)
+
+
+def print_memory_usage():
+    """
+    Prints the memory used by the stored data per tier, with its budget if it has one.
+    The live cache is only kept by the UI process, so it is left out.
+    """
+    tiers = []
+    for tier, usage in get_memory_usage().items():
+        if tier == "live cache":
+            continue
+        text = f"{tier} {usage['bytes'] / 1024:.0f} KiB"
+        if usage["budget"] is not None:
+            text += f" / {usage['budget'] / 1024:.0f} KiB"
+        tiers.append(text)
+    print(f"[INFO] Memory usage: {', '.join(tiers)}")
+
+
+def handle_shutdown_signal(signum, frame):
+    """
+    Ends the data acquisition like a KeyboardInterrupt when the process is asked to stop
+    (e.g. the console window is closed), so the shared memory block is removed on the way out.
+    """
+    raise SystemExit(0)
+
+
+def data_aquisition(tec_interface, r, polling_rate):
+    # keep track if all TECs are online right now
+    tecs_online = True
+
+    # time the memory usage was printed last
+    memory_usage_printed = time()
 
-            # if tecs were offline before, signal that all are connected again
-            if not tecs_online:
+    # live data for the UI, created with the layout of the first measurement
+    live_ring = None
+
+    # pull data until program is forcefully stopped
+    try:
+        while True:
+            time_start = time()  # in seconds
+
+            # get and store fresh data
+            # TECs that cannot be reached are marked as missing instead of aborting the measurement
+            sample = tec_interface.get_sample()
+
+            # the dummy interface runs out of pre-recorded data eventually
+            if sample is None:
+                sleep(polling_rate.get_interval())
+                continue
+
+            # the stored row (with the rate this sample was taken at and the aggregates over all TECs)
+            # is built straight from the buffer, no dataframe is needed
+            sample_rate = polling_rate.rate
+            wide_data = sample.to_wide_table(sample_rate)
+            update_store(wide_data)
+
+            # hand the measurement to the UI through shared memory
+            if live_ring is None or not live_ring.matches(wide_data):
+                if live_ring is not None:
+                    live_ring.close()
+                live_ring = SharedRingWriter.from_table(
+                    wide_data, live_window_rows(wide_data)
+                )
+            live_ring.append(wide_data)
+
+            # adjust the rate for the next sample
+            polling_rate.update(sample)
+
+            # only show the reconnecting overlay when no TEC can be reached at all
+            # the UI expects this signal on every tick while the overlay should be shown
+            if (sample.status == SAMPLE_OFFLINE).all():
+                r.publish(REDIS_KEY_RECONNECTING, f"Reconnecting$${time()}")
+                tecs_online = False
+            elif not tecs_online:
+                # if tecs were offline before, signal that they are connected again
                 r.publish(REDIS_KEY_RECONNECTING, f"ConnectionReestablished$${time()}")
                 tecs_online = True
 
-            # print the current data for debugging
-            df = get_data_from_store()
+            # print the current measurement for debugging
+            df = sample.to_dataframe().assign(**{"sample rate": sample_rate})
             _convert_timestamps(df)
             format_timestamps(df)
             print(df)
-        except ResponseException as ex:
-            # some TECs have encountered an error and are restarting.
-            # instead of sending data, send the signal that an error has occured
-            r.publish(REDIS_KEY_RECONNECTING, f"Reconnecting$${time()}")
-            tecs_online = False
-
-        # sleep to achieve a polling rate of 1Hz
-        sleep_time = 1 - (time() - time_start)
-        print(f"Sleeping for {sleep_time}s...")
-        if sleep_time > 0:
-            sleep(sleep_time)
-        else:
-            print(
-                "[WARNING]: Sampling rate fell below 1Hz. Lowering MAX_ROWS_STORAGE in ui.data_store might help."
-            )
+
+            if time() - memory_usage_printed >= MEMORY_USAGE_INTERVAL:
+                print_memory_usage()
+                memory_usage_printed = time()
+
+            # sleep to achieve the current polling rate
+            sleep_time = polling_rate.get_interval() - (time() - time_start)
+            print(f"Sleeping for {sleep_time}s...")
+            if sleep_time > 0:
+                sleep(sleep_time)
+            else:
+                print(
+                    f"[WARNING]: Sampling rate fell below {polling_rate.rate:.2f}Hz."
+                )
+    finally:
+        # remove the shared memory block, readers fall back to redis
+        if live_ring is not None:
+            live_ring.close()
 
 
 # Entry point of data aquisition program here
 if __name__ == "__main__":
 
+    # SIGBREAK is only available on Windows
+    for signal_name in ["SIGTERM", "SIGBREAK"]:
+        if hasattr(signal, signal_name):
+            signal.signal(getattr(signal, signal_name), handle_shutdown_signal)
+
     # set up redis
     r, pubsub_ui_commands = setup_redis()
 
     # wait for the UI to signal the start of this program
     tec_interface = wait_for_go(r, pubsub_ui_commands)
 
+    # adapts the sampling rate to the state of the TECs
+    polling_rate = PollingRateController()
+
+    # handle UI commands as soon as they arrive
+    listener = Thread(
+        target=command_listener,
+        args=(tec_interface, r, pubsub_ui_commands, polling_rate),
+        daemon=True,
+    )
+    listener.start()
+
     # start the data aquisition
-    data_aquisition(tec_interface, r, pubsub_ui_commands)
+    data_aquisition(tec_interface, r, polling_rate)
@@ -0,0 +1,179 @@
+"""
+Tests of ui.compressed_series: the lossless round trip of measurements through CompressedFrame
+and its encodings of timestamps and values.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.measurement_schema import wide_column
+from ui.compressed_series import (
+    BLOCK_ROWS,
+    CompressedFrame,
+    decode_timestamps,
+    decode_values,
+    encode_timestamps,
+    encode_values,
+)
+
+
+def measurements(rng, n, start=1_700_000_000_000):
+    """
+    Measurements in the wide layout with irregular timestamps, NaN values, repeated values
+    and float32, int8 and float64 columns.
+    """
+    timestamps = start + np.cumsum(rng.integers(200, 5000, n)).astype(np.int64)
+    temperatures = (25 + rng.normal(0, 0.5, n)).astype(np.float32)
+    temperatures[rng.choice(n, n // 20, replace=False)] = np.nan
+    return pd.DataFrame(
+        {
+            wide_column("object temperature", "top", 0): temperatures,
+            # repeated values, e.g. a target that rarely changes
+            wide_column("target object temperature", "top", 0): np.repeat(
+                np.float32([20, 30, np.nan, 25]), -(-n // 4)
+            )[:n],
+            wide_column("loop status", "top", 0): rng.choice(np.int8([-1, 1, 2]), n),
+            "timestamp": timestamps,
+            "sample rate": np.full(n, 0.2, dtype=np.float32),
+            "sum output power": rng.normal(0, 10, n),
+        }
+    )
+
+
+def assert_same(actual, expected):
+    """
+    Asserts equal values (NaN included, bit by bit for floats), dtypes and columns.
+    """
+    assert list(actual.columns) == list(expected.columns)
+    for column in expected.columns:
+        assert actual[column].dtype == expected[column].dtype, column
+        expected_values = expected[column].to_numpy()
+        actual_values = actual[column].to_numpy()
+        if expected_values.dtype.kind == "f":
+            unsigned = f"u{expected_values.dtype.itemsize}"
+            assert np.array_equal(actual_values.view(unsigned), expected_values.view(unsigned)), column
+        else:
+            assert np.array_equal(actual_values, expected_values), column
+
+
+@pytest.mark.parametrize(
+    "timestamps",
+    [
+        [1_700_000_000_000],
+        [0, 1000],
+        [0, 1000, 2000, 3000, 4000],
+        # irregular steps, one of them too large for int8/int16 delta of deltas
+        [0, 1000, 1500, 1501, 9000, 9000 + 10**8, 9000 + 10**8 + 3],
+    ],
+)
+def test_timestamps_round_trip(timestamps):
+    timestamps = np.array(timestamps, dtype=np.int64)
+
+    assert np.array_equal(decode_timestamps(encode_timestamps(timestamps)), timestamps)
+
+
+def test_regular_timestamps_use_the_smallest_type():
+    encoded = encode_timestamps(np.arange(0, 100_000, 1000, dtype=np.int64))
+
+    assert encoded["delta_of_deltas"].dtype == np.int8
+    assert not encoded["delta_of_deltas"].any()
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int8, np.int64])
+def test_values_round_trip(dtype):
+    rng = np.random.default_rng(0)
+    values = rng.normal(0, 100, 1000).astype(dtype)
+    if np.dtype(dtype).kind == "f":
+        values[::7] = np.nan
+        values[1::7] = -0.0
+        values[2::7] = np.inf
+    values[3::7] = values[4::7]
+
+    decoded = decode_values(encode_values(values))
+
+    assert decoded.dtype == values.dtype
+    assert np.array_equal(decoded.view(f"u{values.itemsize}"), values.view(f"u{values.itemsize}"))
+
+
+def test_repeated_values_only_store_the_first():
+    encoded = encode_values(np.full(BLOCK_ROWS, 21.5, dtype=np.float32))
+
+    assert encoded["width"] == 0
+    assert encoded["bits"].nbytes == 0
+    assert np.array_equal(decode_values(encoded), np.full(BLOCK_ROWS, 21.5, dtype=np.float32))
+
+
+@pytest.mark.parametrize("n", [1, BLOCK_ROWS - 1, BLOCK_ROWS, 3 * BLOCK_ROWS + 17])
+def test_frame_round_trip(n):
+    df = measurements(np.random.default_rng(n), n)
+
+    frame = CompressedFrame(df)
+
+    assert len(frame) == n
+    assert frame.last_timestamp == df["timestamp"].iloc[-1]
+    assert_same(frame.to_dataframe(), df)
+
+
+def test_appended_measurements_round_trip():
+    rng = np.random.default_rng(1)
+    df = measurements(rng, 2000)
+
+    # one measurement per tick, then a few larger batches
+    frame = CompressedFrame(df.iloc[:1])
+    for i in range(1, 600):
+        frame.append(df.iloc[i : i + 1])
+    for start in range(600, 2000, 350):
+        assert frame.matches(df.iloc[start : start + 350])
+        frame.append(df.iloc[start : start + 350])
+
+    assert len(frame) == 2000
+    assert_same(frame.to_dataframe(), df)
+
+
+def test_to_dataframe_from_start():
+    df = measurements(np.random.default_rng(2), 3 * BLOCK_ROWS)
+    frame = CompressedFrame(df)
+
+    for start in [
+        df["timestamp"].iloc[0] - 1,
+        df["timestamp"].iloc[BLOCK_ROWS],
+        df["timestamp"].iloc[BLOCK_ROWS + 5] + 1,
+        df["timestamp"].iloc[-1],
+        df["timestamp"].iloc[-1] + 1,
+    ]:
+        expected = df[df["timestamp"] >= start].reset_index(drop=True)
+        assert_same(frame.to_dataframe(start), expected)
+
+
+def test_returned_data_is_a_copy():
+    df = measurements(np.random.default_rng(3), BLOCK_ROWS + 10)
+    frame = CompressedFrame(df)
+
+    returned = frame.to_dataframe()
+    returned.loc[:, wide_column("object temperature", "top", 0)] = 0
+
+    assert_same(frame.to_dataframe(), df)
+
+
+def test_compression_and_trim():
+    df = measurements(np.random.default_rng(4), 10 * BLOCK_ROWS)
+    frame = CompressedFrame(df)
+
+    assert frame.nbytes < int(df.memory_usage(index=False).sum())
+
+    frame.trim(frame.nbytes // 2)
+
+    # whole blocks are dropped at the beginning
+    assert frame.nbytes <= int(df.memory_usage(index=False).sum()) // 2
+    assert len(frame) % BLOCK_ROWS == 0
+    assert_same(frame.to_dataframe(), df.iloc[-len(frame) :].reset_index(drop=True))
+
+
+def test_matches():
+    df = measurements(np.random.default_rng(5), 10)
+    frame = CompressedFrame(df)
+
+    assert frame.matches(df)
+    assert not frame.matches(df.drop(columns="sample rate"))
+    assert not frame.matches(df.astype({"sample rate": np.float64}))
@@ -0,0 +1,218 @@
+"""
+Tests of ui.lossy_compression: the kept samples of deadband and swinging door compression,
+the error bound of the reconstruction and the round trip of compressed tables.
+"""
+
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.measurement_schema import wide_column
+from ui.lossy_compression import (
+    COMPRESSION_METADATA_KEY,
+    compress_table,
+    deadband,
+    decompress_table,
+    swinging_door,
+)
+
+TOLERANCE = 0.01
+
+
+def irregular_timestamps(rng, n):
+    """
+    Increasing timestamps (ms) with a varying sample rate, like the adaptive polling.
+    """
+    return 1_700_000_000_000 + np.cumsum(rng.integers(200, 5000, n)).astype(np.int64)
+
+
+def temperature(rng, timestamps):
+    """
+    Slowly varying temperature with ramps, holds and noise.
+    """
+    seconds = (timestamps - timestamps[0]) / 1000
+    return 25 + 5 * np.sin(seconds / 600) + rng.normal(0, 0.002, len(seconds))
+
+
+def reconstruct_deadband(values, keep):
+    """
+    Repeats the last kept sample, like decompress_table.
+    """
+    return values[np.maximum.accumulate(np.where(keep, np.arange(len(values)), 0))]
+
+
+def reconstruct_swinging_door(timestamps, values, keep):
+    """
+    Interpolates linearly between the kept samples, like decompress_table.
+    """
+    return np.interp(timestamps, timestamps[keep], values[keep])
+
+
+@pytest.mark.parametrize("method", [deadband, swinging_door])
+def test_empty_and_single_sample(method):
+    assert method(np.zeros(0), np.zeros(0), TOLERANCE).tolist() == []
+    assert method(np.zeros(1), np.ones(1), TOLERANCE).tolist() == [True]
+
+
+def test_deadband_without_tolerance_keeps_every_change():
+    values = np.array([1.0, 1.0, 2.0, 2.0, 2.0, 1.0, np.nan, np.nan, 1.0, 1.0])
+    keep = deadband(np.arange(len(values)), values, 0)
+
+    assert keep.tolist() == [True, False, True, False, False, True, True, True, True, True]
+    assert np.array_equal(reconstruct_deadband(values, keep), values, equal_nan=True)
+
+
+def test_deadband_error_bound():
+    rng = np.random.default_rng(0)
+    timestamps = irregular_timestamps(rng, 5000)
+    values = temperature(rng, timestamps)
+
+    keep = deadband(timestamps, values, TOLERANCE)
+
+    assert keep[0] and keep[-1]
+    assert keep.sum() < len(values)
+    assert np.abs(reconstruct_deadband(values, keep) - values).max() <= TOLERANCE
+
+
+def test_deadband_keeps_missing_measurements():
+    values = np.array([1.0, 1.001, np.nan, 1.002, 1.003, 1.0])
+    keep = deadband(np.arange(len(values)), values, TOLERANCE)
+
+    # the missing measurement and the sample after it start a new band
+    assert keep.tolist() == [True, False, True, True, False, True]
+
+
+def test_swinging_door_keeps_line_ends():
+    timestamps = np.arange(0, 10_000, 1000, dtype=np.float64)
+    # two straight lines, only the corner is needed in between
+    values = np.r_[np.linspace(0, 4, 5), np.linspace(3, -1, 5)]
+
+    keep = swinging_door(timestamps, values, TOLERANCE)
+
+    assert keep.tolist() == [True, False, False, False, True, False, False, False, False, True]
+
+
+def test_swinging_door_error_bound():
+    rng = np.random.default_rng(1)
+    timestamps = irregular_timestamps(rng, 5000)
+    values = temperature(rng, timestamps)
+
+    keep = swinging_door(timestamps.astype(np.float64), values, TOLERANCE)
+
+    assert keep[0] and keep[-1]
+    assert keep.sum() < len(values) / 2
+    error = reconstruct_swinging_door(timestamps, values, keep) - values
+    assert np.abs(error).max() <= TOLERANCE + 1e-9
+
+
+def test_swinging_door_keeps_samples_next_to_missing_measurements():
+    timestamps = np.arange(9, dtype=np.float64)
+    values = np.array([0.0, 0.0, 0.0, 0.0, np.nan, 0.0, 0.0, 0.0, 0.0])
+
+    keep = swinging_door(timestamps, values, TOLERANCE)
+
+    assert keep.tolist() == [True, False, False, True, True, True, False, False, True]
+
+
+def measurement_table(rng, n):
+    """
+    Measurements of two TECs in the wide layout, with missing measurements and repeated loop states.
+    """
+    timestamps = irregular_timestamps(rng, n)
+    columns = {}
+    for tec_id in range(2):
+        temperatures = temperature(rng, timestamps).astype(np.float32)
+        temperatures[rng.choice(n, 10, replace=False)] = np.nan
+        columns[wide_column("object temperature", "top", tec_id)] = temperatures
+        columns[wide_column("target object temperature", "top", tec_id)] = np.repeat(
+            np.float32([20, 30, 25, 40]), -(-n // 4)
+        )[:n]
+        columns[wide_column("loop status", "top", tec_id)] = rng.choice(
+            np.int8([1, 2]), n, p=[0.05, 0.95]
+        )
+        columns[wide_column("output current", "top", tec_id)] = rng.normal(0, 1, n).astype(
+            np.float32
+        )
+    columns["timestamp"] = timestamps
+    return pa.table(columns)
+
+
+COMPRESSION = {
+    "object temperature": ("swinging door", TOLERANCE),
+    "target object temperature": ("deadband", 0),
+    "loop status": ("deadband", 0),
+}
+
+
+def test_compress_decompress_round_trip():
+    rng = np.random.default_rng(2)
+    table = measurement_table(rng, 3000)
+
+    compressed, counts = compress_table(table, COMPRESSION)
+    restored = decompress_table(compressed)
+
+    assert set(counts) == set(COMPRESSION)
+    for parameter, (samples, kept) in counts.items():
+        assert samples == 2 * table.num_rows
+        assert kept < samples
+    assert COMPRESSION_METADATA_KEY not in (restored.schema.metadata or {})
+    assert restored.schema == table.schema
+
+    for name in table.column_names:
+        original = table.column(name).to_numpy()
+        values = restored.column(name).to_numpy()
+        if name.startswith("object temperature"):
+            # missing measurements stay missing, the others are within the tolerance
+            assert np.array_equal(np.isnan(values), np.isnan(original))
+            error = np.abs(values.astype(np.float64) - original.astype(np.float64))
+            assert np.nanmax(error) <= TOLERANCE
+        else:
+            # deadband without tolerance and uncompressed columns (including the timestamps) are exact
+            assert np.array_equal(values, original, equal_nan=True)
+
+
+def test_round_trip_through_parquet():
+    rng = np.random.default_rng(3)
+    table = measurement_table(rng, 1000)
+    compressed, _ = compress_table(table, COMPRESSION)
+
+    sink = io.BytesIO()
+    pq.write_table(compressed, sink)
+    restored = decompress_table(pq.read_table(io.BytesIO(sink.getvalue())))
+
+    expected = decompress_table(compressed)
+    assert restored.schema == expected.schema
+    for name in table.column_names:
+        assert np.array_equal(
+            restored.column(name).to_numpy(), expected.column(name).to_numpy(), equal_nan=True
+        )
+
+
+def test_timestamps_are_used_for_the_interpolation():
+    # a straight line over irregular timestamps is reconstructed from its ends only
+    timestamps = np.int64([0, 100, 1000, 1100, 5000, 9000, 10_000])
+    values = (timestamps / 1000).astype(np.float32)
+    table = pa.table(
+        {wide_column("object temperature", "top", 0): values, "timestamp": timestamps}
+    )
+
+    compressed, counts = compress_table(table, COMPRESSION)
+    restored = decompress_table(compressed)
+
+    assert counts["object temperature"] == [len(values), 2]
+    assert np.allclose(
+        restored.column(wide_column("object temperature", "top", 0)).to_numpy(), values
+    )
+
+
+def test_table_without_compressed_columns_is_unchanged():
+    table = pa.table({"sample rate": np.float32([1, 1]), "timestamp": np.int64([0, 1000])})
+
+    compressed, counts = compress_table(table, COMPRESSION)
+
+    assert counts == {}
+    assert compressed.equals(table)
+    assert decompress_table(compressed).equals(table)
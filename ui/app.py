@@ -19,6 +19,11 @@ from .callbacks.callbacks import register_callbacks
 
 register_callbacks(app)
 
+# routes for downloads that are streamed instead of sent through a callback
+from .export import export_routes
+
+export_routes(app)
+
 
 if __name__ == "__main__":
     # disable the dev tools in a production environment
@@ -18,17 +18,20 @@ from ui.command_sender import (
     set_temperature,
     start_backend,
     start_backend_dummy,
+    start_burst_capture,
 )
 from ui.components.connection_status_row import connection_status_row
 from ui.data_store import (
+    get_burst_capture,
+    get_burst_capture_status,
     get_callback_lock,
     get_connection_status,
     get_data_both_channels,
-    get_data_for_download,
-    get_recovered_data,
+    get_sessions,
     set_callback_lock,
 )
 
+from ui.export import export_file_url, get_export_status, get_file_name, start_export
 from ui.layouts import ACTIVE_MODE
 
 
@@ -36,10 +39,23 @@ from ui.layouts import ACTIVE_MODE
 _switches_state = []
 
 
-# Helper function to get the file name of a new CSV to be downloaded as a string
-def get_CSV_file_name():
-    time = datetime.now().strftime("%Y-%m-%d_%H_%M_%S")
-    return f"TEC_data_{time}.csv"
+# Helper function to describe a finished session
+def session_label(session):
+    start = datetime.fromtimestamp(session["start"] / 1000)
+    end = datetime.fromtimestamp(session["end"] / 1000)
+    return f"{start:%Y-%m-%d %H:%M} - {end:%Y-%m-%d %H:%M} ({session['rows']} measurements)"
+
+
+# Helper function to describe the state of the last burst capture
+def burst_capture_status_text(status):
+    if status is None:
+        return "No burst capture recorded yet."
+    label = f"{status['plate'].upper()}_{status['tec']}"
+    if status["state"] == "running":
+        return f"Recording {label} for {float(status['duration']):g}s..."
+    if status["state"] == "finished":
+        return f"Recorded {status['samples']} samples of {label} at {float(status['rate']):.1f}Hz."
+    return f"Burst capture of {label} failed: {status.get('error', 'unknown error')}"
 
 
 # Helper function to assess the disabled state of the 'start' btn in welcome menu and build the rows
@@ -83,6 +99,54 @@ def helper_build_rows_and_check_disabled(switches, labels):
     return updated_rows, not connection_ready
 
 
+def export_job_callbacks(app, prefix, settings, start):
+    """
+    Registers the callbacks of the export controls with the given prefix (see export_controls).
+
+    settings: Inputs with the settings of the export, changing them resets the job
+    start: function starting the export from the values of the settings, returns the job id
+    """
+
+    # start the job when the btn is pressed
+    @app.callback(
+        Output(f"{prefix}-export-job", "data"),
+        [Input(f"btn-{prefix}-export", "n_clicks")] + settings,
+        prevent_initial_call=True,
+    )
+    def start_or_reset_export(n_clicks, *values):
+        if ctx.triggered_id != f"btn-{prefix}-export":
+            return None
+        return start(*values)
+
+    # show the progress and enable the link once the file is ready
+    @app.callback(
+        [
+            Output(f"{prefix}-export-status", "children"),
+            Output(f"btn-{prefix}-export-download", "href"),
+            Output(f"btn-{prefix}-export-download", "disabled"),
+        ],
+        [
+            Input(f"{prefix}-export-job", "data"),
+            Input("interval-component", "n_intervals"),
+        ],
+        prevent_initial_call=True,
+    )
+    def update_export_status(job_id, n):
+        if job_id is None:
+            return None, None, True
+
+        status = get_export_status(job_id)
+        if status is None:
+            return "The export is not available anymore, please prepare it again.", None, True
+        if status["state"] == "failed":
+            return f"Export failed: {status['error']}", None, True
+        if status["state"] == "finished":
+            return "The file is ready.", export_file_url(job_id), False
+
+        progress = round(status["progress"] * 100)
+        return dbc.Progress(value=progress, label=f"{progress}%"), None, True
+
+
 def button_callbacks(app):
     # combined callback for when the start backend btn is pressed or the page is loaded for the first time (spinner)
     @app.callback(
@@ -287,42 +351,106 @@ def button_callbacks(app):
         _, disabled = helper_build_rows_and_check_disabled(switches, labels)
         return disabled
 
-    # when the download data btn is pressed
+    # export of the selected columns of the current session
+    export_job_callbacks(
+        app,
+        "download",
+        [
+            Input("checkboxes-download", "value"),
+            Input("select-download-format", "value"),
+        ],
+        lambda columns, export_format: start_export(
+            columns, export_format=export_format
+        ),
+    )
+
+    # list the finished sessions when the recover data item is opened
     @app.callback(
-        Output("download-data-csv", "data"),
         [
-            Input("btn-download-csv", "n_clicks"),
-            Input("btn-download-csv-reconnecting", "n_clicks"),
-            State("checkboxes-download", "value"),
+            Output("select-recovered-session", "options"),
+            Output("select-recovered-session", "value"),
         ],
+        Input("download-accordion", "active_item"),
         prevent_initial_call=True,
     )
-    def download_all_data(n, n2, selected_options):
-        # Check which button was pressed
-        ctx = dash.callback_context
-        if not ctx.triggered:
-            return dash.no_update
-        else:
-            button_id = ctx.triggered[0]["prop_id"].split(".")[0]
+    def update_recovered_sessions(active_item):
+        if active_item != "item-recover-data":
+            return dash.no_update, dash.no_update
+
+        # newest session first
+        sessions = get_sessions()[::-1]
+        options = [
+            {"label": session_label(session), "value": session["id"]}
+            for session in sessions
+        ]
+        return options, sessions[0]["id"] if sessions else None
+
+    # export of a finished session
+    export_job_callbacks(
+        app,
+        "recovered",
+        [
+            Input("select-recovered-session", "value"),
+            Input("select-recovered-format", "value"),
+            Input("select-recovered-resolution", "value"),
+        ],
+        lambda session_id, export_format, resolution: (
+            None
+            if session_id is None
+            else start_export(
+                session_id=session_id, export_format=export_format, resolution=resolution
+            )
+        ),
+    )
 
-        if button_id == "btn-download-csv-reconnecting":
-            # Select all options
-            selected_options = None
+    # when the start burst capture btn is pressed
+    @app.callback(
+        Output("burst-capture-status", "children", allow_duplicate=True),
+        Input("btn-start-burst", "n_clicks"),
+        [
+            State("select-burst-tec", "value"),
+            State("input-burst-duration", "value"),
+            State("checkboxes-burst", "value"),
+        ],
+        prevent_initial_call=True,
+    )
+    def start_burst(n_clicks, tec, duration, parameters):
+        if duration is None or not parameters:
+            return "Please enter a duration and select at least one parameter."
+
+        plate, tec_id = tec.split("$")
+        start_burst_capture(plate, int(tec_id), float(duration), parameters)
 
-        df = get_data_for_download(selected_options)
+        return "Burst capture requested..."
 
-        return dcc.send_data_frame(df.to_csv, get_CSV_file_name())
+    # keep the burst capture status up to date
+    @app.callback(
+        [
+            Output("burst-capture-status", "children"),
+            Output("btn-download-burst-csv", "disabled"),
+        ],
+        Input("interval-component", "n_intervals"),
+        prevent_initial_call=True,
+    )
+    def update_burst_status(n):
+        status = get_burst_capture_status()
+        finished = status is not None and status["state"] == "finished"
+        return burst_capture_status_text(status), not finished
 
-    # when the recover data btn is pressed
+    # when the download burst capture btn is pressed
     @app.callback(
         Output("download-data-csv", "data", allow_duplicate=True),
-        Input("btn-download-recovered-csv", "n_clicks"),
+        Input("btn-download-burst-csv", "n_clicks"),
         prevent_initial_call=True,
     )
-    def download_recovered_data(n_clicks):
-        df = get_recovered_data()
+    def download_burst_capture(n_clicks):
+        df = get_burst_capture()
+        if df is None:
+            return dash.no_update
 
-        return dcc.send_data_frame(df.to_csv, get_CSV_file_name())
+        return dcc.send_data_frame(
+            df.to_csv, get_file_name("TEC_burst"), index=False
+        )
 
     # when the pause graphs btn is pressed
     # the actual pausing happens in the callback that updates the graphs
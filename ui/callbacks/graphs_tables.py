@@ -4,9 +4,12 @@ import pandas as pd
 import time
 
 import app.param_values as params
-from app.param_values import NUM_TECS
+from app.measurement_schema import parse_wide_column
+from app.sample_buffer import SAMPLE_OFFLINE
+from app.tick_aggregates import average_column, get_tick_aggregate
 from ui.command_sender import disable_all_plates, enable_all_plates, set_temperature
 from ui.components.graphs import (
+    GRAPH_POINTS,
     format_timestamps,
     update_graph_all_current,
     update_graph_all_temperature,
@@ -18,7 +21,11 @@ from ui.components.graphs import (
 from ui.data_store import (
     get_callback_lock,
     check_reconnecting,
-    get_data_from_store,
+    get_latest,
+    get_live_data,
+    get_most_recent,
+    get_store_version,
+    query,
     set_callback_lock,
 )
 from ui.sequence_manager import SequenceManager
@@ -85,18 +92,14 @@ def handle_sequence_instructions(instructions):
 
 def get_avg_temps(df):
     """
-    Will return the average temperatures for the top and bottom plate.
+    Will return the average temperatures for the top and bottom plate of the most recent measurement.
+    The averages are computed by the data acquisition, df is in the wide layout.
     Format: top_avg, bottom_avg
     """
-    if "object temperature" not in df.columns:
-        raise ValueError("DataFrame must include an 'object temperature' column")
+    df_recent = df.tail(1)
 
-    # Group by 'Plate' level calculate the mean of 'object temperature' for each group
-    avg_temps = df["object temperature"].groupby(level="Plate").mean()
-
-    # Extract the average temperatures for 'top' and 'bottom'
-    top_avg = avg_temps.loc["top"]
-    bottom_avg = avg_temps.loc["bottom"]
+    top_avg = get_tick_aggregate(df_recent, average_column("top"))[0]
+    bottom_avg = get_tick_aggregate(df_recent, average_column("bottom"))[0]
 
     return top_avg, bottom_avg
 
@@ -154,6 +157,7 @@ def update_measurement_table(_df):
         ("output current", 4),
         ("output voltage", 4),
         ("output power", 2),
+        ("sample rate", 2),
     ]
 
     # Round specified columns
@@ -169,12 +173,15 @@ def update_measurement_table(_df):
         "output current": "Current (A)",
         "output voltage": "Voltage (V)",
         "output power": "Power (W)",
+        "sample rate": "Rate (Hz)",
         "timestamp": "Time",
     }
 
     # Parse the loop status
     def determine_status(row):
-        if row["loop status"] == 0:
+        if row.get("sample status") == SAMPLE_OFFLINE:
+            return "Offline"
+        elif row["loop status"] == 0:
             return "Inactive"
         elif row["loop status"] == 1:
             if float(row["output current"]) <= 0:
@@ -217,6 +224,15 @@ def update_measurement_table(_df):
     for col in cols_to_wipe:
         df.loc[df["Label"].str.contains("EXTERNAL"), col] = "-"
 
+    # for offline TECs, wipe the missing values
+    if "sample status" in df.columns:
+        offline = df["sample status"] == SAMPLE_OFFLINE
+        for col in ["object temperature"] + cols_to_wipe[1:]:
+            if col in df.columns:
+                df.loc[offline, col] = "-"
+        # the status is shown in the loop status column
+        df = df.drop(columns="sample status")
+
     # create column odering so label is first
     cols = ["Label"] + [col for col in df.columns if col != "Label"]
 
@@ -229,54 +245,74 @@ def update_measurement_table(_df):
     return data, columns
 
 
-def tail_exclude_external(df, num_rows):
+def _is_external_column(column):
     """
-    Returns the last num_rows rows of the DataFrame excluding the external TECs.
+    Returns True if the column holds the values of an external TEC.
     """
-    return df.loc[~df.index.get_level_values("Plate").str.contains("external")].tail(
-        num_rows
-    )
+    parsed = parse_wide_column(column)
+    return parsed is not None and parsed[1] == "external"
 
 
-def tail_only_external(df, num_rows):
+def tail_window(df, duration):
     """
-    Returns the last num_rows rows of the DataFrame only including the external TECs.
+    Returns the rows (= measurements) of the last duration seconds before the newest measurement.
+    The timestamps must be converted to datetime (see _convert_timestamps).
     """
-    return df.loc[df.index.get_level_values("Plate").str.contains("external")].tail(
-        num_rows
-    )
+    if df.empty:
+        return df
+    timestamps = df["timestamp"]
+    return df[timestamps >= timestamps.iloc[-1] - pd.Timedelta(seconds=duration)]
+
+
+def tail_exclude_external(df, duration):
+    """
+    Returns the rows (= measurements) of the last duration seconds of the DataFrame excluding the external TECs.
+    """
+    columns = [column for column in df.columns if not _is_external_column(column)]
+    return tail_window(df[columns], duration)
+
+
+def tail_only_external(df, duration):
+    """
+    Returns the rows (= measurements) of the last duration seconds of the DataFrame only including the external TECs.
+    """
+    columns = [
+        column
+        for column in df.columns
+        if _is_external_column(column) or parse_wide_column(column) is None
+    ]
+    return tail_window(df[columns], duration)
     
-def tail_and_external(df, num_rows, external_labels):
+def tail_and_external(df, duration, external_labels):
     """
-    Returns the last num_rows rows of the DataFrame and some specified external TECs in two dataframes.
+    Returns the rows (= measurements) of the last duration seconds of the DataFrame and some specified external TECs in two dataframes.
     
     Args:
         df (pd.DataFrame): The DataFrame to slice
-        num_rows (int): The number of rows to return
+        duration (float): The time span to return in seconds
         external_labels (list): List of external TEC labels to include (format is EXTERNAL_{n//2} ({'CH1' if n%2==0 else 'CH2'}))
     """
     if not external_labels:
-        return tail_exclude_external(df, num_rows), None
+        return tail_exclude_external(df, duration), None
     
     # convert labels to ids
     external_ids = [params.get_external_id_from_label(label) for label in external_labels]
     
-    # get the rows that contain the external TECs
-    external_rows = df.loc[df.index.get_level_values("Plate").str.contains("external")]
-    
-    # filter the rows
-    external_rows = external_rows.loc[external_rows.index.get_level_values("TEC").isin(external_ids)]
-    
-    # get the rows that do not contain the external TECs
-    non_external_rows = df.loc[~df.index.get_level_values("Plate").str.contains("external")]
-    
-    # take tail
-    non_external_rows = non_external_rows.tail(num_rows)
-    
-    # take tail of external rows (cut off until timestamp of first row of non_external_rows)
-    external_rows = external_rows.loc[external_rows["timestamp"] >= non_external_rows.iloc[0]["timestamp"]]
+    # take tail, the external TECs are part of the same rows
+    rows = tail_window(df, duration)
+
+    # get the columns that do not contain the external TECs
+    non_external_columns = [column for column in rows.columns if not _is_external_column(column)]
+
+    # get the columns of the specified external TECs
+    external_columns = [
+        column
+        for column in rows.columns
+        if parse_wide_column(column) is None
+        or (_is_external_column(column) and parse_wide_column(column)[2] in external_ids)
+    ]
     
-    return non_external_rows, external_rows
+    return rows[non_external_columns], rows[external_columns]
 
 
 def graphs_tables_callbacks(app):
@@ -297,6 +333,7 @@ def graphs_tables_callbacks(app):
             Output("graph-sum-power", "figure"),
             Output("graph-sum-power-2", "figure"),
             Output("tec-error-overlay", "style"),
+            Output("graphs-state", "data"),
         ],
         [
             Input("interval-component", "n_intervals"),
@@ -306,11 +343,13 @@ def graphs_tables_callbacks(app):
             State("graph-tabs-2", "active_tab"),
             State("initial-load", "children"),
             State("graph-object-temperature-external-probes", "value"),
+            State("graph-time-window", "value"),
+            State("graphs-state", "data"),
         ],
         prevent_initial_call=True,
     )
     def update_components_from_store(
-        n, n_clicks, n_clicks_2, active_tab, active_tab_2, is_app_loaded, object_temp_external_probes
+        n, n_clicks, n_clicks_2, active_tab, active_tab_2, is_app_loaded, object_temp_external_probes, time_window, previous_graphs_state
     ):
 
         # notify the spinner that the app has loaded and is ready for display
@@ -323,20 +362,18 @@ def graphs_tables_callbacks(app):
         reconnecting_code = check_reconnecting()
         if reconnecting_code == 1:
             # display overlay
-            return (dash.no_update,) * 14 + ({"display": "block"},)
-
-        # only show this many datapoints:
-        MAX_DP_OBJECT_TEMP = NUM_TECS * 10 * 60  # 10 min
-        MAX_DP_CURRENT = NUM_TECS * 5 * 60  # 5 min
-        MAX_DP_VOLTAGE = NUM_TECS * 5 * 60  # 5 min
-        MAX_DP_POWER = NUM_TECS * 10 * 60  # 10 min
+            return (dash.no_update,) * 14 + ({"display": "block"}, dash.no_update)
 
-        MAX_DP_OBJECT_TEMP_EXTERNAL = params.num_external_tecs * 10 * 60  # 10 min
+        # only show the measurements of this many seconds:
+        WINDOW_OBJECT_TEMP = 10 * 60  # 10 min
+        WINDOW_CURRENT = 5 * 60  # 5 min
+        WINDOW_VOLTAGE = 5 * 60  # 5 min
+        WINDOW_POWER = 10 * 60  # 10 min
 
-        # get data
-        df_all = get_data_from_store()
+        WINDOW_OBJECT_TEMP_EXTERNAL = 10 * 60  # 10 min
 
-        if df_all is None:
+        # check for data, only the newest measurement is read here
+        if get_latest() is None:
             return dash.no_update
 
         # check that this callback is not already running
@@ -348,25 +385,23 @@ def graphs_tables_callbacks(app):
 
         # try-finally block for the rest of the code to make sure that the lock is unset in every case
         try:
-            # only show this many datapoints:
-            MAX_DP_OBJECT_TEMP = NUM_TECS * 10 * 60  # 10 min
-            MAX_DP_CURRENT = NUM_TECS * 5 * 60  # 5 min
-            MAX_DP_VOLTAGE = NUM_TECS * 5 * 60  # 5 min
-            MAX_DP_POWER = NUM_TECS * 10 * 60  # 10 min
+            # only show the measurements of this many seconds:
+            WINDOW_OBJECT_TEMP = 10 * 60  # 10 min
+            WINDOW_CURRENT = 5 * 60  # 5 min
+            WINDOW_VOLTAGE = 5 * 60  # 5 min
+            WINDOW_POWER = 10 * 60  # 10 min
 
-            # get data
-            df_all = get_data_from_store()
+            # get the most recent measurement, its cost does not depend on the amount of stored data
+            df_latest = get_latest()
 
-            if df_all is None:
+            if df_latest is None:
                 return dash.no_update
 
             # update table
-            # get the most recent measurement
-            df_recent = df_all.tail(NUM_TECS + params.num_external_tecs)
-            table_data, table_columns = update_measurement_table(df_recent)
+            table_data, table_columns = update_measurement_table(get_most_recent(df_latest))
 
             # get the current avergae temperatures
-            avg_top, avg_bottom = get_avg_temps(df_recent)
+            avg_top, avg_bottom = get_avg_temps(df_latest)
 
             # get new instructions from the sequence manager
             instructions = sequence_manager.get_instructions(avg_top, avg_bottom)
@@ -382,15 +417,61 @@ def graphs_tables_callbacks(app):
                     table_columns,
                     sequence_status,
                     app_loading_status,
-                ) + (dash.no_update,) * 11
+                ) + (dash.no_update,) * 12
 
             # Update graphs
 
+            # only redraw the graphs if there is new data or the settings of this client changed
+            store_version = get_store_version()
+            graphs_state = [
+                None if store_version is None else list(store_version[:2]),
+                active_tab,
+                active_tab_2,
+                time_window,
+                object_temp_external_probes,
+            ]
+            if store_version is not None and graphs_state == previous_graphs_state:
+                return (
+                    table_data,
+                    table_columns,
+                    sequence_status,
+                    app_loading_status,
+                ) + (dash.no_update,) * 12
+
+            # get data, only measurements that are new to this process are fetched
+            # and only the shown time span is decoded
+            df_all = get_live_data(
+                max(
+                    WINDOW_OBJECT_TEMP,
+                    WINDOW_CURRENT,
+                    WINDOW_VOLTAGE,
+                    WINDOW_POWER,
+                    WINDOW_OBJECT_TEMP_EXTERNAL,
+                )
+            )
+
+            if df_all is None:
+                return dash.no_update
+
+            # longer time windows are read with a resolution that matches the number of displayed points
+            time_window = int(time_window or 0)
+            if time_window > 0:
+                end = df_all["timestamp"].iloc[-1]
+                df_window = query(
+                    start=end - time_window * 1000,
+                    end=end,
+                    resolution=time_window / GRAPH_POINTS,
+                )
+                if df_window is not None:
+                    df_all = df_window
+                    WINDOW_OBJECT_TEMP = WINDOW_CURRENT = WINDOW_VOLTAGE = WINDOW_POWER = time_window
+                    WINDOW_OBJECT_TEMP_EXTERNAL = time_window
+
             # convert timestamps to datetime
             _convert_timestamps(df_all)
 
             # update main temperature graph
-            df, df_external = tail_and_external(df_all, MAX_DP_OBJECT_TEMP, object_temp_external_probes)
+            df, df_external = tail_and_external(df_all, WINDOW_OBJECT_TEMP, object_temp_external_probes)
             graph_object_temp = update_graph_object_temperature(
                 df=df,
                 df_external=df_external,
@@ -400,7 +481,7 @@ def graphs_tables_callbacks(app):
             # update external temperature graph if applicable
             if params.num_external_tecs > 0:
                 graph_object_temp_external = update_graph_external_temperature(
-                    tail_only_external(df_all, MAX_DP_OBJECT_TEMP_EXTERNAL),
+                    tail_only_external(df_all, WINDOW_OBJECT_TEMP_EXTERNAL),
                     fig_id="graph-object-temperature-external",
                 )
             else:
@@ -411,7 +492,7 @@ def graphs_tables_callbacks(app):
             # tab-1
             graph_all_current = (
                 update_graph_all_current(
-                    tail_exclude_external(df_all, MAX_DP_CURRENT),
+                    tail_exclude_external(df_all, WINDOW_CURRENT),
                     fig_id="graph-all-current",
                 )
                 if active_tab == "tab-current"
@@ -419,7 +500,7 @@ def graphs_tables_callbacks(app):
             )
             graph_all_voltage = (
                 update_graph_all_voltage(
-                    tail_exclude_external(df_all, MAX_DP_VOLTAGE),
+                    tail_exclude_external(df_all, WINDOW_VOLTAGE),
                     fig_id="graph-all-voltage",
                 )
                 if active_tab == "tab-voltage"
@@ -427,7 +508,7 @@ def graphs_tables_callbacks(app):
             )
             graph_all_temperature = (
                 update_graph_all_temperature(
-                    tail_exclude_external(df_all, MAX_DP_OBJECT_TEMP),
+                    tail_exclude_external(df_all, WINDOW_OBJECT_TEMP),
                     fig_id="graph-all-temperature",
                 )
                 if active_tab == "tab-temperature"
@@ -435,7 +516,7 @@ def graphs_tables_callbacks(app):
             )
             graph_sum_power = (
                 update_graph_sum_power(
-                    tail_exclude_external(df_all, MAX_DP_POWER),
+                    tail_exclude_external(df_all, WINDOW_POWER),
                     fig_id="graph-sum-power",
                 )
                 if active_tab == "tab-power"
@@ -445,7 +526,7 @@ def graphs_tables_callbacks(app):
             # tab-2
             graph_all_current2 = (
                 update_graph_all_current(
-                    tail_exclude_external(df_all, MAX_DP_CURRENT),
+                    tail_exclude_external(df_all, WINDOW_CURRENT),
                     fig_id="graph-all-current-2",
                 )
                 if active_tab_2 == "tab-current"
@@ -453,7 +534,7 @@ def graphs_tables_callbacks(app):
             )
             graph_all_voltage2 = (
                 update_graph_all_voltage(
-                    tail_exclude_external(df_all, MAX_DP_VOLTAGE),
+                    tail_exclude_external(df_all, WINDOW_VOLTAGE),
                     fig_id="graph-all-voltage-2",
                 )
                 if active_tab_2 == "tab-voltage"
@@ -461,7 +542,7 @@ def graphs_tables_callbacks(app):
             )
             graph_all_temperature2 = (
                 update_graph_all_temperature(
-                    tail_exclude_external(df_all, MAX_DP_OBJECT_TEMP),
+                    tail_exclude_external(df_all, WINDOW_OBJECT_TEMP),
                     fig_id="graph-all-temperature-2",
                 )
                 if active_tab_2 == "tab-temperature"
@@ -469,7 +550,7 @@ def graphs_tables_callbacks(app):
             )
             graph_sum_power2 = (
                 update_graph_sum_power(
-                    tail_exclude_external(df_all, MAX_DP_POWER),
+                    tail_exclude_external(df_all, WINDOW_POWER),
                     fig_id="graph-sum-power-2",
                 )
                 if active_tab_2 == "tab-power"
@@ -492,6 +573,7 @@ def graphs_tables_callbacks(app):
                 graph_sum_power,
                 graph_sum_power2,
                 {"display": "none"},
+                graphs_state,
             )
         finally:
             set_callback_lock("update_components_from_store", False)
@@ -2,28 +2,50 @@
 Functions to send commands to the TECInterface
 """
 
-import redis
+from time import time
 
+from redis_connection import get_redis
 from redis_keys import REDIS_KEY_START_BACKEND_FEEDBACK, REDIS_KEY_UI_COMMANDS
 import app.param_values as params
 
-r = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+r = get_redis()
 
 # subscribe pubsub channels
 pubsub_backend_start_feedback = r.pubsub()
 pubsub_backend_start_feedback.subscribe(REDIS_KEY_START_BACKEND_FEEDBACK)
 
 
+def _send_command(*parts):
+    """
+    Publishes a command for the running data acquisition.
+    Format: "command$$value1$$value2$$..$$timestamp", the timestamp is used to measure the latency.
+    """
+    r.publish(REDIS_KEY_UI_COMMANDS, "$$".join(map(str, parts + (time(),))))
+
+
 def set_temperature(plate, temp):
-    r.publish(REDIS_KEY_UI_COMMANDS, f"SET_TEMP$${plate}$${temp}")
+    _send_command("SET_TEMP", plate, temp)
 
 
 def disable_all_plates():
-    r.publish(REDIS_KEY_UI_COMMANDS, "DISABLE_ALL")
+    _send_command("DISABLE_ALL")
 
 
 def enable_all_plates():
-    r.publish(REDIS_KEY_UI_COMMANDS, "ENABLE_ALL")
+    _send_command("ENABLE_ALL")
+
+
+def start_burst_capture(plate, tec_id, duration, parameters):
+    """
+    Records parameters of one TEC at the maximum achievable rate for a few seconds.
+
+    Args:
+        plate (str): top or bottom
+        tec_id (int): id of the TEC on the plate
+        duration (float): duration of the capture in seconds
+        parameters (list of str): parameters to record, e.g. "object temperature"
+    """
+    _send_command("BURST", plate, tec_id, duration, "$".join(parameters))
 
 
 def start_backend(optional_tec_controllers=None):
@@ -23,6 +23,12 @@ def data_table():
                     "backgroundColor": "#90EE90",
                     "color": "black",
                 },
+                # Offline status - Grey
+                {
+                    "if": {"filter_query": '{loop status} = "Offline"'},
+                    "backgroundColor": "#D3D3D3",
+                    "color": "black",
+                },
             ],
             style_table={'overflowX': 'auto'},  # horizontal scrolling instead of overflow
         )
\ No newline at end of file
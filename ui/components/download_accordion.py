@@ -1,5 +1,25 @@
 import dash_bootstrap_components as dbc
-from dash import html
+from dash import dcc, html
+
+from app.burst_capture import MAX_BURST_DURATION
+from ui.export import EXPORT_FORMATS, EXPORT_RESOLUTIONS
+
+# parameters that can be selected for the download
+DOWNLOAD_OPTIONS = [
+    {"label": "Loop Status", "value": "loop status"},
+    {
+        "label": "Object Temperature",
+        "value": "object temperature",
+    },
+    {
+        "label": "Target Temperature",
+        "value": "target object temperature",
+    },
+    {"label": "Output Current", "value": "output current"},
+    {"label": "Output Voltage", "value": "output voltage"},
+    {"label": "Output Power", "value": "output power"},
+    {"label": "Sample Rate", "value": "sample rate"},
+]
 
 
 def download_accordion():
@@ -10,57 +30,203 @@ def download_accordion():
                     html.P("Select applicable columns:"),
                     dbc.Checklist(
                         id="checkboxes-download",
-                        options=[
-                            {"label": "Loop Status", "value": "loop status"},
-                            {
-                                "label": "Object Temperature",
-                                "value": "object temperature",
-                            },
-                            {
-                                "label": "Target Temperature",
-                                "value": "target object temperature",
-                            },
-                            {"label": "Output Current", "value": "output current"},
-                            {"label": "Output Voltage", "value": "output voltage"},
-                            {"label": "Output Power", "value": "output power"},
-                        ],
+                        options=DOWNLOAD_OPTIONS,
                         value=[
-                            "loop status",
-                            "object temperature",
-                            "target object temperature",
-                            "output current",
-                            "output voltage",
-                            "output power",
+                            option["value"] for option in DOWNLOAD_OPTIONS
                         ],  # Default selected
                     ),
-                    download_btn('btn-download-csv'),
+                    format_select("select-download-format"),
+                    export_controls("download"),
                 ],
                 title="Download Data",
             ),
             dbc.AccordionItem(
                 children=[
                     html.P(
-                        "You might be able to recover the data from your previous session here:"
+                        "You might be able to recover the data from your previous sessions here:"
                     ),
-                    dbc.Button(
-                        "Download recovered data as CSV",
-                        color="primary",
-                        id="btn-download-recovered-csv",
-                        class_name="mt-2",
+                    dbc.InputGroup(
+                        [
+                            dbc.InputGroupText("Session"),
+                            dbc.Select(
+                                id="select-recovered-session",
+                                options=[],  # filled via callback
+                            ),
+                        ],
+                        style={"maxWidth": 500},
                     ),
+                    format_select("select-recovered-format"),
+                    resolution_select("select-recovered-resolution"),
+                    export_controls("recovered"),
                 ],
                 title="Recover Data",
+                item_id="item-recover-data",
             ),
+            burst_capture_item(),
         ],
+        id="download-accordion",
         start_collapsed=True,
         class_name="mt-3 mb-3",
     )
 
 
-def download_btn(id, label="Download as CSV"):
+def format_select(id):
+    """
+    Selector for the file format of a download.
+    """
+    return dbc.InputGroup(
+        [
+            dbc.InputGroupText("Format"),
+            dbc.Select(
+                id=id,
+                options=[
+                    {"label": label, "value": export_format}
+                    for export_format, (label, _, _) in EXPORT_FORMATS.items()
+                ],
+                value="csv",
+            ),
+        ],
+        class_name="mt-2",
+        style={"maxWidth": 300},
+    )
+
+
+def resolution_select(id):
+    """
+    Selector for the resolution of a download, aggregated data is much smaller for long sessions.
+    """
+    return dbc.InputGroup(
+        [
+            dbc.InputGroupText("Resolution"),
+            dbc.Select(
+                id=id,
+                options=[
+                    {"label": label, "value": resolution}
+                    for resolution, (label, _) in EXPORT_RESOLUTIONS.items()
+                ],
+                value="raw",
+            ),
+        ],
+        class_name="mt-2",
+        style={"maxWidth": 300},
+    )
+
+
+def export_controls(prefix):
+    """
+    Button starting an export job in the background, its progress and the link to the finished file.
+    The job id is kept in a store, see the export callbacks.
+
+    prefix: prefix of the ids, e.g. "download"
+    """
+    return html.Div(
+        [
+            dbc.Button(
+                "Prepare download",
+                color="primary",
+                id=f"btn-{prefix}-export",
+                class_name="mt-2 me-2",
+            ),
+            # the link is set via callback once the file is ready
+            download_btn(
+                f"btn-{prefix}-export-download", "Download", is_link=True, disabled=True
+            ),
+            html.Div(id=f"{prefix}-export-status", className="mt-2"),
+            dcc.Store(id=f"{prefix}-export-job", data=None),
+        ]
+    )
+
+
+def download_btn(id, label="Download as CSV", href=None, is_link=None, disabled=False):
+    """
+    Button for a download. As a link, the button points to a download route (see ui.export),
+    otherwise the download is handled by a callback.
+
+    href: url of the download, can also be set via callback
+    is_link: whether the button is a link, True if an href is given
+    disabled: whether the button is disabled initially
+    """
+    if is_link is None:
+        is_link = href is not None
     return dbc.Button(
         label,
         color="primary",
         id=id,
         class_name="mt-2",
+        href=href,
+        external_link=is_link,
+        disabled=disabled,
+    )
+
+
+def burst_capture_item():
+    """
+    Accordion item to record one TEC at a high rate for a few seconds, e.g. for tuning the PID parameters.
+    """
+    return dbc.AccordionItem(
+        [
+            html.P(
+                "Record one TEC at the maximum rate for a few seconds. "
+                "The other TEC on the same control board is not sampled during the capture."
+            ),
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.InputGroup(
+                            [
+                                dbc.InputGroupText("TEC"),
+                                dbc.Select(
+                                    id="select-burst-tec",
+                                    options=[
+                                        {"label": f"{plate.upper()}_{tec_id}", "value": f"{plate}${tec_id}"}
+                                        for plate in ["top", "bottom"]
+                                        for tec_id in range(4)
+                                    ],
+                                    value="top$0",
+                                ),
+                            ]
+                        ),
+                        width="auto",
+                    ),
+                    dbc.Col(
+                        dbc.InputGroup(
+                            [
+                                dbc.InputGroupText("Duration"),
+                                dbc.Input(
+                                    id="input-burst-duration",
+                                    type="number",
+                                    min=1,
+                                    max=MAX_BURST_DURATION,
+                                    step=1,
+                                    value=10,
+                                    style={"maxWidth": 100},
+                                ),
+                                dbc.InputGroupText("s"),
+                            ]
+                        ),
+                        width="auto",
+                    ),
+                ],
+                class_name="mb-2",
+            ),
+            dbc.Checklist(
+                id="checkboxes-burst",
+                options=[
+                    {"label": "Object Temperature", "value": "object temperature"},
+                    {"label": "Output Current", "value": "output current"},
+                    {"label": "Output Voltage", "value": "output voltage"},
+                    {"label": "Ramp Temperature", "value": "ramp temperature"},
+                ],
+                value=["object temperature", "output current"],  # Default selected
+            ),
+            html.Div(id="burst-capture-status", className="mt-2"),
+            dbc.Button(
+                "Start Burst Capture",
+                color="primary",
+                id="btn-start-burst",
+                class_name="mt-2 me-2",
+            ),
+            download_btn("btn-download-burst-csv"),
+        ],
+        title="Burst Capture",
     )
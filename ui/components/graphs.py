@@ -6,6 +6,13 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objs as go
 import app.param_values as params
+from app.measurement_schema import parse_wide_column, wide_columns
+from app.tick_aggregates import (
+    average_column,
+    get_tick_aggregate,
+    max_abs_column,
+    sum_column,
+)
 
 
 # remove these buttons from all graphs
@@ -15,10 +22,23 @@ GRAPH_BUTTONS_TO_REMOVE = ["lasso2d", "select2d", "autoScale2d"]
 # format: id: [ymin, ymax]
 graph_yaxis_ranges = {}
 
+# selectable time windows of the graphs (in seconds), 0 shows the live data
+GRAPH_TIME_WINDOWS = [
+    ("Live", 0),
+    ("1 h", 60 * 60),
+    ("6 h", 6 * 60 * 60),
+    ("24 h", 24 * 60 * 60),
+    ("7 d", 7 * 24 * 60 * 60),
+]
+
+# number of points per line shown for the longer time windows
+GRAPH_POINTS = 600
+
 
 def graphs(app):
     return html.Div(
         [
+            time_window_selector(),
             dbc.Card(
                 dbc.CardBody(
                     html.Div(
@@ -106,6 +126,27 @@ def graphs(app):
     )
 
 
+def time_window_selector():
+    """
+    Selector for the time window shown in all graphs.
+    """
+    return dbc.InputGroup(
+        [
+            dbc.InputGroupText("Time window"),
+            dbc.Select(
+                id="graph-time-window",
+                options=[
+                    {"label": label, "value": seconds}
+                    for label, seconds in GRAPH_TIME_WINDOWS
+                ],
+                value=0,
+                style={"maxWidth": 150},
+            ),
+        ],
+        class_name="mt-3",
+    )
+
+
 def graph_with_config_and_controls(app, id, controls_external=False):
     """
     Creates a graph with a predefined configuration and controls for the y-axis range.
@@ -347,18 +388,34 @@ def set_yaxis(fig_id, fig):
 
 def update_graph_object_temperature(df, fig_id, df_external=None):
 
-    # Group by Plate and Timestamp, then calculate mean
-    avg_temps = (
-        df.groupby(["Plate", "timestamp"])["object temperature"].mean().reset_index()
-    )
-
-    # reset multiindex
-    temp_df = df.reset_index()
-
-    # Extract the first target temperature for each Plate at each timestamp
-    target_temps = temp_df.drop_duplicates(subset=["Plate", "timestamp"])[
-        ["Plate", "timestamp", "target object temperature"]
-    ]
+    # the average temperature of each Plate is computed by the data acquisition,
+    # the target temperature is the one of the first TEC of the Plate
+    avg_temps = []
+    target_temps = []
+    for plate in ["bottom", "top"]:
+        target_columns = wide_columns(df, "target object temperature", plates=[plate])
+        if not target_columns:
+            continue
+        avg_temps.append(
+            pd.DataFrame(
+                {
+                    "Plate": plate,
+                    "timestamp": df["timestamp"],
+                    "object temperature": get_tick_aggregate(df, average_column(plate)),
+                }
+            )
+        )
+        target_temps.append(
+            pd.DataFrame(
+                {
+                    "Plate": plate,
+                    "timestamp": df["timestamp"],
+                    "target object temperature": df[target_columns[0]],
+                }
+            )
+        )
+    avg_temps = pd.concat(avg_temps, ignore_index=True)
+    target_temps = pd.concat(target_temps, ignore_index=True)
 
     # Format the Timestamps to hh:mm:ss
     format_timestamps(avg_temps)
@@ -392,28 +449,27 @@ def update_graph_object_temperature(df, fig_id, df_external=None):
 
     # add external TECs if available
     if df_external is not None:
-        # reset multiindex
-        df_ext = df_external.reset_index()
+        df_ext = df_external.copy()
         # format timestamps
         format_timestamps(df_ext)
 
-        # add one trace per unique TEC
-        unique_tecs = sorted(df_ext["TEC"].unique())
-        for i, tec_id in enumerate(unique_tecs):
-            subset = df_ext[df_ext["TEC"] == tec_id]
+        # add one trace per TEC column
+        ext_columns = wide_columns(df_ext, "object temperature")
+        for i, column in enumerate(ext_columns):
+            _, _, tec_id = parse_wide_column(column)
             label = params.get_external_tec_label_from_id(tec_id)
 
             fig.add_trace(
                 go.Scatter(
-                    x=subset["timestamp"],
-                    y=subset["object temperature"],
+                    x=df_ext["timestamp"],
+                    y=df_ext[column],
                     mode="lines+markers",
                     name=label,
                     line=dict(
                         color=(
                             color_map[label]
                             if label in color_map
-                            else f"hsl({i*360//len(unique_tecs)}, 50%, 50%)"
+                            else f"hsl({i*360//len(ext_columns)}, 50%, 50%)"
                         )
                     ),
                 )
@@ -471,17 +527,12 @@ def update_graph_max_abs_generic(df, parameter, label, unit, fig_id):
     unit: label of unit, e.g. "A"
     """
 
-    # Keep only necessary columns
-    df = df[[parameter, "timestamp"]]
-
-    # Group by timestamp first
-    grouped_by_timestamp = df.groupby("timestamp")
-
-    # Find the value with the maximum absolute value in each group
-    max_abs = (
-        grouped_by_timestamp[parameter]
-        .apply(lambda x: x.loc[x.abs().idxmax()])
-        .reset_index()
+    # value with the maximum absolute value at each timestamp, computed by the data acquisition
+    max_abs = pd.DataFrame(
+        {
+            "timestamp": df["timestamp"].to_numpy(),
+            parameter: get_tick_aggregate(df, max_abs_column(parameter)),
+        }
     )
 
     # format timestamps
@@ -527,11 +578,18 @@ def update_graph_all_generic(_df, parameter, label, unit, fig_id, is_external=Fa
     is_external: whether the data is from external TECs
     """
 
-    # reset multiindex
-    df = _df.reset_index()
+    # one row per TEC and timestamp
+    columns = wide_columns(_df, parameter)
+    df = _df[["timestamp"] + columns].melt(
+        id_vars="timestamp", var_name="Label", value_name=parameter
+    )
 
-    # Create a 'Label' column
-    df["Label"] = df["Plate"].str.upper() + "_" + df["TEC"].astype(str)
+    # Create the labels from the column names
+    labels = {}
+    for column in columns:
+        _, plate, tec_id = parse_wide_column(column)
+        labels[column] = f"{plate.upper()}_{tec_id}"
+    df["Label"] = df["Label"].map(labels)
 
     # for the externals, specify the channel
     df.loc[df["Label"].str.contains("EXTERNAL"), "Label"] = (
@@ -613,14 +671,13 @@ def update_graph_sum_generic(_df, parameter, label, unit, fig_id):
     unit: label of unit, e.g. "A"
     """
 
-    # reset multiindex
-    df = _df.reset_index()
-
-    # Keep only necessary columns
-    df = df[[parameter, "timestamp"]]
-
-    # Group by timestamp and take the sum of the parameter
-    df = df.groupby("timestamp").sum().reset_index()
+    # sum of the TEC columns at each timestamp, computed by the data acquisition
+    df = pd.DataFrame(
+        {
+            "timestamp": _df["timestamp"].to_numpy(),
+            parameter: get_tick_aggregate(_df, sum_column(parameter)),
+        }
+    )
 
     # format timestamps
     format_timestamps(df)
@@ -2,6 +2,7 @@ import dash_bootstrap_components as dbc
 from dash import html
 
 from ui.components.download_accordion import download_btn
+from ui.export import export_url
 
 
 def tec_error_page():
@@ -42,7 +43,9 @@ def tec_error_page():
                             "Some TECs are have encountered an error and are currently rebooting. Trying to reconnect..."
                         ),
                         download_btn(
-                            "btn-download-csv-reconnecting", "Download data as CSV"
+                            "btn-download-csv-reconnecting",
+                            "Download data as CSV",
+                            href=export_url(),
                         ),
                     ],
                 ),
@@ -0,0 +1,262 @@
+"""
+Compressed in-memory storage of measurements in the wide layout, inspired by the Gorilla time series encoding.
+
+Measurements are kept in blocks of BLOCK_ROWS rows, only the newest (not full) block is kept decoded:
+    - timestamps are stored as the difference of consecutive differences (delta of delta), which is
+      almost always 0 or tiny for a steady sample rate, in the smallest integer type that fits.
+    - every value is XORed with the previous value of its column. Unchanged values give 0 and are
+      only marked in a bitmask, the other XORs share their leading and trailing zero bits within the block,
+      so only the bits in between are stored.
+All steps are vectorized with NumPy, so a block is decoded at once. The encoding is lossless (NaN included).
+"""
+
+from bisect import bisect_right
+
+import numpy as np
+import pandas as pd
+
+# number of measurements per compressed block
+BLOCK_ROWS = 512
+
+
+def _bit_length(value):
+    """
+    Returns the number of bits needed for an unsigned integer.
+    """
+    return int(value).bit_length()
+
+
+def encode_timestamps(timestamps):
+    """
+    Encodes increasing integer timestamps as the first timestamp, the first difference
+    and the differences of the differences.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    deltas = np.diff(timestamps)
+    delta_of_deltas = np.diff(deltas)
+    dtype = np.int64
+    if len(delta_of_deltas) > 0:
+        largest = max(abs(int(delta_of_deltas.min())), abs(int(delta_of_deltas.max())))
+        dtype = next(
+            t for t in [np.int8, np.int16, np.int32, np.int64] if largest <= np.iinfo(t).max
+        )
+    return {
+        "first": int(timestamps[0]),
+        "delta": int(deltas[0]) if len(deltas) > 0 else 0,
+        "delta_of_deltas": delta_of_deltas.astype(dtype),
+        "rows": len(timestamps),
+    }
+
+
+def decode_timestamps(encoded):
+    """
+    Decodes timestamps encoded by encode_timestamps.
+    """
+    deltas = np.empty(encoded["rows"] - 1, dtype=np.int64)
+    if len(deltas) > 0:
+        deltas[0] = encoded["delta"]
+        deltas[1:] = encoded["delta_of_deltas"]
+        deltas = np.cumsum(deltas)
+    return encoded["first"] + np.concatenate([[0], np.cumsum(deltas)])
+
+
+def encode_values(values):
+    """
+    Encodes numeric values by XORing every value with the previous one.
+    Only the non-zero XORs are stored, with the bits between their common leading and trailing zeros.
+    """
+    dtype = values.dtype
+    unsigned = np.dtype(f"u{dtype.itemsize}")
+    bits = np.ascontiguousarray(values).view(unsigned)
+
+    xors = bits[1:] ^ bits[:-1]
+    changed = xors != 0
+    changed_xors = xors[changed]
+
+    # bits shared by all changed values of the block
+    combined = int(np.bitwise_or.reduce(changed_xors)) if len(changed_xors) > 0 else 0
+    shift = (combined & -combined).bit_length() - 1 if combined else 0
+    width = _bit_length(combined) - shift if combined else 0
+
+    packed = np.zeros(0, dtype=np.uint8)
+    if width > 0:
+        # big-endian bytes of every value, only the lowest width bits after the shift are kept
+        shifted = (changed_xors >> unsigned.type(shift)).astype(unsigned.newbyteorder(">"))
+        value_bits = np.unpackbits(shifted.view(np.uint8).reshape(-1, dtype.itemsize), axis=1)
+        packed = np.packbits(value_bits[:, 8 * dtype.itemsize - width :])
+
+    return {
+        "dtype": dtype,
+        "first": bits[:1].copy(),
+        "changed": np.packbits(changed),
+        "shift": shift,
+        "width": width,
+        "bits": packed,
+        "rows": len(values),
+    }
+
+
+def decode_values(encoded):
+    """
+    Decodes values encoded by encode_values.
+    """
+    dtype = encoded["dtype"]
+    unsigned = np.dtype(f"u{dtype.itemsize}")
+    num_xors = encoded["rows"] - 1
+
+    changed = np.unpackbits(encoded["changed"], count=num_xors).astype(bool)
+    xors = np.zeros(num_xors, dtype=unsigned)
+
+    width = encoded["width"]
+    if width > 0:
+        num_changed = int(changed.sum())
+        value_bits = np.unpackbits(encoded["bits"], count=num_changed * width).reshape(
+            num_changed, width
+        )
+        # pad to whole values again
+        value_bits = np.concatenate(
+            [
+                np.zeros((num_changed, 8 * dtype.itemsize - width), dtype=np.uint8),
+                value_bits,
+            ],
+            axis=1,
+        )
+        changed_xors = (
+            np.packbits(value_bits, axis=1)
+            .view(unsigned.newbyteorder(">"))
+            .ravel()
+            .astype(unsigned)
+        )
+        xors[changed] = changed_xors << unsigned.type(encoded["shift"])
+
+    bits = np.bitwise_xor.accumulate(np.concatenate([encoded["first"], xors]))
+    return bits.view(dtype)
+
+
+def _block_nbytes(block):
+    """
+    Returns the memory used by the arrays of an encoded block.
+    """
+    return sum(
+        value.nbytes
+        for _, encoded in block.values()
+        for value in encoded.values()
+        if isinstance(value, np.ndarray)
+    )
+
+
+class CompressedFrame:
+    """
+    Measurements in the wide layout (sorted by time) kept in compressed blocks. Rows are appended at the end
+    and whole blocks are dropped at the beginning, so it is suited for the live window.
+    """
+
+    def __init__(self, df):
+        """
+        Args:
+            df (pd.DataFrame): first measurements in the wide layout, defines the columns.
+        """
+        self.columns = list(df.columns)
+        self.dtypes = df.dtypes
+        self._blocks = []
+        self._block_rows = 0
+        self._block_bytes = 0
+        self._head = df.iloc[:0]
+        self.append(df)
+
+    def matches(self, df):
+        """
+        Returns whether measurements can be appended, i.e. they have the same columns and dtypes.
+        """
+        return list(df.columns) == self.columns and (df.dtypes == self.dtypes).all()
+
+    def append(self, df):
+        """
+        Appends measurements, full blocks are compressed.
+        """
+        head = pd.concat([self._head, df], ignore_index=True) if len(self._head) > 0 else df.copy()
+        while len(head) >= BLOCK_ROWS:
+            block = self._encode_block(head.iloc[:BLOCK_ROWS])
+            self._blocks.append(block)
+            self._block_rows += BLOCK_ROWS
+            self._block_bytes += _block_nbytes(block)
+            head = head.iloc[BLOCK_ROWS:].reset_index(drop=True)
+        self._head = head.reset_index(drop=True)
+
+    def _encode_block(self, df):
+        """
+        Compresses a block of measurements. Columns that are not numeric are kept as they are.
+        """
+        block = {}
+        for column in self.columns:
+            values = df[column].to_numpy()
+            if column == "timestamp":
+                block[column] = ("timestamps", encode_timestamps(values))
+            elif values.dtype.kind in "biuf":
+                block[column] = ("values", encode_values(values))
+            else:
+                block[column] = ("raw", {"values": values.copy()})
+        return block
+
+    def _decode_block(self, block):
+        """
+        Decodes a compressed block into a dataframe.
+        """
+        columns = {}
+        for column, (encoding, encoded) in block.items():
+            if encoding == "timestamps":
+                columns[column] = decode_timestamps(encoded).astype(self.dtypes[column])
+            elif encoding == "values":
+                columns[column] = decode_values(encoded)
+            else:
+                columns[column] = encoded["values"].copy()
+        return pd.DataFrame(columns, columns=self.columns)
+
+    def __len__(self):
+        return self._block_rows + len(self._head)
+
+    @property
+    def last_timestamp(self):
+        """
+        Timestamp of the newest measurement.
+        """
+        if len(self._head) > 0:
+            return int(self._head["timestamp"].iloc[-1])
+        return int(self._decode_block(self._blocks[-1])["timestamp"].iloc[-1])
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the measurements in bytes.
+        """
+        return self._block_bytes + int(self._head.memory_usage(index=False).sum())
+
+    def trim(self, max_bytes):
+        """
+        Drops the oldest blocks until the measurements use at most max_bytes.
+        The measurements that are not compressed yet are always kept.
+        """
+        while self._blocks and self.nbytes > max_bytes:
+            self._block_bytes -= _block_nbytes(self._blocks.pop(0))
+            self._block_rows -= BLOCK_ROWS
+
+    def to_dataframe(self, start=None):
+        """
+        Returns the measurements from the timestamp start on (all if None) as a new dataframe.
+        Only the blocks containing them are decoded.
+        """
+        # first timestamp of every block and of the measurements that are not compressed yet
+        first_timestamps = [block["timestamp"][1]["first"] for block in self._blocks]
+        if len(self._head) > 0:
+            first_timestamps.append(int(self._head["timestamp"].iloc[0]))
+        first_block = 0
+        if start is not None:
+            # the last block starting at or before the start may contain measurements after it
+            first_block = max(bisect_right(first_timestamps, start) - 1, 0)
+
+        frames = [self._decode_block(block) for block in self._blocks[first_block:]]
+        frames.append(self._head.copy())
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if start is not None:
+            df = df[df["timestamp"] >= start]
+        return df.reset_index(drop=True)
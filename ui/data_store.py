@@ -1,32 +1,84 @@
 """
-Handles the data store. Dataframes are converted to base64 using parquet and then stored.
+Handles the data store. Dataframes are stored as raw bytes in the Arrow IPC stream format,
+archived data (previous session) as raw Parquet bytes.
+All stored measurements follow the compact schema of app.measurement_schema and are kept in the
+wide layout with one row per measurement, use get_most_recent or to_long for the long layout.
+The live window is read from the shared memory ring of the data acquisition if it runs on the same machine.
+The newest measurement is also kept in its own small key, so the current state is read without the history.
+Every stored measurement increments the version of the store. The UI process keeps a compressed copy of the newest
+measurements, which only fetches measurements newer than its version (see get_live_data).
+
+The current data is stored append-only: every tick is pushed to a small hot segment, which is sealed
+into an immutable segment key once it is full. Sealed segments are kept in an ordered index,
+so readers only fetch the segments they need. Once enough sealed segments left the live window,
+they are moved to the archive on disk (Parquet files or an SQLite database, see ui.segment_archive),
+so redis memory stays bounded. The live window and the segments in redis are sized by memory budgets
+in bytes, see get_memory_usage for the accounting.
+Finished sessions are kept in the same on-disk format and listed in a catalog, so any of them can be read.
+Rollup tiers with a coarser resolution (see ui.rollups) are maintained as data arrives, so long time
+ranges can be read without touching the raw data.
 """
 
 import base64
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 import io
+from threading import Lock
 from time import sleep, time
 import dash
-import redis
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 
-from app.param_values import NUM_TECS
+from app.measurement_schema import (
+    apply_schema,
+    parse_wide_column,
+    to_long,
+    to_wide,
+)
+from ui.compressed_series import CompressedFrame
+from ui.rollups import (
+    COUNT_COLUMN,
+    ROLLUP_TIERS,
+    RollupAggregator,
+    base_parameter,
+    reaggregate,
+)
+from ui.segment_archive import (
+    CURRENT_SESSION,
+    PREVIOUS_SESSION,
+    SessionCatalog,
+    open_archive,
+)
+from ui.shared_ring import read_shared_ring
+from redis_connection import get_redis
 from redis_keys import (
-    REDIS_HOST,
+    REDIS_KEY_BURST_CAPTURE,
+    REDIS_KEY_BURST_CAPTURE_STATUS,
+    REDIS_KEY_LATEST,
+    REDIS_KEY_LEGACY_STORE_ALL,
     REDIS_KEY_PREFIX_CALLBACK_LOCK,
+    REDIS_KEY_PREFIX_ROLLUP,
+    REDIS_KEY_PREFIX_ROLLUP_INDEX,
     REDIS_KEY_PREVIOUS_DATA,
     REDIS_KEY_RECONNECTING,
+    REDIS_KEY_PREFIX_SEGMENT,
+    REDIS_KEY_SEGMENT_INDEX,
     REDIS_KEY_TEC_CONNECTION_STATUS,
-    REDIS_KEY_STORE_ALL,
-    REDIS_PORT,
     REDIS_KEY_STORE,
+    REDIS_KEY_STORE_BYTES,
+    REDIS_KEY_STORE_VERSION,
 )
 
 # timestamp of the last data pulled
 _last_data_timestamp = None
 
 # redis connection for storing data
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+r = get_redis()
+
+# redis connection for binary values, used for the data itself
+r_data = get_redis(decode_responses=False)
 
 
 # delete all callback lock channels
@@ -48,111 +100,752 @@ except Exception as e:
     input("Press Enter to continue....")
     exit()
 
-# this is the maximum number of rows that will be stored
-# everything above this will be moved to the STORE_ALL channel
-MAX_ROWS_STORAGE = 8000
+# memory budget of the live window in bytes (decoded), the number of measurements follows from the size
+# of one measurement, so it adapts to the number of TECs and columns (see live_window_rows)
+# older data stays in the store but is only read when all data is requested
+LIVE_WINDOW_BYTES = 512 * 1024
+
+# memory budget of the sealed segments in redis in bytes, older segments are moved to the archive
+# at least the live window is always kept in redis
+REDIS_SEGMENTS_BYTES = 4 * 1024 * 1024
+
+# memory budget of the compressed copy of the newest measurements kept by the UI process (see get_live_data),
+# it grows beyond the live window as measurements arrive, which covers hours of data
+LIVE_CACHE_BYTES = 8 * 1024 * 1024
+
+# number of sealed segments fetched per round trip while reading the live window
+LIVE_READ_SEGMENTS = 8
+
+# number of ticks collected in the hot segment before it is sealed
+SEGMENT_TICKS = 60
+
+# memory budget of the hot segment in redis in bytes, it is sealed earlier if its ticks exceed it
+# (e.g. with many TECs)
+HOT_SEGMENT_BYTES = 1024 * 1024
+
+# minimum number of sealed segments over the budget that are moved to one archive file together
+ARCHIVE_FILE_SEGMENTS = 60
+
+# number of rows per chunk of a rollup tier
+ROLLUP_CHUNK_ROWS = 60
+
+# memory budget of every rollup tier in redis in bytes (interval in seconds -> bytes), the oldest chunks
+# are removed once a tier exceeds it, even within its retention. Tiers without a budget are only limited by their retention.
+ROLLUP_TIER_BYTES = {
+    10: 16 * 1024 * 1024,
+    60: 16 * 1024 * 1024,
+}
+
+# aggregators and the newest (not full) chunk of every rollup tier, only used by the data acquisition
+_rollup_aggregators = {interval: RollupAggregator(interval) for interval, _ in ROLLUP_TIERS}
+_rollup_chunks = {}
+
+# sealed segments are archived (and compressed) in one background thread, so the data acquisition is not delayed,
+# only used by the data acquisition
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+_archive_future = None
+
+# compressed copy of the newest measurements of the UI process and the version of the store it reflects,
+# shared by all clients
+_live_cache = {"generation": None, "version": None, "frame": None}
+_live_cache_lock = Lock()
+
+
+def live_window_rows(data):
+    """
+    Returns the number of measurements (whole ticks) in the live window.
+
+    Args:
+        data (pd.DataFrame or pa.Table): measurements in the wide layout, used for the size of one measurement.
+    """
+    if isinstance(data, pa.Table):
+        num_bytes = data.nbytes
+    else:
+        num_bytes = int(data.memory_usage(index=False).sum())
+    row_bytes = max(num_bytes // max(len(data), 1), 1)
+    return max(LIVE_WINDOW_BYTES // row_bytes, 1)
+
+
+# on-disk archive of the current session and catalog of the finished sessions
+current_archive = open_archive(CURRENT_SESSION)
+session_catalog = SessionCatalog()
+
+
+def df_to_arrow(df):
+    """
+    Converts a dataframe (without its index) to bytes in the Arrow IPC stream format for storage
+    """
+    return table_to_arrow(pa.Table.from_pandas(df, preserve_index=False))
+
 
-# when the above limit of rows above is exceeded, this many rows will be moved
-REMOVE_ROWS_COUNT = 1504
+def table_to_arrow(table):
+    """
+    Converts an Arrow table to bytes in the Arrow IPC stream format for storage
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
 
-# do not disrupt data
-assert REMOVE_ROWS_COUNT % NUM_TECS == 0
+
+def arrow_to_table(data):
+    """
+    Reads an Arrow table from Arrow IPC stream bytes without copying the buffers
+    """
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all()
 
 
-def df_to_base64(df):
+def tables_to_df(tables):
+    """
+    Converts a list of Arrow tables to one dataframe.
+    The tables are concatenated in Arrow, so pandas only converts once.
+    Columns missing in some tables (e.g. data of older versions) are filled with nulls.
+    Returns None for an empty list.
     """
-    Converts a dataframe to base64 with parquet for storage
+    if not tables:
+        return None
+    table = (
+        pa.concat_tables(tables, promote_options="default")
+        if len(tables) > 1
+        else tables[0]
+    )
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def arrows_to_df(encoded_frames):
+    """
+    Converts a list of Arrow IPC stream bytes back to one dataframe.
+    Returns None for an empty list.
+    """
+    return tables_to_df(
+        [arrow_to_table(data) for data in encoded_frames if data is not None]
+    )
+
+
+def arrow_to_df(data):
+    """
+    Converts Arrow IPC stream bytes back to a dataframe
+    """
+    return arrows_to_df([data])
+
+
+def df_to_parquet(df):
+    """
+    Converts a dataframe to parquet bytes for archiving
     """
     buffer = io.BytesIO()
-    df.to_parquet(buffer, index=True)  # includes index
-    encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    return encoded
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
 
 
-def base64_to_df(encoded):
+def parquet_to_df(data):
     """
-    Converts a base64 with parquet encoded dataframe back to a dataframe
+    Converts parquet bytes back to a dataframe.
+    Also reads the base64 encoded parquet of older versions.
     """
-    data = base64.b64decode(encoded)
-    buffer = io.BytesIO(data)
-    df = pd.read_parquet(buffer)
-    return df
+    if not data.startswith(b"PAR1"):
+        data = base64.b64decode(data)
+    return pd.read_parquet(io.BytesIO(data))
 
 
 def get_most_recent(df):
     """
-    Will return the last x rows from a dataframe that all have the same timestamp
+    Will return the most recent measurement in the long layout, i.e. one row per TEC
+    """
+    return to_long(df.tail(1))
+
+
+def get_latest():
+    """
+    Returns the newest measurement of the current data in the wide layout (one row),
+    including the tick aggregates, or None if there is no data.
+    The cost does not depend on the amount of stored data.
+    """
+    # the data acquisition shares the newest measurement directly when it runs on this machine,
+    # redis is read if it does not or stopped appending to the ring
+    df = read_shared_ring(1)
+    if df is not None:
+        return df
+
+    data = r_data.get(REDIS_KEY_LATEST)
+    if data is None:
+        return None
+    return arrow_to_df(data)
+
+
+def _segment_sizes(keys):
+    """
+    Returns the sizes of sealed segments (or rollup chunks) in bytes as stored in redis,
+    0 for keys that do not exist anymore.
     """
-    # get the most recent timestamp from the last row and return all rows with that one
-    last_index = len(df) - 1
-    most_recent_timestamp = df.iloc[last_index]["timestamp"]
+    if not keys:
+        return []
+    pipe = r_data.pipeline(transaction=False)
+    for key in keys:
+        pipe.strlen(key)
+    return pipe.execute()
+
 
-    # Iterate backwards until a different timestamp is found
-    for i in range(last_index, -1, -1):
-        if df.iloc[i]["timestamp"] != most_recent_timestamp:
-            # Slice from the next index to the end to get all rows with the most recent timestamp
-            return df.iloc[i + 1 :]
-    return df  # In case all rows have the same timestamp
+def _read_segments(keys):
+    """
+    Fetches sealed segments. Returns a list of Arrow IPC stream bytes in the order of the keys.
+    """
+    if not keys:
+        return []
+    return r_data.mget(keys)
 
 
 def get_data_from_store(channel=REDIS_KEY_STORE):
     """
-    Gets the data from the store and returns a dataframe with the data
+    Gets the data from the store and returns a dataframe with the data.
+    For the current data, this is the live window of the newest measurements within LIVE_WINDOW_BYTES.
+    It is read from shared memory if available and its writer is still appending, otherwise from redis.
     """
+    if channel == REDIS_KEY_PREVIOUS_DATA:
+        # the newest finished session
+        sessions = get_sessions()
+        if not sessions:
+            return None
+        return query_session(sessions[-1]["id"])
+
+    if channel != REDIS_KEY_STORE:
+        # get data from storage channel
+        store_data = r_data.get(channel)
+
+        if store_data is None:
+            return None
+
+        # convert encoded data to df
+        return arrow_to_df(store_data)
+
+    # the data acquisition shares the live window directly when it runs on this machine
+    # the ring of the data acquisition holds exactly the live window
+    df = read_shared_ring()
+    if df is not None:
+        return df
+
+    # get the hot segment and the sealed segments in one atomic snapshot
+    pipe = r_data.pipeline(transaction=True)
+    pipe.lrange(REDIS_KEY_STORE, 0, -1)
+    pipe.zrevrange(REDIS_KEY_SEGMENT_INDEX, 0, -1)
+    encoded_ticks, newest_keys = pipe.execute()
+
+    hot_tables = [arrow_to_table(encoded) for encoded in encoded_ticks]
+    num_bytes = sum(table.nbytes for table in hot_tables)
+
+    # add sealed segments (newest first, a few per round trip) until the decoded live window is full
+    segment_tables = []
+    while newest_keys and num_bytes < LIVE_WINDOW_BYTES:
+        keys, newest_keys = newest_keys[:LIVE_READ_SEGMENTS], newest_keys[LIVE_READ_SEGMENTS:]
+        for data in _read_segments(keys):
+            if data:
+                table = arrow_to_table(data)
+                segment_tables.insert(0, table)
+                num_bytes += table.nbytes
+
+    df = tables_to_df(segment_tables + hot_tables)
+    if df is None:
+        return None
+    return df.tail(live_window_rows(df)).reset_index(drop=True)
 
-    # get data from storage channel
-    store_data = r.get(channel)
 
-    if store_data is None:
+def get_store_version():
+    """
+    Returns (generation, version, timestamp of the newest measurement) of the current data or None if there is no data.
+    The version increases with every stored measurement, the generation changes whenever the data is cleared.
+    """
+    version = r.hgetall(REDIS_KEY_STORE_VERSION)
+    if "version" not in version:
         return None
+    return (
+        int(version.get("generation", 0)),
+        int(version["version"]),
+        int(version.get("timestamp", 0)),
+    )
 
-    # convert encoded data to df
-    df = base64_to_df(store_data)
 
-    # return all the data
-    return df
+def get_live_data(duration=None):
+    """
+    Returns the newest measurements of the current data, starting with the live window of get_data_from_store.
+    They are kept in a compressed copy in this process (see ui.compressed_series), which holds up to
+    LIVE_CACHE_BYTES of measurements. Only measurements newer than the copy are fetched
+    and nothing is read if the store did not change.
+
+    Args:
+        duration (float): time span before the newest measurement to return in seconds, all kept ones if None.
+            Only the compressed blocks containing it are decoded.
+    """
+    store_version = get_store_version()
+    if store_version is None:
+        df = get_data_from_store()
+        if df is None or df.empty or duration is None:
+            return df
+        start = df["timestamp"].iloc[-1] - duration * 1000
+        return df[df["timestamp"] >= start].reset_index(drop=True)
+    generation, version, _ = store_version
+
+    with _live_cache_lock:
+        frame = _live_cache["frame"]
+
+        if frame is None or len(frame) == 0 or generation != _live_cache["generation"]:
+            # first read or the data was cleared
+            frame = _new_live_frame()
+        elif version != _live_cache["version"]:
+            # only the measurements after the newest one of the copy
+            new_data = query(start=frame.last_timestamp + 1)
+            if new_data is not None:
+                if frame.matches(new_data):
+                    frame.append(new_data)
+                else:
+                    # the columns changed, e.g. because TECs were added
+                    frame = _new_live_frame()
+
+        if frame is not None:
+            frame.trim(LIVE_CACHE_BYTES)
+        _live_cache.update(generation=generation, version=version, frame=frame)
+
+        if frame is None:
+            return None
+        start = None if duration is None else frame.last_timestamp - duration * 1000
+        # decoded into new arrays, callers may modify the returned data
+        return frame.to_dataframe(start)
+
+
+def _new_live_frame():
+    """
+    Returns a compressed copy of the live window or None if there is no data.
+    """
+    df = get_data_from_store()
+    if df is None or df.empty:
+        return None
+    return CompressedFrame(df)
+
+
+def get_memory_usage():
+    """
+    Returns the memory used by the current data per tier in bytes, with the budget of the tier (None if unbounded):
+    "live cache" (compressed copy of this process, see get_live_data), "hot segment", "segments" (sealed segments in redis)
+    and one "rollups <interval>s" tier per rollup tier (redis). The data itself is not read, the sizes of the segments
+    and chunks are fetched with one pipelined STRLEN each and the size of the hot segment is counted as ticks are added.
+
+    Returns:
+        dict: tier -> dict with the keys "bytes", "budget" and the number of "rows", "ticks", "segments" or "chunks".
+    """
+    with _live_cache_lock:
+        frame = _live_cache["frame"]
+        live_bytes = 0 if frame is None else frame.nbytes
+        live_rows = 0 if frame is None else len(frame)
+
+    pipe = r_data.pipeline(transaction=True)
+    pipe.llen(REDIS_KEY_STORE)
+    pipe.get(REDIS_KEY_STORE_BYTES)
+    pipe.zrange(REDIS_KEY_SEGMENT_INDEX, 0, -1)
+    for interval, _ in ROLLUP_TIERS:
+        pipe.zrange(f"{REDIS_KEY_PREFIX_ROLLUP_INDEX}{interval}", 0, -1)
+    num_ticks, hot_bytes, keys, *rollup_keys = pipe.execute()
+
+    sizes = _segment_sizes(keys + [key for keys_of_tier in rollup_keys for key in keys_of_tier])
+    usage = {
+        "live cache": {
+            "bytes": live_bytes,
+            "budget": LIVE_CACHE_BYTES,
+            "rows": live_rows,
+        },
+        "hot segment": {
+            "bytes": int(hot_bytes or 0),
+            "budget": HOT_SEGMENT_BYTES,
+            "ticks": num_ticks,
+        },
+        "segments": {
+            "bytes": sum(sizes[: len(keys)]),
+            "budget": max(REDIS_SEGMENTS_BYTES, LIVE_WINDOW_BYTES),
+            "segments": len(keys),
+        },
+    }
+    offset = len(keys)
+    for (interval, _), keys_of_tier in zip(ROLLUP_TIERS, rollup_keys):
+        usage[f"rollups {interval}s"] = {
+            "bytes": sum(sizes[offset : offset + len(keys_of_tier)]),
+            "budget": ROLLUP_TIER_BYTES.get(interval),
+            "chunks": len(keys_of_tier),
+        }
+        offset += len(keys_of_tier)
+    return usage
 
 
 def get_data_both_channels():
     """
-    Stichtes the data from both channels together
+    Stitches all the data of the current session together (archive on disk and redis)
     """
-    df_1 = get_data_from_store(channel=REDIS_KEY_STORE_ALL)
-    df_2 = get_data_from_store(channel=REDIS_KEY_STORE)
+    df = query()
 
-    if df_1 is None and df_2 is None:
+    if df is None:
         return pd.DataFrame()
 
-    df = pd.concat([df_1, df_2])
-
     return df
 
 
+def _select_columns(names, columns=None, tecs=None, plates=None):
+    """
+    Returns the stored columns (wide layout) of the requested parameters, TECs and plates.
+    The timestamp and the number of measurements of rollup rows are always included.
+
+    Args:
+        names (list of str): names of the stored columns.
+        columns, tecs, plates: see query.
+    """
+    selected = []
+    for name in names:
+        parsed = parse_wide_column(name)
+        if name in ("timestamp", COUNT_COLUMN):
+            selected.append(name)
+        elif parsed is None:
+            # one value per measurement, e.g. the sample rate or a tick aggregate with its min and max
+            if columns is None or base_parameter(name) in columns:
+                selected.append(name)
+        else:
+            parameter, plate, tec_id = parsed
+            if (
+                (columns is None or base_parameter(parameter) in columns)
+                and (plates is None or plate in plates)
+                and (tecs is None or tec_id in tecs)
+            ):
+                selected.append(name)
+    return selected
+
+
+def _slice_table(table, start=None, end=None):
+    """
+    Returns the rows of a table (sorted by timestamp) within the time range using binary search.
+    """
+    if start is None and end is None:
+        return table
+    timestamps = table.column("timestamp").to_numpy()
+    first = 0 if start is None else np.searchsorted(timestamps, start, side="left")
+    last = len(timestamps) if end is None else np.searchsorted(timestamps, end, side="right")
+    return table.slice(first, last - first)
+
+
+def query(start=None, end=None, columns=None, tecs=None, plates=None, resolution=None):
+    """
+    Returns the data of the current session within a time range in the wide layout.
+    Spans the archive on disk and redis, but only reads the files and segments overlapping the range
+    and only converts the requested columns.
+    If a resolution is given, the coarsest rollup tier that still meets it is read instead of the raw data.
+
+    Args:
+        start (int): first timestamp (ms since epoch), from the beginning if None.
+        end (int): last timestamp (ms since epoch), until the end if None.
+        columns (list of str): parameters to return, e.g. ["object temperature", "sample rate"], all if None.
+        tecs (list of int): ids of the TECs to return, all if None.
+        plates (list of str): plates to return, e.g. ["top"], all if None.
+        resolution (float): time between two rows in seconds that is still sufficient, raw data if None.
+
+    Returns:
+        pd.DataFrame or None if there is no data in the range.
+    """
+    start = None if start is None else int(start)
+    end = None if end is None else int(end)
+
+    def select(names):
+        return _select_columns(names, columns, tecs, plates)
+
+    if resolution is not None:
+        rollups = _query_rollups(start, end, select, resolution)
+        if rollups is not None:
+            tables, interval = rollups
+            df = tables_to_df(tables)
+            # e.g. 7 days of the 60 s tier hold ~10000 rows, but only one row per resolution is needed
+            if resolution >= 2 * interval:
+                df = reaggregate(df, resolution)
+            return df
+
+    return tables_to_df(list(iter_query(start, end, columns, tecs, plates)))
+
+
+def iter_query(start=None, end=None, columns=None, tecs=None, plates=None):
+    """
+    Yields the data of the current session within a time range as Arrow tables in the wide layout, sorted by time.
+    The archive on disk is read one file at a time, so the memory does not depend on the length of the session.
+    Arguments like query.
+    """
+    start = None if start is None else int(start)
+    end = None if end is None else int(end)
+
+    def select(names):
+        return _select_columns(names, columns, tecs, plates)
+
+    # get the hot segment and the sealed segments starting before the end in one atomic snapshot
+    pipe = r_data.pipeline(transaction=True)
+    pipe.lrange(REDIS_KEY_STORE, 0, -1)
+    pipe.zrangebyscore(REDIS_KEY_SEGMENT_INDEX, "-inf", "+inf" if end is None else end)
+    encoded_ticks, keys = pipe.execute()
+
+    # segments are sorted by their first timestamp,
+    # so the first segment overlapping the range is the last one starting at or before the start
+    if start is not None:
+        first_timestamps = [_segment_timestamp(key) for key in keys]
+        keys = keys[max(bisect_right(first_timestamps, start) - 1, 0) :]
+    segments = _read_segments(keys)
+
+    # segments are archived oldest first, so segments that were moved to the archive after the snapshot
+    # are the oldest ones, they are read from the archive. The archive is only read before the oldest
+    # data read from redis to avoid duplicates, even if segments were archived in the meantime.
+    redis_timestamps = [
+        _segment_timestamp(key) for key, data in zip(keys, segments) if data is not None
+    ]
+    if not redis_timestamps and encoded_ticks:
+        redis_timestamps = [int(arrow_to_table(encoded_ticks[0]).column("timestamp")[0].as_py())]
+    archive_end = end
+    if redis_timestamps:
+        cutoff = min(redis_timestamps) - 1
+        archive_end = cutoff if end is None else min(end, cutoff)
+
+    # opened again, the data acquisition may have started a session with another backend
+    archive = open_archive(CURRENT_SESSION, root=current_archive.root)
+    for table in archive.iter_read(start, archive_end, select):
+        if table.num_rows > 0:
+            yield table
+
+    for data in segments + encoded_ticks:
+        if data is None:
+            continue
+        table = arrow_to_table(data)
+        table = _slice_table(table.select(select(table.column_names)), start, end)
+        if table.num_rows > 0:
+            yield table
+
+
+def get_sessions():
+    """
+    Returns the finished sessions, sorted by time (newest last).
+    Every entry has the keys "id", "start", "end" (ms since epoch) and "rows".
+    """
+    return session_catalog.get_sessions()
+
+
+def query_session(
+    session_id, start=None, end=None, columns=None, tecs=None, plates=None, resolution=None
+):
+    """
+    Returns the data of a finished session within a time range in the wide layout.
+    Only the files overlapping the range and the requested columns are read.
+    If a resolution is given, the data is aggregated by the archive (see ui.rollups for the layout),
+    which runs in SQL for sessions in an SQLite archive.
+
+    Args:
+        session_id (str): id of the session, see get_sessions.
+        start, end, columns, tecs, plates: see query.
+        resolution (float): time between two rows in seconds, raw data if None.
+
+    Returns:
+        pd.DataFrame or None if there is no data in the range.
+    """
+    return tables_to_df(
+        list(iter_query_session(session_id, start, end, columns, tecs, plates, resolution))
+    )
+
+
+def iter_query_session(
+    session_id, start=None, end=None, columns=None, tecs=None, plates=None, resolution=None
+):
+    """
+    Yields the data of a finished session within a time range as Arrow tables in the wide layout,
+    one file at a time, or a single table of aggregated data if a resolution is given.
+    Arguments like query_session.
+    """
+    start = None if start is None else int(start)
+    end = None if end is None else int(end)
+
+    def select(names):
+        return _select_columns(names, columns, tecs, plates)
+
+    archive = session_catalog.get_archive(session_id)
+    if resolution is not None:
+        table = archive.aggregate(start, end, select, interval=max(int(resolution), 1))
+        if table is not None:
+            yield table
+        return
+
+    for table in archive.iter_read(start, end, select):
+        if table.num_rows > 0:
+            yield table
+
+
+def get_compression_ratios(session_id=None):
+    """
+    Returns the compression ratio (samples per stored sample) of every lossily compressed parameter
+    of the archive of a finished session or the current session if session_id is None.
+    """
+    if session_id is None:
+        return open_archive(CURRENT_SESSION, root=current_archive.root).get_compression_ratios()
+    return session_catalog.get_archive(session_id).get_compression_ratios()
+
+
+def _query_rollups(start, end, select, resolution):
+    """
+    Reads the coarsest rollup tier with an interval of at most resolution and a retention covering the start.
+    The retention is counted back from the newest rollup row, so older sessions are read from their rollups as well.
+    Only the chunks overlapping the range are fetched.
+    Returns (list of tables, interval of the tier in seconds) or None if no tier has data for the request.
+    """
+    for interval, retention in sorted(ROLLUP_TIERS, reverse=True):
+        if interval > resolution:
+            continue
+
+        # the newest chunk and the chunks starting before the end in one atomic snapshot
+        index = f"{REDIS_KEY_PREFIX_ROLLUP_INDEX}{interval}"
+        pipe = r_data.pipeline(transaction=True)
+        pipe.zrevrange(index, 0, 0)
+        pipe.zrangebyscore(index, "-inf", "+inf" if end is None else end, withscores=True)
+        newest_keys, chunks = pipe.execute()
+        newest = r_data.get(newest_keys[0]) if newest_keys else None
+        if newest is None:
+            continue
+        # the tier keeps at least the retention before the end of its newest interval
+        newest_timestamp = int(arrow_to_table(newest).column("timestamp")[-1].as_py())
+        if start is not None and start < newest_timestamp + interval * 1000 - retention * 1000:
+            continue
+
+        # chunks are sorted by their first timestamp,
+        # so the first chunk overlapping the range is the last one starting at or before the start
+        if start is not None:
+            first_timestamps = [timestamp for _, timestamp in chunks]
+            chunks = chunks[max(bisect_right(first_timestamps, start) - 1, 0) :]
+
+        tables = []
+        keys = [key for key, _ in chunks]
+        for data in r_data.mget(keys) if keys else []:
+            if data is None:
+                continue
+            table = arrow_to_table(data)
+            tables.append(
+                _slice_table(table.select(select(table.column_names)), start, end)
+            )
+        tables = [table for table in tables if table.num_rows > 0]
+        if tables:
+            return tables, interval
+    return None
+
+
+def _rollup_chunk_key(interval, first_timestamp):
+    """
+    Returns the key of the chunk of a rollup tier starting at first_timestamp.
+    """
+    return f"{REDIS_KEY_PREFIX_ROLLUP}{interval}:{first_timestamp}"
+
+
+def update_rollups(new_data, pipe):
+    """
+    Adds new data in the wide layout to all rollup tiers and queues the commands storing the completed rollup rows.
+    Every tier is a set of chunks of up to ROLLUP_CHUNK_ROWS rows, indexed by their first timestamp,
+    where only the newest chunk is rewritten. Chunks beyond the retention are removed by trim_rollups.
+
+    Args:
+        new_data (pd.DataFrame or pa.Table): new measurements in the wide layout.
+        pipe (redis.client.Pipeline): pipeline of the binary connection the commands are added to.
+    """
+    for interval, _ in ROLLUP_TIERS:
+        rollup = _rollup_aggregators[interval].add(new_data)
+        if rollup is None:
+            continue
+
+        chunk = _rollup_chunks.get(interval)
+        if chunk is None or len(chunk) >= ROLLUP_CHUNK_ROWS:
+            chunk = rollup
+        else:
+            chunk = pd.concat([chunk, rollup], ignore_index=True)
+        _rollup_chunks[interval] = chunk
+
+        first_timestamp = int(chunk["timestamp"].iloc[0])
+        key = _rollup_chunk_key(interval, first_timestamp)
+        pipe.set(key, df_to_arrow(chunk))
+        pipe.zadd(f"{REDIS_KEY_PREFIX_ROLLUP_INDEX}{interval}", {key: first_timestamp})
+
+
+def trim_rollups():
+    """
+    Removes the chunks of every rollup tier that end before its retention,
+    counted back from the start of the newest chunk of the tier, and the oldest chunks over its memory budget
+    (see ROLLUP_TIER_BYTES). Chunks are removed as a whole and the newest chunk is always kept.
+    """
+    for interval, retention in ROLLUP_TIERS:
+        index = f"{REDIS_KEY_PREFIX_ROLLUP_INDEX}{interval}"
+        chunks = r_data.zrange(index, 0, -1, withscores=True)
+        if not chunks:
+            continue
+
+        # a chunk ends where the next one starts
+        cutoff = chunks[-1][1] - retention * 1000
+        num_expired = sum(
+            1 for _, next_timestamp in chunks[1:] if next_timestamp <= cutoff
+        )
+
+        # keep the newest chunks within the budget
+        budget = ROLLUP_TIER_BYTES.get(interval)
+        if budget is not None:
+            num_bytes = 0
+            keep = 0
+            for size in reversed(_segment_sizes([key for key, _ in chunks[num_expired:]])):
+                if keep > 0 and num_bytes + size > budget:
+                    break
+                num_bytes += size
+                keep += 1
+            num_expired = len(chunks) - keep
+
+        keys = [key for key, _ in chunks[:num_expired]]
+        if keys:
+            pipe = r_data.pipeline(transaction=True)
+            pipe.zrem(index, *keys)
+            pipe.delete(*keys)
+            pipe.execute()
+
+
+def get_legacy_data():
+    """
+    Gets the data of a session recorded by an older version of this software,
+    which stored all data as base64 encoded parquet in two keys.
+    Returns None if there is no such data.
+    """
+    frames = []
+    for key in [REDIS_KEY_LEGACY_STORE_ALL, REDIS_KEY_STORE]:
+        if r.type(key) == "string":
+            frames.append(parquet_to_df(r_data.get(key)))
+
+    if not frames:
+        return None
+
+    return to_wide(apply_schema(pd.concat(frames)))
+
+
+def sort_download_columns(columns):
+    """
+    Sorts columns in the wide layout like the downloads of older versions (a pivot table):
+    by parameter, plate and TEC id, e.g. "object temperature_bottom_0" before "object temperature_top_0".
+    """
+
+    def key(column):
+        parsed = parse_wide_column(column)
+        return (column, "", -1) if parsed is None else parsed
+
+    return sorted(columns, key=key)
+
+
 def prepare_df_for_download(df):
     """
     Converts internally used dataframe into a format that is convenient for data analysis;
 
-    All 8 rows with the same timestamp are consolidated into 1 row with timestamp as key.
-    Timestamp columns are consolidated and renamed accordingly.
+    The data is already stored with one row per timestamp, so the timestamp only becomes the key.
+    The columns are sorted like in older versions (see sort_download_columns).
     Whitespaces in column names are replaced by underscores.
     """
-    # pivot to change index to timestamp
-    df_pivot = df.pivot_table(index="timestamp", columns=["Plate", "TEC"])
-
-    # Rename columns
-    df_pivot.columns = [
-        f"{lvl1}_{lvl2}_{lvl3}" for lvl1, lvl2, lvl3 in df_pivot.columns
-    ]
+    # change index to timestamp
+    df_pivot = df.set_index("timestamp")
+    df_pivot = df_pivot[sort_download_columns(df_pivot.columns)]
 
-    # add "time_since_start" column
+    # add "time_since_start" as the first column
     start_time = df_pivot.index.min()
-    df_pivot["time_since_start"] = df_pivot.index - start_time
-
-    # Reorder columns to make 'time_since_start' the first column
-    columns = ["time_since_start"] + [
-        col for col in df_pivot.columns if col != "time_since_start"
-    ]
-    df_pivot = df_pivot[columns]
+    df_pivot.insert(0, "time_since_start", df_pivot.index - start_time)
 
     # replace whitespaces and tabs in column names with underscores
     df_pivot.columns = df_pivot.columns.str.replace(r"\s+", "_", regex=True)
@@ -162,25 +855,30 @@ def prepare_df_for_download(df):
 
 def get_data_for_download(selected_columns):
     """
-    Gets the data from both channels and changes the format.
+    Gets the selected columns of all data of the current session and changes the format.
     """
-    df = get_data_both_channels()
+    # only read the columns of the selected parameters
+    df = query(columns=selected_columns)
 
-    # only keep selected columns
-    if selected_columns is not None:
-        selected_columns = ["timestamp"] + selected_columns
-        df = df[selected_columns]
+    if df is None:
+        df = pd.DataFrame(columns=["timestamp"])
 
     df_pivot = prepare_df_for_download(df)
 
     return df_pivot
 
 
-def get_recovered_data():
+def get_recovered_data(session_id=None, start=None, end=None):
     """
-    Gets the data that was saved from the previous session.
+    Gets the data of a finished session (the newest one if session_id is None) and changes the format.
     """
-    df = get_data_from_store(REDIS_KEY_PREVIOUS_DATA)
+    if session_id is None:
+        df = get_data_from_store(REDIS_KEY_PREVIOUS_DATA)
+    else:
+        df = query_session(session_id, start, end)
+
+    if df is None:
+        df = pd.DataFrame(columns=["timestamp"])
 
     df_pivot = prepare_df_for_download(df)
 
@@ -190,58 +888,294 @@ def get_recovered_data():
 def update_store(new_data, channel=REDIS_KEY_STORE):
     """
     Appends new data to the data store.
+    The data is pushed to the hot segment, so the cost of an append does not depend on the length of the run.
+    Other channels hold a single dataframe, which is replaced.
+    An Arrow table is expected to be in the compact schema and the wide layout already
+    (see SampleBuffer.to_wide_table) and is stored without a pandas round trip.
     """
     global _last_data_timestamp
 
+    if isinstance(new_data, pa.Table) and channel == REDIS_KEY_STORE:
+        table = new_data
+    else:
+        if isinstance(new_data, pa.Table):
+            new_data = new_data.to_pandas()
+
+        # measurements are always stored in the compact schema and the wide layout
+        new_data = to_wide(apply_schema(new_data))
+
+        if channel == REDIS_KEY_PREVIOUS_DATA:
+            r_data.set(channel, df_to_parquet(new_data))
+            return
+
+        if channel != REDIS_KEY_STORE:
+            r_data.set(channel, df_to_arrow(new_data))
+            return
+
+        table = pa.Table.from_pandas(new_data, preserve_index=False)
+
     # check if the timestamp of the "new" data and most recent old data matches
     # in that case, do not append the data as we already have it
     # this may happen sometimes as TECInterface will only give new data every n second(s)
-    if channel == REDIS_KEY_STORE:
-        new_timestamp = new_data.iloc[len(new_data) - 1]["timestamp"]
+    new_timestamp = table.column("timestamp")[-1].as_py()
 
-        if _last_data_timestamp == new_timestamp:
-            return dash.no_update
+    if _last_data_timestamp == new_timestamp:
+        return dash.no_update
 
-        _last_data_timestamp = new_timestamp
+    _last_data_timestamp = new_timestamp
 
-    # get the existing data
-    existing_data = get_data_from_store(channel)
+    # a single measurement is the newest measurement as well, so it is only encoded once
+    encoded = table_to_arrow(table)
+    if table.num_rows > 1:
+        encoded_latest = table_to_arrow(table.slice(table.num_rows - 1))
+    else:
+        encoded_latest = encoded
+
+    # append to the hot segment, replace the newest measurement and update the rollup tiers
+    # in one round trip, readers never see only a part of it
+    pipe = r_data.pipeline(transaction=True)
+    pipe.rpush(REDIS_KEY_STORE, encoded)
+    pipe.incrby(REDIS_KEY_STORE_BYTES, len(encoded))
+    pipe.set(REDIS_KEY_LATEST, encoded_latest)
+    pipe.hincrby(REDIS_KEY_STORE_VERSION, "version", table.num_rows)
+    pipe.hset(REDIS_KEY_STORE_VERSION, "timestamp", int(new_timestamp))
+    update_rollups(table, pipe)
+    num_ticks, hot_bytes = pipe.execute()[:2]
+
+    # seal the hot segment once it is full or over its memory budget
+    if num_ticks >= SEGMENT_TICKS or hot_bytes >= HOT_SEGMENT_BYTES:
+        seal_hot_segment()
+        trim_rollups()
+        _archive_in_background()
+
+
+def seal_hot_segment():
+    """
+    Moves all ticks of the hot segment into a new immutable segment and adds it to the index.
+    """
+    encoded_ticks = r_data.lrange(REDIS_KEY_STORE, 0, -1)
+    if not encoded_ticks:
+        return
+
+    # concatenate in arrow, no pandas round trip needed
+    # combined into one record batch, every batch of the stream format has a fixed overhead
+    table = pa.concat_tables(
+        [arrow_to_table(encoded) for encoded in encoded_ticks]
+    ).combine_chunks()
+    first_timestamp = int(table.column("timestamp")[0].as_py())
+    key = f"{REDIS_KEY_PREFIX_SEGMENT}{first_timestamp}"
+
+    # store and index the segment and remove its ticks from the hot segment atomically
+    pipe = r_data.pipeline(transaction=True)
+    pipe.set(key, table_to_arrow(table))
+    pipe.zadd(REDIS_KEY_SEGMENT_INDEX, {key: first_timestamp})
+    pipe.ltrim(REDIS_KEY_STORE, len(encoded_ticks), -1)
+    pipe.decrby(REDIS_KEY_STORE_BYTES, sum(len(encoded) for encoded in encoded_ticks))
+    pipe.execute()
+
+
+def _segment_timestamp(key):
+    """
+    Returns the first timestamp of a sealed segment from its key.
+    """
+    if isinstance(key, bytes):
+        key = key.decode()
+    return int(key[len(REDIS_KEY_PREFIX_SEGMENT) :])
 
-    # if there is existing data, append to it. Otherwise, override it
-    if existing_data is not None:
-        # concat
-        updated_df = pd.concat([existing_data, new_data])
 
-        # check if the data is too large
-        if channel == REDIS_KEY_STORE and len(updated_df) > MAX_ROWS_STORAGE:
-            # move some data to the other channel
-            updated_df = transfer_rows(updated_df)
+def _archive_in_background():
+    """
+    Starts archive_segments in the background thread, unless it is still busy.
+    Segments that are not archived now are archived after the next sealed segment.
+    """
+    global _archive_future
+    if _archive_future is not None and not _archive_future.done():
+        return
+    _archive_future = _archive_executor.submit(_archive_segments_safely)
 
-        # convert back for storage
-        updated_store_data = df_to_base64(updated_df)
 
-    else:
-        # convert new data for storage
-        updated_store_data = df_to_base64(new_data)
+def _archive_segments_safely():
+    """
+    Runs archive_segments in the background thread, the segments stay in redis if it fails.
+    """
+    try:
+        archive_segments()
+    except Exception as ex:
+        print(f"[ERROR] Archiving segments failed: {ex}")
 
-    # update the data store
-    r.set(channel, updated_store_data)
+
+def wait_for_archiving():
+    """
+    Waits until the segments are archived by the background thread, e.g. before the archive is replaced.
+    """
+    if _archive_future is not None:
+        _archive_future.result()
 
 
-def transfer_rows(df):
+def archive_segments(keep_bytes=None, min_segments=ARCHIVE_FILE_SEGMENTS):
     """
-    Removes rows from the dataframe and stores them in the other channel.
+    Moves the oldest sealed segments over the memory budget from redis into the archive of the current session.
+    Segments are moved as a whole, so the archive only gets whole ticks.
+
+    Args:
+        keep_bytes (int): size of the newest sealed segments that stay in redis,
+            REDIS_SEGMENTS_BYTES (but at least LIVE_WINDOW_BYTES) if None.
+        min_segments (int): only move segments if there are at least this many, so the files are not tiny.
     """
-    # create new df
-    new_df = df.iloc[:REMOVE_ROWS_COUNT].copy()
+    if keep_bytes is None:
+        keep_bytes = max(REDIS_SEGMENTS_BYTES, LIVE_WINDOW_BYTES)
+
+    # keep the newest segments within the budget
+    newest_keys = r_data.zrevrange(REDIS_KEY_SEGMENT_INDEX, 0, -1)
+    num_bytes = 0
+    keep = 0
+    for size in _segment_sizes(newest_keys):
+        if num_bytes + size > keep_bytes:
+            break
+        num_bytes += size
+        keep += 1
+
+    keys = newest_keys[keep:][::-1]
+    if not keys or len(keys) < min_segments:
+        return
+
+    # the segments must be on disk before they are removed from redis
+    current_archive.write(
+        [arrow_to_table(data) for data in _read_segments(keys) if data is not None]
+    )
+    ratios = get_compression_ratios()
+    if ratios:
+        print(
+            f"[INFO] Archived {len(keys)} segments, compression of the session: "
+            + ", ".join(f"{parameter} {ratio:.1f}x" for parameter, ratio in ratios.items())
+        )
 
-    # remove the rows
-    df = df.iloc[REMOVE_ROWS_COUNT:]
+    pipe = r_data.pipeline(transaction=True)
+    pipe.zrem(REDIS_KEY_SEGMENT_INDEX, *keys)
+    pipe.delete(*keys)
+    pipe.execute()
 
-    # update the store
-    update_store(channel=REDIS_KEY_STORE_ALL, new_data=new_df)
 
-    return df
+def archive_previous_session():
+    """
+    Finishes the current session: its data is moved to the archive on disk and the archive becomes
+    a new session of the catalog. Only the data still in redis is written, the rest is just renamed.
+    Sessions recorded by older versions of this software are migrated into the catalog.
+    """
+    global current_archive
+    wait_for_archiving()
+    _migrate_previous_session()
+
+    legacy_data = get_legacy_data()
+    if legacy_data is not None:
+        r.delete(REDIS_KEY_LEGACY_STORE_ALL, REDIS_KEY_STORE)
+        current_archive.write([pa.Table.from_pandas(legacy_data, preserve_index=False)])
+
+    # move everything from redis to the archive
+    seal_hot_segment()
+    archive_segments(keep_bytes=0, min_segments=1)
+
+    session_catalog.add(current_archive)
+    # the next session is stored with the configured backend
+    current_archive = open_archive(CURRENT_SESSION, root=current_archive.root)
+
+    pipe = r.pipeline(transaction=True)
+    pipe.delete(REDIS_KEY_PREVIOUS_DATA, REDIS_KEY_LATEST)
+    _new_store_generation(pipe)
+    pipe.execute()
+
+
+def _migrate_previous_session():
+    """
+    Adds the previous session of older versions to the catalog, which was either kept in a single
+    archive directory or stored in redis (possibly with the dtypes and layout of an even older version).
+    """
+    previous_archive = open_archive(PREVIOUS_SESSION, root=current_archive.root)
+
+    store_data = r_data.get(REDIS_KEY_PREVIOUS_DATA)
+    if store_data is not None and not previous_archive.get_manifest():
+        df = to_wide(apply_schema(parquet_to_df(store_data)))
+        if not df.empty:
+            previous_archive.write([pa.Table.from_pandas(df, preserve_index=False)])
+
+    session_catalog.add(previous_archive)
+
+
+def clear_store():
+    """
+    Deletes the current data, i.e. the hot segment, all sealed segments and the archive of the current session.
+    """
+    global current_archive
+
+    rollup_indexes = [f"{REDIS_KEY_PREFIX_ROLLUP_INDEX}{interval}" for interval, _ in ROLLUP_TIERS]
+
+    def delete_all(pipe):
+        # the indexes are watched, so segments sealed and chunks added in the meantime are not missed
+        keys = pipe.zrange(REDIS_KEY_SEGMENT_INDEX, 0, -1)
+        for index in rollup_indexes:
+            keys += pipe.zrange(index, 0, -1)
+        pipe.multi()
+        pipe.delete(
+            REDIS_KEY_STORE,
+            REDIS_KEY_STORE_BYTES,
+            REDIS_KEY_LATEST,
+            REDIS_KEY_SEGMENT_INDEX,
+            REDIS_KEY_LEGACY_STORE_ALL,
+            *rollup_indexes,
+            *keys,
+        )
+        _new_store_generation(pipe)
+
+    wait_for_archiving()
+    r.transaction(delete_all, REDIS_KEY_SEGMENT_INDEX, *rollup_indexes)
+    current_archive.clear()
+    current_archive = open_archive(CURRENT_SESSION, root=current_archive.root)
+
+    # start the rollup tiers from scratch
+    for interval, _ in ROLLUP_TIERS:
+        _rollup_aggregators[interval] = RollupAggregator(interval)
+    _rollup_chunks.clear()
+
+
+def _new_store_generation(pipe):
+    """
+    Queues the commands marking the current data as replaced, so copies of it (see get_live_data) are read again.
+    """
+    pipe.hincrby(REDIS_KEY_STORE_VERSION, "generation", 1)
+    pipe.hdel(REDIS_KEY_STORE_VERSION, "version", "timestamp")
+
+
+def store_burst_capture(df):
+    """
+    Stores the result of a burst capture, replacing the previous one.
+    """
+    r_data.set(REDIS_KEY_BURST_CAPTURE, df_to_arrow(df))
+
+
+def get_burst_capture():
+    """
+    Returns the result of the last burst capture or None if there is none.
+    """
+    return get_data_from_store(REDIS_KEY_BURST_CAPTURE)
+
+
+def set_burst_capture_status(status):
+    """
+    Stores the state and metadata of the burst capture.
+
+    Args:
+        status (dict): state ("running", "finished" or "error") and metadata of the capture.
+    """
+    r.delete(REDIS_KEY_BURST_CAPTURE_STATUS)
+    r.hset(REDIS_KEY_BURST_CAPTURE_STATUS, mapping=status)
+
+
+def get_burst_capture_status():
+    """
+    Returns the state and metadata of the last burst capture or None if no capture was started.
+    """
+    status = r.hgetall(REDIS_KEY_BURST_CAPTURE_STATUS)
+    return status if status else None
 
 
 def check_reconnecting():
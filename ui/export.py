@@ -0,0 +1,432 @@
+"""
+Exports data as CSV (optionally compressed), Parquet or Feather.
+The data is read and converted one chunk (archive file or redis segment) at a time,
+directly from the stored Arrow tables, so the memory does not depend on the length of a run.
+
+Exports from the UI run as background jobs in a thread pool, which write the file to disk
+and report their progress. The files are kept as a cache, so repeating an export is instant.
+Data can also be streamed directly through a flask route.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import io
+import json
+import os
+import re
+from threading import Lock
+from urllib.parse import urlencode
+
+from flask import Response, abort, request, send_file
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from ui.data_store import (
+    get_sessions,
+    get_store_version,
+    iter_query,
+    iter_query_session,
+    sort_download_columns,
+)
+
+# route of the export, followed by the format
+EXPORT_ROUTE = "/download"
+
+# route of the files of finished export jobs, followed by the job id
+EXPORT_FILE_ROUTE = "/download/file"
+
+# directory of the files of the export jobs
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "exports")
+
+# number of export files kept in the cache
+EXPORT_CACHE_FILES = 20
+
+# number of exports running at the same time
+EXPORT_WORKERS = 2
+
+# export formats: format -> (label, file extension, mimetype)
+EXPORT_FORMATS = {
+    "csv": ("CSV", "csv", "text/csv"),
+    "csv.gz": ("CSV (gzip)", "csv.gz", "application/gzip"),
+    "csv.zst": ("CSV (zstd)", "csv.zst", "application/zstd"),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet"),
+    "feather": ("Feather", "feather", "application/vnd.apache.arrow.file"),
+}
+
+# resolutions of exports of finished sessions: resolution -> (label, seconds per row)
+# aggregated rows hold the mean of every value and its min and max, see ui.rollups
+EXPORT_RESOLUTIONS = {
+    "raw": ("All samples", None),
+    "10s": ("10 s means", 10),
+    "1min": ("1 min means", 60),
+    "10min": ("10 min means", 600),
+}
+
+# compression of the compressed CSV formats
+_CSV_COMPRESSION = {"csv.gz": "gzip", "csv.zst": "zstd"}
+
+# minimum number of rows per written chunk (and row group of Parquet files),
+# the ticks of the hot segment are combined instead of being written one by one
+EXPORT_CHUNK_ROWS = 3600
+
+
+# Helper function to get the file name of a new file to be downloaded as a string
+def get_file_name(prefix="TEC_data", extension="csv"):
+    time = datetime.now().strftime("%Y-%m-%d_%H_%M_%S")
+    return f"{prefix}_{time}.{extension}"
+
+
+def export_url(columns=None, session_id=None, export_format="csv", resolution="raw"):
+    """
+    Returns the url downloading the data.
+
+    Args:
+        columns (list of str): parameters to export, e.g. ["object temperature"], all if None.
+        session_id (str): id of a finished session, the current session if None.
+        export_format (str): one of EXPORT_FORMATS.
+        resolution (str): one of EXPORT_RESOLUTIONS, only for finished sessions.
+    """
+    args = {}
+    if columns is not None:
+        # parameter names do not contain commas
+        args["columns"] = ",".join(columns)
+    if session_id is not None:
+        args["session"] = session_id
+    if resolution != "raw":
+        args["resolution"] = resolution
+    url = f"{EXPORT_ROUTE}/{export_format}"
+    return f"{url}?{urlencode(args)}" if args else url
+
+
+def download_tables(tables):
+    """
+    Converts Arrow tables in the wide layout into the download format, like prepare_df_for_download:
+    the timestamp is the first column followed by the time since the start and the sorted columns
+    (see sort_download_columns), whitespaces in column names are replaced by underscores.
+    The schema of the first table is used for all tables, missing columns are filled with nulls.
+    """
+    schema = None
+    for table in tables:
+        if schema is None:
+            first_timestamp = table.column("timestamp")[0]
+            columns = sort_download_columns(
+                [column for column in table.column_names if column != "timestamp"]
+            )
+            fields = [
+                pa.field(re.sub(r"\s+", "_", column), table.schema.field(column).type)
+                for column in columns
+            ]
+            timestamp_type = table.schema.field("timestamp").type
+            schema = pa.schema(
+                [("timestamp", timestamp_type), ("time_since_start", timestamp_type)] + fields
+            )
+
+        arrays = [
+            table.column("timestamp"),
+            pc.subtract(table.column("timestamp"), first_timestamp),
+        ] + [
+            (
+                table.column(column).cast(field.type)
+                if column in table.column_names
+                else pa.nulls(table.num_rows, type=field.type)
+            )
+            for column, field in zip(columns, fields)
+        ]
+        yield pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _combine_small_tables(tables, min_rows=EXPORT_CHUNK_ROWS):
+    """
+    Combines consecutive tables (with the same schema) until they have at least min_rows rows.
+    """
+    pending = []
+    num_rows = 0
+    for table in tables:
+        pending.append(table)
+        num_rows += table.num_rows
+        if num_rows >= min_rows:
+            yield pa.concat_tables(pending)
+            pending = []
+            num_rows = 0
+    if pending:
+        yield pa.concat_tables(pending)
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    File that collects the written bytes until they are sent.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        """
+        Returns and removes all bytes written so far.
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _new_writer(stream, schema, export_format):
+    """
+    Returns a writer of tables in the export format.
+    """
+    if export_format == "parquet":
+        return pq.ParquetWriter(stream, schema)
+    if export_format == "feather":
+        return ipc.new_file(stream, schema)
+
+    # Arrow quotes the names in the header, it is written like by pandas instead (names have no commas)
+    stream.write((",".join(schema.names) + "\n").encode())
+    return pa_csv.CSVWriter(
+        stream, schema, write_options=pa_csv.WriteOptions(include_header=False)
+    )
+
+
+def export_chunks(tables, export_format="csv"):
+    """
+    Yields the file in the export format chunk by chunk, small tables are combined into one chunk.
+    Parquet files get one row group per chunk.
+    """
+    sink = _ChunkSink()
+    stream = pa.PythonFile(sink, mode="w")
+    if export_format in _CSV_COMPRESSION:
+        stream = pa.CompressedOutputStream(stream, _CSV_COMPRESSION[export_format])
+
+    writer = None
+    for table in _combine_small_tables(download_tables(tables)):
+        if writer is None:
+            writer = _new_writer(stream, table.schema, export_format)
+        writer.write_table(table)
+
+        # compressed data is buffered until it is flushed
+        stream.flush()
+        yield sink.pop()
+
+    # no data, only the header
+    if writer is None:
+        schema = pa.schema([("timestamp", pa.int64()), ("time_since_start", pa.int64())])
+        writer = _new_writer(stream, schema, export_format)
+
+    writer.close()
+    stream.close()
+    yield sink.pop()
+
+
+# export jobs of this process by id
+_jobs = {}
+_jobs_lock = Lock()
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+
+def _job_id(columns, session_id, export_format, resolution):
+    """
+    Returns the id of an export, which is the same for the same data, columns and format.
+    The current session is identified by the version of the store, so new data results in a new export,
+    and by the timestamp of its newest measurement, because the version starts again if redis is reset.
+    """
+    if session_id is None:
+        store_version = get_store_version()
+        source = ["current"] + (list(store_version) if store_version else [])
+    else:
+        source = ["session", session_id, resolution]
+    key = [source, None if columns is None else sorted(columns), export_format]
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+
+
+def _job_path(job_id, export_format):
+    return os.path.join(EXPORT_DIR, f"{job_id}.{EXPORT_FORMATS[export_format][1]}")
+
+
+def start_export(columns=None, session_id=None, export_format="csv", resolution="raw"):
+    """
+    Starts exporting data into a file in the background.
+    No job is started if the same export is already running or its file is cached.
+
+    Args:
+        columns (list of str): parameters to export, e.g. ["object temperature"], all if None.
+        session_id (str): id of a finished session, the current session if None.
+        export_format (str): one of EXPORT_FORMATS.
+        resolution (str): one of EXPORT_RESOLUTIONS, only for finished sessions.
+
+    Returns:
+        str: id of the job, see get_export_status.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if resolution not in EXPORT_RESOLUTIONS or (session_id is None and resolution != "raw"):
+        raise ValueError(f"Unknown export resolution: {resolution}")
+    if session_id is not None and session_id not in {
+        session["id"] for session in get_sessions()
+    }:
+        raise ValueError(f"Unknown session: {session_id}")
+
+    job_id = _job_id(columns, session_id, export_format, resolution)
+    path = _job_path(job_id, export_format)
+
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None and job["state"] != "failed":
+            return job_id
+
+        job = {"state": "running", "progress": 0.0, "path": path, "format": export_format}
+        if os.path.exists(path):
+            job.update(state="finished", progress=1.0)
+            _jobs[job_id] = job
+            return job_id
+        _jobs[job_id] = job
+
+    _executor.submit(_run_export, job, columns, session_id, export_format, resolution)
+    return job_id
+
+
+def _run_export(job, columns, session_id, export_format, resolution):
+    """
+    Writes an export file and keeps the progress of the job up to date.
+    """
+    try:
+        # number of rows to export, used for the progress
+        if session_id is None:
+            store_version = get_store_version()
+            total_rows = store_version[1] if store_version else 0
+            tables = iter_query(columns=columns)
+        else:
+            sessions = {session["id"]: session for session in get_sessions()}
+            total_rows = sessions[session_id]["rows"]
+            # aggregated data is returned as one table, the progress jumps to the end
+            tables = iter_query_session(
+                session_id, columns=columns, resolution=EXPORT_RESOLUTIONS[resolution][1]
+            )
+
+        def count_rows(tables):
+            rows = 0
+            for table in tables:
+                yield table
+                rows += table.num_rows
+                job["progress"] = min(rows / max(total_rows, 1), 1.0)
+
+        # the file only appears once it is complete
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        with open(f"{job['path']}.tmp", "wb") as f:
+            for chunk in export_chunks(count_rows(tables), export_format):
+                f.write(chunk)
+        os.replace(f"{job['path']}.tmp", job["path"])
+
+        job.update(state="finished", progress=1.0)
+    except Exception as e:
+        print(f"[ERROR] Export failed: {e}")
+        job.update(state="failed", error=str(e))
+        return
+
+    _prune_export_cache()
+
+
+def _prune_export_cache():
+    """
+    Deletes the oldest export files if there are more than EXPORT_CACHE_FILES.
+    Files that cannot be deleted (e.g. still open for a download) are kept until the next export.
+    """
+    with _jobs_lock:
+        files = []
+        for file in os.listdir(EXPORT_DIR):
+            path = os.path.join(EXPORT_DIR, file)
+            if file.endswith(".tmp"):
+                continue
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        files.sort()
+        for _, path in files[:-EXPORT_CACHE_FILES]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"[WARNING] Could not delete the export {path}: {e}")
+                continue
+            for job_id, job in list(_jobs.items()):
+                if job["path"] == path:
+                    del _jobs[job_id]
+
+
+def get_export_status(job_id):
+    """
+    Returns the status of an export job as a dict with the keys "state" ("running", "finished" or "failed"),
+    "progress" (0 to 1) and "error" (only if failed), or None if there is no such job.
+    """
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    return {key: job[key] for key in ["state", "progress", "error"] if key in job}
+
+
+def export_file_url(job_id):
+    """
+    Returns the url downloading the file of a finished export job.
+    """
+    return f"{EXPORT_FILE_ROUTE}/{job_id}"
+
+
+def export_routes(app):
+    """
+    Registers the export routes at the flask server of the app.
+    """
+
+    @app.server.route(f"{EXPORT_FILE_ROUTE}/<job_id>")
+    def export_file(job_id):
+        job = _jobs.get(job_id)
+        if job is None or job["state"] != "finished":
+            abort(404)
+
+        _, extension, mimetype = EXPORT_FORMATS[job["format"]]
+        return send_file(
+            job["path"],
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=get_file_name(extension=extension),
+        )
+
+    @app.server.route(f"{EXPORT_ROUTE}/<export_format>")
+    def export_data(export_format):
+        if export_format not in EXPORT_FORMATS:
+            abort(404)
+
+        columns = request.args.get("columns")
+        if columns is not None:
+            columns = [column for column in columns.split(",") if column]
+        session_id = request.args.get("session")
+        resolution = request.args.get("resolution", "raw")
+        if resolution not in EXPORT_RESOLUTIONS:
+            abort(404)
+
+        if session_id is None:
+            if resolution != "raw":
+                abort(404)
+            tables = iter_query(columns=columns)
+        elif session_id in {session["id"] for session in get_sessions()}:
+            tables = iter_query_session(
+                session_id, columns=columns, resolution=EXPORT_RESOLUTIONS[resolution][1]
+            )
+        else:
+            abort(404)
+
+        _, extension, mimetype = EXPORT_FORMATS[export_format]
+        return Response(
+            export_chunks(tables, export_format),
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": f"attachment; filename={get_file_name(extension=extension)}"
+            },
+        )
@@ -96,6 +96,8 @@ def layout(app):
                     dcc.Store(
                         id="is-sequence-running", data=False, storage_type="session"
                     ),
+                    # store for the data version and settings the graphs of this client were drawn with
+                    dcc.Store(id="graphs-state", data=None),
                     # hidden div to track whether the app is ready to be displayed
                     html.Div(
                         id="initial-load", style={"display": "none"}, children="Loaded."
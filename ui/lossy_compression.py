@@ -0,0 +1,194 @@
+"""
+Lossy compression of slowly varying TEC columns for the archive.
+
+Samples that can be reconstructed within a tolerance from the samples kept around them are dropped,
+i.e. stored as null. Nulls take almost no space in Parquet files. Missing measurements of compressed
+float columns are stored as NaN instead of null, so they are not confused (pandas reads both as NaN);
+integer columns with missing measurements are not compressed. On read, dropped samples are filled in again:
+    - "deadband": a sample is kept when it differs from the last kept sample by more than the tolerance,
+      dropped samples repeat the last kept one. A tolerance of 0 keeps every change, so it is lossless.
+    - "swinging door": a sample is kept when the samples since the last kept one are no longer
+      within the tolerance of a straight line, dropped samples are interpolated linearly.
+The first and last sample of a table and the samples next to missing measurements are always kept,
+so every table is reconstructed on its own.
+"""
+
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from app.measurement_schema import parse_wide_column
+
+# key of the schema metadata listing the compressed columns (column -> method)
+COMPRESSION_METADATA_KEY = b"tec_compression"
+
+
+def deadband(timestamps, values, tolerance):
+    """
+    Returns the mask of the samples kept by deadband compression.
+    Vectorized: a tolerance of 0 compares neighbouring samples at once, otherwise the next sample
+    leaving the band of the last kept sample is searched in NumPy, so the loop only runs once per kept sample.
+
+    Args:
+        timestamps (np.ndarray): timestamps of the samples (unused, same signature as swinging_door).
+        values (np.ndarray): values of the samples, NaN for missing measurements.
+        tolerance (float): maximum difference to the last kept sample.
+    """
+    n = len(values)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    if tolerance == 0:
+        # every change is kept, NaN never equals anything, so missing measurements and the samples after them are kept
+        keep[0] = True
+        keep[1:] = values[1:] != values[:-1]
+    else:
+        missing = np.isnan(values)
+        i = 0
+        while i < n:
+            keep[i] = True
+            if missing[i]:
+                i += 1
+                continue
+            # the first later sample that is missing or outside the band is kept next
+            with np.errstate(invalid="ignore"):
+                leaves = missing[i + 1 :] | (np.abs(values[i + 1 :] - values[i]) > tolerance)
+            if not leaves.any():
+                break
+            i += 1 + int(leaves.argmax())
+    keep[-1] = True
+    return keep
+
+
+def swinging_door(timestamps, values, tolerance):
+    """
+    Returns the mask of the samples kept by swinging door compression.
+    Every dropped sample is within the tolerance of the line between the kept samples around it.
+
+    Args:
+        timestamps (np.ndarray): timestamps of the samples, increasing.
+        values (np.ndarray): values of the samples, NaN for missing measurements.
+        tolerance (float): maximum difference to the linear interpolation.
+    """
+    n = len(values)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = True
+    keep[-1] = True
+
+    anchor = 0
+    # slopes from the anchor that keep all samples since the anchor within the tolerance
+    low, high = -np.inf, np.inf
+    for i in range(1, n):
+        if np.isnan(values[i]) or np.isnan(values[anchor]):
+            # missing measurements and the samples next to them are kept
+            keep[i - 1] = keep[i] = True
+            anchor = i
+            low, high = -np.inf, np.inf
+            continue
+
+        duration = timestamps[i] - timestamps[anchor]
+        slope = (values[i] - values[anchor]) / duration
+        if not low <= slope <= high:
+            # the previous sample still fits all samples before it, it becomes the new anchor
+            keep[i - 1] = True
+            anchor = i - 1
+            low, high = -np.inf, np.inf
+            duration = timestamps[i] - timestamps[anchor]
+
+        low = max(low, (values[i] - tolerance - values[anchor]) / duration)
+        high = min(high, (values[i] + tolerance - values[anchor]) / duration)
+    return keep
+
+
+# compression methods: name -> function returning the mask of the kept samples
+COMPRESSION_METHODS = {
+    "deadband": deadband,
+    "swinging door": swinging_door,
+}
+
+
+def compress_table(table, compression):
+    """
+    Drops the samples of TEC columns that can be reconstructed within the tolerance of their parameter.
+
+    Args:
+        table (pa.Table): measurements in the wide layout, sorted by time.
+        compression (dict): parameter -> (method, tolerance), e.g. {"object temperature": ("swinging door", 0.01)}.
+
+    Returns:
+        (pa.Table, dict): the compressed table and the number of samples per compressed parameter
+            as [samples, kept samples].
+    """
+    timestamps = table.column("timestamp").to_numpy().astype(np.float64)
+    compressed = {}
+    counts = {}
+
+    for i, name in enumerate(table.column_names):
+        parsed = parse_wide_column(name)
+        if parsed is None or parsed[0] not in compression:
+            continue
+        method, tolerance = compression[parsed[0]]
+        column = table.column(name)
+        if pa.types.is_floating(column.type):
+            column = column.fill_null(float("nan"))
+        elif column.null_count > 0:
+            continue
+
+        values = column.to_numpy().astype(np.float64)
+        if pa.types.is_floating(column.type):
+            # the reconstruction is rounded to the stored precision
+            rounding = np.finfo(column.type.to_pandas_dtype()).eps * np.nanmax(
+                np.abs(values), initial=0
+            )
+            tolerance = max(tolerance - 2 * rounding, 0)
+        keep = COMPRESSION_METHODS[method](timestamps, values, tolerance)
+
+        kept_values = pc.if_else(pa.array(keep), column, pa.nulls(len(keep), column.type))
+        table = table.set_column(i, table.schema.field(i), kept_values)
+        compressed[name] = method
+        samples, kept = counts.get(parsed[0], [0, 0])
+        counts[parsed[0]] = [samples + len(keep), kept + int(keep.sum())]
+
+    if compressed:
+        metadata = dict(table.schema.metadata or {})
+        metadata[COMPRESSION_METADATA_KEY] = json.dumps(compressed).encode()
+        table = table.replace_schema_metadata(metadata)
+    return table, counts
+
+
+def decompress_table(table):
+    """
+    Reconstructs the samples dropped by compress_table. Tables without compressed columns are returned unchanged.
+    """
+    metadata = table.schema.metadata or {}
+    if COMPRESSION_METADATA_KEY not in metadata:
+        return table
+    compressed = json.loads(metadata[COMPRESSION_METADATA_KEY])
+
+    timestamps = table.column("timestamp").to_numpy()
+    for name, method in compressed.items():
+        if name not in table.column_names:
+            continue
+        column = table.column(name)
+        if column.null_count == 0:
+            continue
+
+        if method == "deadband":
+            column = pc.fill_null_forward(column)
+        else:
+            dropped = column.is_null().to_numpy()
+            values = column.to_numpy().astype(np.float64)
+            values[dropped] = np.interp(
+                timestamps[dropped], timestamps[~dropped], values[~dropped]
+            )
+            column = pa.array(values).cast(column.type)
+        table = table.set_column(table.column_names.index(name), name, column)
+
+    metadata = dict(metadata)
+    del metadata[COMPRESSION_METADATA_KEY]
+    return table.replace_schema_metadata(metadata)
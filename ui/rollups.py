@@ -0,0 +1,252 @@
+"""
+Aggregates measurements into rollup tiers with a coarser resolution (e.g. one row per 10s or 60s).
+
+A rollup row has the same columns as the measurements (wide layout), holding the mean of each value,
+plus a min and a max column for every value of a TEC and every tick aggregate,
+e.g. "object temperature min_top_0" or "sum output power max".
+The "max abs" tick aggregates hold the value with the maximum absolute value of the interval instead of the mean.
+Integer columns (loop status, sample status) hold the last value of the interval.
+The number of measurements of the interval is kept as well, so rollup rows are combined with weighted means.
+The timestamp of a rollup row is the start of its interval.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from app.measurement_schema import parse_wide_column, wide_column
+from app.tick_aggregates import MAX_ABS_AGGREGATES, TICK_AGGREGATES
+
+# rollup tiers: (interval in seconds, retention in seconds)
+ROLLUP_TIERS = [
+    (10, 24 * 60 * 60),  # 24 hours
+    (60, 7 * 24 * 60 * 60),  # 7 days
+]
+
+# aggregates stored in addition to the mean, appended to the parameter name
+ROLLUP_AGGREGATES = ["min", "max"]
+
+# column holding the number of measurements of a rollup row
+COUNT_COLUMN = "sample count"
+
+
+def rollup_column(column, aggregate):
+    """
+    Returns the name of the column holding an aggregate of a TEC column or a tick aggregate,
+    e.g. "object temperature min_top_0" or "sum output power min".
+    """
+    parsed = parse_wide_column(column)
+    if parsed is None:
+        return f"{column} {aggregate}"
+    parameter, plate, tec_id = parsed
+    return wide_column(f"{parameter} {aggregate}", plate, tec_id)
+
+
+def has_extremes(column):
+    """
+    Returns True if the min and max of a column are kept, i.e. for TEC columns and tick aggregates.
+    """
+    return parse_wide_column(column) is not None or column in TICK_AGGREGATES
+
+
+def _max_abs_reduceat(values, first_rows):
+    """
+    Value with the maximum absolute value of every block of rows, missing values are skipped.
+    """
+    minimum = np.fmin.reduceat(values, first_rows)
+    maximum = np.fmax.reduceat(values, first_rows)
+    return np.where(np.abs(minimum) > np.abs(maximum), minimum, maximum)
+
+
+def base_parameter(parameter):
+    """
+    Returns the parameter an aggregate column belongs to, e.g. "object temperature" for "object temperature min".
+    """
+    for aggregate in ROLLUP_AGGREGATES:
+        if parameter.endswith(f" {aggregate}"):
+            return parameter[: -len(aggregate) - 1]
+    return parameter
+
+
+def aggregate(df, interval):
+    """
+    Aggregates measurements in the wide layout into one row per interval.
+
+    Args:
+        df (pd.DataFrame): measurements in the wide layout, sorted by time.
+        interval (int): length of the intervals in seconds.
+
+    Returns:
+        pd.DataFrame: one rollup row per interval with data.
+    """
+    interval_ms = interval * 1000
+    interval_starts = df["timestamp"].to_numpy() // interval_ms * interval_ms
+
+    # the rows are sorted by time, so every interval is a block of rows
+    first_rows = np.flatnonzero(np.r_[True, interval_starts[1:] != interval_starts[:-1]])
+    last_rows = np.r_[first_rows[1:], len(df)] - 1
+
+    float_columns = [
+        column
+        for column in df.columns
+        if column != "timestamp" and df[column].dtype.kind == "f"
+    ]
+    extreme_columns = [column for column in float_columns if has_extremes(column)]
+
+    # mean, min and max of all blocks at once, missing values are skipped
+    values = df[float_columns].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.add.reduceat(np.nan_to_num(values), first_rows) / np.add.reduceat(
+            ~np.isnan(values), first_rows
+        )
+    means = pd.DataFrame(means.astype(np.float32), columns=float_columns)
+    # the extreme value of the "max abs" aggregates instead of their mean
+    for column in MAX_ABS_AGGREGATES:
+        if column in means.columns:
+            means[column] = _max_abs_reduceat(df[column].to_numpy(), first_rows)
+
+    extreme_values = df[extreme_columns].to_numpy()
+    parts = [
+        pd.DataFrame({"timestamp": interval_starts[first_rows]}),
+        means,
+        pd.DataFrame(
+            np.fmin.reduceat(extreme_values, first_rows),
+            columns=[rollup_column(column, "min") for column in extreme_columns],
+        ),
+        pd.DataFrame(
+            np.fmax.reduceat(extreme_values, first_rows),
+            columns=[rollup_column(column, "max") for column in extreme_columns],
+        ),
+        pd.DataFrame({COUNT_COLUMN: np.diff(np.r_[first_rows, len(df)]).astype(np.int64)}),
+    ]
+
+    # other columns (loop status, sample status) keep their last value
+    other_columns = [
+        column
+        for column in df.columns
+        if column != "timestamp" and column not in float_columns
+    ]
+    parts.append(df[other_columns].iloc[last_rows].reset_index(drop=True))
+    rollup = pd.concat(parts, axis=1)
+
+    # same column order as the measurements, followed by the aggregates
+    return rollup[
+        list(df.columns)
+        + [column for column in rollup.columns if column not in df.columns]
+    ]
+
+
+def reaggregate(rollup, interval):
+    """
+    Aggregates rollup rows into longer intervals, e.g. to reduce a tier to the resolution of a graph.
+    Means are averaged weighted by the number of measurements of every row (equally weighted for rollups
+    without COUNT_COLUMN), min and max columns keep their minimum and maximum, the "max abs" aggregates
+    their extreme value, the counts are added up and the other columns keep their last value.
+
+    Args:
+        rollup (pd.DataFrame): rollup rows, sorted by time.
+        interval (float): length of the new intervals in seconds.
+
+    Returns:
+        pd.DataFrame: one rollup row per new interval with data, with the same columns.
+    """
+    interval_ms = max(int(interval * 1000), 1)
+    interval_starts = rollup["timestamp"].to_numpy() // interval_ms * interval_ms
+
+    first_rows = np.flatnonzero(np.r_[True, interval_starts[1:] != interval_starts[:-1]])
+    last_rows = np.r_[first_rows[1:], len(rollup)] - 1
+
+    if COUNT_COLUMN in rollup.columns:
+        counts = rollup[COUNT_COLUMN].to_numpy()
+    else:
+        counts = np.ones(len(rollup), dtype=np.int64)
+
+    columns = {"timestamp": interval_starts[first_rows]}
+    for column in rollup.columns:
+        if column == "timestamp":
+            continue
+        values = rollup[column].to_numpy()
+        if column == COUNT_COLUMN:
+            columns[column] = np.add.reduceat(values, first_rows)
+            continue
+        if values.dtype.kind != "f":
+            columns[column] = values[last_rows]
+            continue
+
+        parsed = parse_wide_column(column)
+        parameter = parsed[0] if parsed is not None else column
+        if column in MAX_ABS_AGGREGATES:
+            columns[column] = _max_abs_reduceat(values, first_rows)
+        elif parameter.endswith(" min"):
+            columns[column] = np.fmin.reduceat(values, first_rows)
+        elif parameter.endswith(" max"):
+            columns[column] = np.fmax.reduceat(values, first_rows)
+        else:
+            # rows without a value do not count
+            weights = np.where(np.isnan(values), 0, counts)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                columns[column] = (
+                    np.add.reduceat(np.nan_to_num(values) * weights, first_rows)
+                    / np.add.reduceat(weights, first_rows)
+                ).astype(values.dtype)
+    return pd.DataFrame(columns, columns=rollup.columns)
+
+
+class RollupAggregator:
+    """
+    Maintains one rollup tier incrementally as measurements arrive.
+    """
+
+    def __init__(self, interval):
+        """
+        Args:
+            interval (int): length of the intervals in seconds.
+        """
+        self.interval = interval
+
+        # measurements of the interval that is not complete yet
+        self._pending = []
+        self._pending_interval = None
+
+    def add(self, data):
+        """
+        Adds measurements in the wide layout (sorted by time) as a dataframe or an Arrow table.
+        Arrow tables are only converted to a dataframe once their interval is complete.
+
+        Returns:
+            pd.DataFrame: rollup rows of the intervals completed by these measurements or None.
+        """
+        is_table = isinstance(data, pa.Table)
+        timestamps = data.column("timestamp") if is_table else data["timestamp"]
+        intervals = timestamps.to_numpy() // (self.interval * 1000)
+        last_interval = intervals[-1]
+
+        def rows(mask):
+            return data.filter(pa.array(mask)) if is_table else data[mask]
+
+        # a measurement in a new interval completes all previous ones
+        completed = []
+        if last_interval != self._pending_interval:
+            completed = self._pending
+            if intervals[0] != last_interval:
+                completed = completed + [rows(intervals != last_interval)]
+            self._pending = []
+
+        # usually all measurements are in the same interval (e.g. one per tick)
+        self._pending.append(data if intervals[0] == last_interval else rows(intervals == last_interval))
+        self._pending_interval = last_interval
+
+        completed = [frame for frame in completed if len(frame) > 0]
+        if not completed:
+            return None
+        if all(isinstance(frame, pa.Table) for frame in completed):
+            df = pa.concat_tables(completed).to_pandas()
+        else:
+            df = pd.concat(
+                [
+                    frame.to_pandas() if isinstance(frame, pa.Table) else frame
+                    for frame in completed
+                ],
+                ignore_index=True,
+            )
+        return aggregate(df, self.interval)
@@ -0,0 +1,355 @@
+"""
+Archive of sealed data segments on the local disk.
+
+Segments that left the live window are written to immutable Parquet files, partitioned by day
+(ARCHIVE_DIR/<session>/<YYYY-MM-DD>/<first timestamp>.parquet). Every segment is one row group,
+so the row group statistics describe the time range of each segment. A small manifest lists
+all files with their time range, so readers only open the files they need.
+
+Finished sessions are listed in a catalog (see SessionCatalog) and kept in their own directory,
+starting a new session only renames the directory of the current one.
+
+Slowly varying TEC columns can be compressed lossily before they are written (see ARCHIVE_COMPRESSION
+and ui.lossy_compression), they are reconstructed within their tolerance on read.
+
+The storage of a session is pluggable: instead of Parquet files, a session can be kept in an embedded
+SQLite database (see ui.sqlite_archive), which offers the same interface. ARCHIVE_BACKEND selects the
+backend of new sessions (environment variable TEC_ARCHIVE_BACKEND), existing sessions are read
+with the backend they were written with.
+"""
+
+from datetime import datetime, timezone
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from ui.lossy_compression import compress_table, decompress_table
+from ui.rollups import aggregate
+from ui.sqlite_archive import DATABASE_FILE, SQLiteArchive
+
+# root directory of the archive
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "archive")
+
+# storages of sessions: "parquet" (files, see SegmentArchive) or "sqlite" (database, see SQLiteArchive)
+ARCHIVE_BACKENDS = ["parquet", "sqlite"]
+
+# storage of new sessions, set with the environment variable TEC_ARCHIVE_BACKEND (both processes read it)
+ARCHIVE_BACKEND = os.getenv("TEC_ARCHIVE_BACKEND", "parquet").lower()
+if ARCHIVE_BACKEND not in ARCHIVE_BACKENDS:
+    raise ValueError(f"Unknown archive backend: {ARCHIVE_BACKEND}, use one of {ARCHIVE_BACKENDS}")
+
+# lossy compression of the Parquet files: parameter -> (method, tolerance), see ui.lossy_compression
+# a deadband of 0 only keeps changes, so it is lossless, an empty dict stores every sample
+ARCHIVE_COMPRESSION = {
+    "object temperature": ("swinging door", 0.01),
+    "target object temperature": ("deadband", 0),
+    "loop status": ("deadband", 0),
+}
+
+# sessions in the archive
+CURRENT_SESSION = "current"
+PREVIOUS_SESSION = "previous"  # single previous session of older versions, only read for migration
+
+# directory of the finished sessions within the archive
+SESSIONS_DIR = "sessions"
+
+# name of the manifest in every session directory
+MANIFEST_FILE = "manifest.json"
+
+# name of the catalog of the finished sessions
+CATALOG_FILE = "catalog.json"
+
+
+def open_archive(session, root=ARCHIVE_DIR):
+    """
+    Returns the archive of a session. Sessions with data are opened with the backend they were written with,
+    new sessions with ARCHIVE_BACKEND.
+
+    Args:
+        session (str): name of the session, e.g. CURRENT_SESSION.
+        root (str): root directory of the archive.
+    """
+    path = os.path.join(root, session)
+    if os.path.exists(os.path.join(path, DATABASE_FILE)):
+        return SQLiteArchive(session, root)
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)) or ARCHIVE_BACKEND == "parquet":
+        return SegmentArchive(session, root)
+    return SQLiteArchive(session, root)
+
+
+class SegmentArchive:
+    """
+    Archive of one session. Files are only ever added as a whole, never modified.
+    """
+
+    def __init__(self, session, root=ARCHIVE_DIR):
+        """
+        Args:
+            session (str): name of the session, e.g. CURRENT_SESSION.
+            root (str): root directory of the archive.
+        """
+        self.root = root
+        self.path = os.path.join(root, session)
+
+    def get_manifest(self):
+        """
+        Returns the list of files of the session, sorted by time.
+        Every entry has the keys "file", "first_timestamp", "last_timestamp" and "rows",
+        compressed files also "compression" (parameter -> [samples, kept samples]).
+        """
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE)) as f:
+                return json.load(f)["files"]
+        except FileNotFoundError:
+            return []
+
+    def write(self, tables):
+        """
+        Writes segments into a new file. Each segment becomes one row group.
+        The columns of ARCHIVE_COMPRESSION are compressed over the whole file, which is then one row group,
+        because it is always read as a whole.
+
+        Args:
+            tables (list of pa.Table): segments in the wide layout, sorted by time.
+        """
+        if not tables:
+            return
+
+        first_timestamp = int(tables[0].column("timestamp")[0].as_py())
+        last_timestamp = int(tables[-1].column("timestamp")[-1].as_py())
+        day = datetime.fromtimestamp(first_timestamp / 1000, timezone.utc).strftime(
+            "%Y-%m-%d"
+        )
+        file = os.path.join(day, f"{first_timestamp}.parquet")
+        os.makedirs(os.path.join(self.path, day), exist_ok=True)
+
+        table, compression = compress_table(
+            pa.concat_tables(tables, promote_options="default"), ARCHIVE_COMPRESSION
+        )
+
+        # write to a temporary file first, readers only see complete files
+        path = os.path.join(self.path, file)
+        with pq.ParquetWriter(f"{path}.tmp", table.schema) as writer:
+            if compression:
+                writer.write_table(table, row_group_size=table.num_rows)
+            else:
+                offset = 0
+                for segment in tables:
+                    writer.write_table(table.slice(offset, segment.num_rows))
+                    offset += segment.num_rows
+        os.replace(f"{path}.tmp", path)
+
+        entry = {
+            "file": file,
+            "first_timestamp": first_timestamp,
+            "last_timestamp": last_timestamp,
+            "rows": table.num_rows,
+        }
+        if compression:
+            entry["compression"] = compression
+        files = self.get_manifest()
+        files.append(entry)
+        self._write_manifest(files)
+
+    def read(self, start=None, end=None, select=None):
+        """
+        Reads the files of the session. The files are memory-mapped instead of read into memory,
+        only files overlapping the time range are opened and only the selected columns are decoded.
+
+        Args:
+            start (int): first timestamp (ms since epoch) to read, from the beginning if None.
+            end (int): last timestamp (ms since epoch) to read, until the end if None.
+            select (function): returns the columns to read from the column names of a file, all if None.
+
+        Returns:
+            list of pa.Table: one table per file, sorted by time.
+        """
+        return list(self.iter_read(start, end, select))
+
+    def iter_read(self, start=None, end=None, select=None):
+        """
+        Like read, but yields one table per file, so only one file is decoded at a time.
+        """
+        # row groups outside the time range are skipped based on their statistics
+        filters = []
+        if start is not None:
+            filters.append(("timestamp", ">=", start))
+        if end is not None:
+            filters.append(("timestamp", "<=", end))
+
+        for entry in self.get_manifest():
+            if start is not None and entry["last_timestamp"] < start:
+                continue
+            if end is not None and entry["first_timestamp"] > end:
+                continue
+
+            path = os.path.join(self.path, entry["file"])
+            columns = None
+            if select is not None:
+                columns = select(pq.read_schema(path, memory_map=True).names)
+
+            if "compression" not in entry:
+                yield pq.read_table(
+                    path, columns=columns, filters=filters or None, memory_map=True
+                )
+                continue
+
+            # dropped samples are reconstructed from the samples around them, so the whole file is read
+            table = decompress_table(pq.read_table(path, columns=columns, memory_map=True))
+            timestamps = table.column("timestamp")
+            if start is not None:
+                table = table.filter(pc.greater_equal(timestamps, start))
+                timestamps = table.column("timestamp")
+            if end is not None:
+                table = table.filter(pc.less_equal(timestamps, end))
+            yield table
+
+    def get_compression_ratios(self):
+        """
+        Returns the compression ratio (samples per kept sample) of every compressed parameter of the session.
+        """
+        counts = {}
+        for entry in self.get_manifest():
+            for parameter, (samples, kept) in entry.get("compression", {}).items():
+                total_samples, total_kept = counts.get(parameter, (0, 0))
+                counts[parameter] = (total_samples + samples, total_kept + kept)
+        return {
+            parameter: samples / max(kept, 1) for parameter, (samples, kept) in counts.items()
+        }
+
+    def aggregate(self, start=None, end=None, select=None, interval=60):
+        """
+        Aggregates the data of the session into one row per interval with the layout of ui.rollups.
+        The files are aggregated one at a time, so only the aggregated rows are kept in memory.
+
+        Args:
+            start, end, select: see read.
+            interval (int): length of the intervals in seconds.
+
+        Returns:
+            pa.Table or None if there is no data in the range.
+        """
+        interval_ms = interval * 1000
+        rollups = []
+        # rows of the last interval of the previous file, it may continue in the next file
+        pending = None
+        for table in self.iter_read(start, end, select):
+            if table.num_rows == 0:
+                continue
+            df = table.to_pandas()
+            if pending is not None:
+                df = pd.concat([pending, df], ignore_index=True)
+
+            timestamps = df["timestamp"].to_numpy()
+            complete = timestamps < timestamps[-1] // interval_ms * interval_ms
+            if complete.any():
+                rollups.append(aggregate(df[complete], interval))
+            pending = df[~complete]
+
+        if pending is not None:
+            rollups.append(aggregate(pending, interval))
+        if not rollups:
+            return None
+        return pa.Table.from_pandas(pd.concat(rollups, ignore_index=True), preserve_index=False)
+
+    def clear(self):
+        """
+        Deletes all files of the session.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write_manifest(self, files):
+        """
+        Replaces the manifest atomically.
+        """
+        _write_json(os.path.join(self.path, MANIFEST_FILE), {"files": files})
+
+
+class SessionCatalog:
+    """
+    Catalog of the finished sessions. Every session has an id, its time range, its number of rows
+    and its own directory, whose data is only read on request.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        """
+        Args:
+            root (str): root directory of the archive.
+        """
+        self.root = root
+        self.sessions_root = os.path.join(root, SESSIONS_DIR)
+
+    def get_sessions(self):
+        """
+        Returns the list of finished sessions, sorted by time (newest last).
+        Every entry has the keys "id", "start", "end" (ms since epoch) and "rows".
+        """
+        try:
+            with open(os.path.join(self.root, CATALOG_FILE)) as f:
+                return json.load(f)["sessions"]
+        except FileNotFoundError:
+            return []
+
+    def get_archive(self, session_id):
+        """
+        Returns the archive of a finished session.
+        """
+        return open_archive(session_id, root=self.sessions_root)
+
+    def add(self, archive):
+        """
+        Finishes a session: its directory is renamed into the catalog, the data is not touched.
+        An empty session is removed instead.
+
+        Args:
+            archive (SegmentArchive or SQLiteArchive): archive of the session, e.g. the current session.
+
+        Returns:
+            str: id of the new session or None if the session was empty.
+        """
+        files = archive.get_manifest()
+        if not files:
+            archive.clear()
+            return None
+
+        start = files[0]["first_timestamp"]
+        end = files[-1]["last_timestamp"]
+
+        # the id is the local start time, made unique if sessions started within the same second
+        sessions = self.get_sessions()
+        ids = {session["id"] for session in sessions}
+        session_id = datetime.fromtimestamp(start / 1000).strftime("%Y-%m-%d_%H-%M-%S")
+        unique_id = session_id
+        number = 1
+        while unique_id in ids:
+            number += 1
+            unique_id = f"{session_id}_{number}"
+
+        os.makedirs(self.sessions_root, exist_ok=True)
+        os.replace(archive.path, os.path.join(self.sessions_root, unique_id))
+
+        sessions.append(
+            {
+                "id": unique_id,
+                "start": start,
+                "end": end,
+                "rows": sum(entry["rows"] for entry in files),
+            }
+        )
+        sessions.sort(key=lambda session: session["start"])
+        _write_json(os.path.join(self.root, CATALOG_FILE), {"sessions": sessions})
+        return unique_id
+
+
+def _write_json(path, data):
+    """
+    Replaces a json file atomically.
+    """
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,262 @@
+"""
+Ring buffer in shared memory for passing the live data from the data acquisition to the UI process.
+
+The block has a fixed-stride columnar layout: a header, the column names and dtypes as JSON
+and one preallocated array per column. The writer protects every append with a sequence counter
+(seqlock), so readers never see a half written measurement and never block the writer.
+The writer also stores the time of its last append (heartbeat), readers ignore a block whose writer
+stopped appending, e.g. because it crashed and could not remove the block.
+Redis is still used for the durable store, this only replaces the live path.
+"""
+
+import atexit
+import json
+import os
+from multiprocessing import resource_tracker, shared_memory
+from time import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# name of the shared memory block
+SHARED_RING_NAME = "tec-live-ring"
+
+# format version of the block, blocks of other versions are ignored by readers
+_RING_VERSION = 2
+
+# a block without an append for this long (in seconds) is ignored by readers,
+# the data acquisition appends at least every 5 seconds (see app.polling_rate)
+SHARED_RING_MAX_AGE = 30
+
+# header of the block
+_HEADER_DTYPE = np.dtype(
+    [
+        ("version", "<i8"),
+        ("capacity", "<i8"),
+        ("count", "<i8"),  # number of rows written since the block was created
+        ("sequence", "<i8"),  # odd while the writer is appending
+        ("layout_size", "<i8"),
+        ("heartbeat", "<i8"),  # time of the last append (ms since epoch)
+    ]
+)
+
+# bytes reserved for the layout (column names and dtypes as JSON)
+_LAYOUT_SIZE = 16384
+
+# start of the column arrays
+_DATA_OFFSET = _HEADER_DTYPE.itemsize + _LAYOUT_SIZE
+
+# number of attempts of a reader to get a consistent snapshot
+_READ_ATTEMPTS = 10
+
+
+def _column_offsets(dtypes, capacity):
+    """
+    Returns the offset of every column array and the total size of the block.
+    Every column starts at an 8 byte boundary.
+    """
+    offsets = []
+    offset = _DATA_OFFSET
+    for dtype in dtypes:
+        offsets.append(offset)
+        offset += -(-capacity * np.dtype(dtype).itemsize // 8) * 8
+    return offsets, offset
+
+
+def _column_views(buffer, dtypes, capacity):
+    """
+    Returns one array per column that maps into the block.
+    """
+    offsets, _ = _column_offsets(dtypes, capacity)
+    return [
+        np.ndarray(capacity, dtype=dtype, buffer=buffer, offset=offset)
+        for dtype, offset in zip(dtypes, offsets)
+    ]
+
+
+class SharedRingWriter:
+    """
+    Creates the shared memory block and appends measurements in the wide layout to it.
+    There must only be one writer per block.
+    """
+
+    def __init__(self, columns, dtypes, capacity, name=SHARED_RING_NAME):
+        """
+        Args:
+            columns (list of str): column names of the measurements.
+            dtypes (list of str): dtype of each column.
+            capacity (int): number of measurements kept in the ring.
+            name (str): name of the shared memory block.
+        """
+        self.columns = list(columns)
+        self.dtypes = [np.dtype(dtype).str for dtype in dtypes]
+        self.capacity = capacity
+
+        layout = json.dumps({"columns": self.columns, "dtypes": self.dtypes}).encode()
+        assert len(layout) <= _LAYOUT_SIZE, "Too many columns for the shared ring"
+
+        # a block left over by a crashed writer is replaced
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        _, size = _column_offsets(self.dtypes, capacity)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self._shm.buf[_HEADER_DTYPE.itemsize : _HEADER_DTYPE.itemsize + len(layout)] = layout
+        self._header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=self._shm.buf)
+        self._header["capacity"] = capacity
+        self._header["count"] = 0
+        self._header["sequence"] = 0
+        self._header["layout_size"] = len(layout)
+        self._header["heartbeat"] = int(time() * 1000)
+        self._arrays = _column_views(self._shm.buf, self.dtypes, capacity)
+
+        # readers only accept the block once it is complete
+        self._header["version"] = _RING_VERSION
+
+        # the block is also removed if the process exits without closing the writer
+        atexit.register(self.close)
+
+    @classmethod
+    def from_dataframe(cls, df, capacity, name=SHARED_RING_NAME):
+        """
+        Creates a writer for measurements with the columns and dtypes of df.
+        """
+        return cls(df.columns, df.dtypes, capacity, name)
+
+    @classmethod
+    def from_table(cls, table, capacity, name=SHARED_RING_NAME):
+        """
+        Creates a writer for measurements with the columns and types of an Arrow table.
+        """
+        return cls(
+            table.column_names,
+            [field.type.to_pandas_dtype() for field in table.schema],
+            capacity,
+            name,
+        )
+
+    def matches(self, data):
+        """
+        Returns True if data (dataframe or Arrow table) has the columns of this ring.
+        """
+        if isinstance(data, pa.Table):
+            return data.column_names == self.columns
+        return list(data.columns) == self.columns
+
+    def append(self, data):
+        """
+        Appends measurements in the wide layout (one row per measurement) from a dataframe or an Arrow table.
+        """
+        count = int(self._header["count"])
+        positions = (count + np.arange(len(data))) % self.capacity
+
+        if isinstance(data, pa.Table):
+            columns = [data.column(column).to_numpy() for column in self.columns]
+        else:
+            columns = [data[column].to_numpy() for column in self.columns]
+
+        self._header["sequence"] += 1
+        for values, array in zip(columns, self._arrays):
+            array[positions] = values
+        self._header["count"] = count + len(data)
+        self._header["sequence"] += 1
+        self._header["heartbeat"] = int(time() * 1000)
+
+    def close(self):
+        """
+        Closes and removes the shared memory block. Does nothing if it was closed already.
+        """
+        if self._shm is None:
+            return
+        atexit.unregister(self.close)
+
+        # the views must be released before the block can be closed
+        self._header = None
+        self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+def _attach(name):
+    """
+    Attaches to an existing block without handing it to the resource tracker of this process,
+    which would remove the block when this process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always tracks the block on POSIX systems
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _is_fresh(buffer, max_age):
+    """
+    Returns True if the writer of the block appended within the last max_age seconds.
+    """
+    header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=buffer)
+    return time() * 1000 - int(header["heartbeat"]) <= max_age * 1000
+
+
+def _snapshot(buffer, num_rows):
+    """
+    Copies the newest num_rows measurements out of the block.
+    Returns None if the writer was appending at the same time.
+    """
+    header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=buffer)
+    if int(header["version"]) != _RING_VERSION:
+        return None
+
+    capacity = int(header["capacity"])
+    layout_size = int(header["layout_size"])
+    layout = json.loads(
+        bytes(buffer[_HEADER_DTYPE.itemsize : _HEADER_DTYPE.itemsize + layout_size])
+    )
+
+    sequence = int(header["sequence"])
+    if sequence % 2 == 1:
+        return None
+
+    count = int(header["count"])
+    num_rows = min(count, capacity) if num_rows is None else min(num_rows, count, capacity)
+    positions = (count - num_rows + np.arange(num_rows)) % capacity
+
+    arrays = _column_views(buffer, layout["dtypes"], capacity)
+    columns = {
+        column: array[positions] for column, array in zip(layout["columns"], arrays)
+    }
+
+    if int(header["sequence"]) != sequence:
+        return None
+    return pd.DataFrame(columns)
+
+
+def read_shared_ring(num_rows=None, name=SHARED_RING_NAME, max_age=SHARED_RING_MAX_AGE):
+    """
+    Returns the newest num_rows measurements (all if None) in the wide layout.
+    Returns None if there is no ring, e.g. because the data acquisition runs on another machine,
+    or if its writer did not append within max_age seconds (never if None), e.g. because it crashed.
+    """
+    try:
+        shm = _attach(name)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    try:
+        if max_age is not None and not _is_fresh(shm.buf, max_age):
+            return None
+        for _ in range(_READ_ATTEMPTS):
+            df = _snapshot(shm.buf, num_rows)
+            if df is not None:
+                return df if not df.empty else None
+        return None
+    finally:
+        shm.close()
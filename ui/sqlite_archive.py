@@ -0,0 +1,316 @@
+"""
+Archive of one session in an embedded SQLite database on the local disk, an alternative to the
+Parquet files of ui.segment_archive with the same interface (select it with ARCHIVE_BACKEND).
+
+All measurements are rows of one table in the wide layout, keyed by their timestamp,
+so time ranges are read through the primary key index and aggregations run in SQL.
+The database is in WAL mode, so readers are not blocked while the data acquisition writes.
+The Arrow schema of the data is stored with it, so tables are read back with the compact dtypes.
+"""
+
+from contextlib import closing
+import os
+import shutil
+import sqlite3
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from app.tick_aggregates import MAX_ABS_AGGREGATES
+from ui.rollups import COUNT_COLUMN, has_extremes, rollup_column
+
+# name of the database in every session directory
+DATABASE_FILE = "samples.sqlite"
+
+# number of rows per table yielded by iter_read
+READ_CHUNK_ROWS = 3600
+
+
+def _quote(column):
+    """
+    Returns the column name as an SQL identifier.
+    """
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _sql_type(arrow_type):
+    """
+    Returns the SQLite type storing values of an Arrow type.
+    """
+    if pa.types.is_integer(arrow_type):
+        return "INTEGER"
+    if pa.types.is_floating(arrow_type):
+        return "REAL"
+    return "BLOB"
+
+
+class SQLiteArchive:
+    """
+    Archive of one session in a SQLite database. Every write is one transaction.
+    """
+
+    def __init__(self, session, root):
+        """
+        Args:
+            session (str): name of the session, e.g. CURRENT_SESSION.
+            root (str): root directory of the archive.
+        """
+        self.root = root
+        self.path = os.path.join(root, session)
+        self.database = os.path.join(self.path, DATABASE_FILE)
+
+    def _connect(self):
+        """
+        Opens a new connection, connections are not shared between threads.
+        """
+        connection = sqlite3.connect(self.database, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _get_schema(self, connection):
+        """
+        Returns the Arrow schema of the stored data or None if nothing was written yet.
+        """
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        except sqlite3.OperationalError:
+            # no tables yet
+            return None
+        if row is None:
+            return None
+        return ipc.read_schema(pa.py_buffer(row[0]))
+
+    def get_manifest(self):
+        """
+        Returns the list of writes of the session, sorted by time.
+        Every entry has the keys "file", "first_timestamp", "last_timestamp" and "rows", like SegmentArchive.
+        """
+        if not os.path.exists(self.database):
+            return []
+        with closing(self._connect()) as connection:
+            try:
+                rows = connection.execute(
+                    "SELECT first_timestamp, last_timestamp, rows FROM batches ORDER BY first_timestamp"
+                ).fetchall()
+            except sqlite3.OperationalError:
+                return []
+        return [
+            {
+                "file": DATABASE_FILE,
+                "first_timestamp": first_timestamp,
+                "last_timestamp": last_timestamp,
+                "rows": num_rows,
+            }
+            for first_timestamp, last_timestamp, num_rows in rows
+        ]
+
+    def write(self, tables):
+        """
+        Inserts segments in one transaction. New columns are added to the table.
+
+        Args:
+            tables (list of pa.Table): segments in the wide layout, sorted by time.
+        """
+        if not tables:
+            return
+        table = pa.concat_tables(tables, promote_options="default")
+
+        os.makedirs(self.path, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS batches "
+                "(first_timestamp INTEGER PRIMARY KEY, last_timestamp INTEGER, rows INTEGER)"
+            )
+
+            schema = self._get_schema(connection)
+            if schema is None:
+                schema = table.schema
+                columns = ", ".join(
+                    f"{_quote(field.name)} {_sql_type(field.type)}"
+                    + (" PRIMARY KEY" if field.name == "timestamp" else "")
+                    for field in schema
+                )
+                connection.execute(f"CREATE TABLE samples ({columns})")
+            else:
+                # columns of newer versions
+                for field in table.schema:
+                    if field.name not in schema.names:
+                        connection.execute(
+                            f"ALTER TABLE samples ADD COLUMN {_quote(field.name)} {_sql_type(field.type)}"
+                        )
+                        schema = schema.append(field)
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('schema', ?)",
+                (schema.serialize().to_pybytes(),),
+            )
+
+            # missing values (NaN) are stored as NULL
+            names = table.column_names
+            connection.executemany(
+                f"INSERT OR REPLACE INTO samples ({', '.join(map(_quote, names))}) "
+                f"VALUES ({', '.join('?' * len(names))})",
+                zip(*(table.column(name).to_pylist() for name in names)),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO batches VALUES (?, ?, ?)",
+                (
+                    int(tables[0].column("timestamp")[0].as_py()),
+                    int(tables[-1].column("timestamp")[-1].as_py()),
+                    table.num_rows,
+                ),
+            )
+
+    def _where(self, start, end):
+        """
+        Returns the WHERE clause and its parameters of a time range.
+        """
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("timestamp <= ?")
+            parameters.append(end)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), parameters
+
+    def read(self, start=None, end=None, select=None):
+        """
+        Reads the data of the session, see SegmentArchive.read.
+
+        Returns:
+            list of pa.Table: tables of up to READ_CHUNK_ROWS rows, sorted by time.
+        """
+        return list(self.iter_read(start, end, select))
+
+    def iter_read(self, start=None, end=None, select=None):
+        """
+        Like read, but yields one table of up to READ_CHUNK_ROWS rows at a time.
+        The time range and the columns are selected in SQL.
+        """
+        if not os.path.exists(self.database):
+            return
+        with closing(self._connect()) as connection:
+            schema = self._get_schema(connection)
+            if schema is None:
+                return
+            names = schema.names if select is None else select(schema.names)
+            schema = pa.schema([schema.field(name) for name in names])
+
+            where, parameters = self._where(start, end)
+            cursor = connection.execute(
+                f"SELECT {', '.join(map(_quote, names))} FROM samples{where} ORDER BY timestamp",
+                parameters,
+            )
+            while True:
+                rows = cursor.fetchmany(READ_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield _rows_to_table(rows, schema)
+
+    def aggregate(self, start=None, end=None, select=None, interval=60):
+        """
+        Aggregates the data of the session into one row per interval in SQL, with the layout of ui.rollups:
+        the mean of every float column (the extreme value of the "max abs" aggregates), the min and max
+        of every TEC column and tick aggregate, the number of measurements and the last value of the integer columns.
+
+        Args:
+            start, end, select: see read.
+            interval (int): length of the intervals in seconds.
+
+        Returns:
+            pa.Table or None if there is no data in the range.
+        """
+        if not os.path.exists(self.database):
+            return None
+        with closing(self._connect()) as connection:
+            schema = self._get_schema(connection)
+            if schema is None:
+                return None
+            names = schema.names if select is None else select(schema.names)
+
+            aggregates = []
+            last_columns = []
+            fields = []
+            for name in names:
+                field = schema.field(name)
+                if name == "timestamp":
+                    continue
+                if name in MAX_ABS_AGGREGATES:
+                    # the value with the maximum absolute value, like ui.rollups
+                    aggregates.append(
+                        f"CASE WHEN MAX(ABS({_quote(name)})) = MAX({_quote(name)}) "
+                        f"THEN MAX({_quote(name)}) ELSE MIN({_quote(name)}) END AS {_quote(name)}"
+                    )
+                    fields.append(field)
+                elif pa.types.is_floating(field.type):
+                    aggregates.append(f"AVG({_quote(name)}) AS {_quote(name)}")
+                    fields.append(field)
+                else:
+                    last_columns.append(name)
+            extreme_fields = [field for field in fields if has_extremes(field.name)]
+            for function in ["min", "max"]:
+                for field in extreme_fields:
+                    column = rollup_column(field.name, function)
+                    aggregates.append(f"{function.upper()}({_quote(field.name)}) AS {_quote(column)}")
+                    fields.append(pa.field(column, field.type))
+            aggregates.append(f"COUNT(*) AS {_quote(COUNT_COLUMN)}")
+            fields.append(pa.field(COUNT_COLUMN, pa.int64()))
+
+            where, parameters = self._where(start, end)
+            interval_ms = interval * 1000
+            columns = (
+                ["intervals.interval_start"]
+                + [f"intervals.{_quote(field.name)}" for field in fields]
+                # the other columns are taken from the last row of every interval
+                + [f"samples.{_quote(name)}" for name in last_columns]
+            )
+            rows = connection.execute(
+                f"WITH intervals AS (SELECT timestamp / {interval_ms} * {interval_ms} AS interval_start, "
+                f"{', '.join(['MAX(timestamp) AS last_timestamp'] + aggregates)} "
+                f"FROM samples{where} GROUP BY interval_start) "
+                f"SELECT {', '.join(columns)} FROM intervals "
+                "JOIN samples ON samples.timestamp = intervals.last_timestamp "
+                "ORDER BY intervals.interval_start",
+                parameters,
+            ).fetchall()
+
+        if not rows:
+            return None
+        schema = pa.schema(
+            [schema.field("timestamp")] + fields + [schema.field(name) for name in last_columns]
+        )
+        table = _rows_to_table(rows, schema)
+
+        # same column order as the measurements, followed by the aggregates
+        return table.select(
+            [name for name in names if name in table.column_names]
+            + [field.name for field in fields if field.name not in names]
+        )
+
+    def get_compression_ratios(self):
+        """
+        Returns the compression ratios like SegmentArchive, the database always stores every sample.
+        """
+        return {}
+
+    def clear(self):
+        """
+        Deletes all data of the session.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _rows_to_table(rows, schema):
+    """
+    Converts rows returned by SQLite into an Arrow table, NULL values of float columns become NaN.
+    """
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        array = pa.array(values, type=field.type)
+        if pa.types.is_floating(field.type) and array.null_count > 0:
+            array = array.fill_null(float("nan"))
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=schema)